@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+""" Compares the CPU time and throughput of writing a streamed download to
+    disk with the original 1 KiB iter_content loop, an iter_content loop at
+    each large buffer size, and the large buffer readinto write path of
+    PureAPI.download_file.
+
+    The file is served from a separate process so that only the client's
+    CPU time is measured, e.g.:
+
+        python benchmarks/bench_download_write.py --size-mb 512
+"""
+import argparse
+import http.server
+import multiprocessing
+import os
+import socketserver
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                    'pure_adaptor'))
+
+from pure.v59.api import PureAPI  # noqa: E402
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                          http.server.HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, size):
+    """ Serves size bytes of random data for any GET request.
+        """
+    payload = memoryview(os.urandom(size))
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def send_payload_headers(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+
+        def do_HEAD(self):
+            self.send_payload_headers()
+
+        def do_GET(self):
+            self.send_payload_headers()
+            for start in range(0, size, 1024 * 1024):
+                self.wfile.write(payload[start:start + 1024 * 1024])
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+def iter_content_download(url, dest, chunk_size=1024):
+    """ The download loop used before the readinto write path, which
+        allocates a bytes object for every chunk.
+        """
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(dest, 'wb', buffering=0) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+
+def measure(name, download, size):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    download()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    gib = size / 1024 ** 3
+    print('{:<28} {:>8.3f} CPU s/GiB {:>10.1f} MiB/s'.format(
+        name, cpu / gib, size / 1024 ** 2 / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--buffer-sizes', type=int, nargs='+',
+                        default=[256 * 1024, 1024 * 1024, 8 * 1024 * 1024])
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    server = multiprocessing.Process(target=serve, args=(args.port, size),
+                                     daemon=True)
+    server.start()
+    url = 'http://127.0.0.1:{}/a_file.dat'.format(args.port)
+    for _ in range(50):
+        try:
+            requests.head(url)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dest = os.path.join(temp_dir, 'a_file.dat')
+        measure('iter_content 1 KiB',
+                lambda: iter_content_download(url, dest), size)
+        for buffer_size in args.buffer_sizes:
+            measure('iter_content {} KiB'.format(buffer_size // 1024),
+                    lambda: iter_content_download(url, dest, buffer_size),
+                    size)
+            for preallocate in (False, True):
+                api = PureAPI(url, 'an_api_key', max_attempts=1,
+                              download_buffer_size=buffer_size,
+                              preallocate_downloads=preallocate)
+                measure('readinto {} KiB{}'.format(
+                    buffer_size // 1024, ' prealloc' if preallocate else ''),
+                    lambda: api.download_file(url, dest), size)
+                api.close()
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
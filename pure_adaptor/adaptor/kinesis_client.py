@@ -8,6 +8,12 @@ import json
 class KinesisClient(object):
     """Client for managing kinesis messages."""
 
+    # Limits on the records sent in a single PutRecords request.
+    MAX_BATCH_RECORDS = 500
+    MAX_BATCH_BYTES = 5 * 1024 * 1024
+    # Bytes allowed for the partition key of each record in a batch.
+    PARTITION_KEY_BYTES = 32
+
     def __init__(self, input_stream_name, invalid_stream_name,
                  error_stream_name):
         self.input_stream_name = input_stream_name
@@ -16,6 +22,7 @@ class KinesisClient(object):
         self.logger = logging.getLogger()
         self.logger.setLevel(logging.INFO)
         self.client = boto3.client('kinesis')
+        self._buffer = []
 
     def put_record(self, message):
         """ Take a message and attempt to put in into the input stream.
@@ -28,6 +35,122 @@ class KinesisClient(object):
         else:
             self.__put_record(self.input_stream_name, message.as_json)
 
+    def buffer_record(self, message):
+        """ Take a message and buffer it to be put into the input stream by
+            the next flush. Invalid messages are placed into the invalid
+            stream straight away.
+            :message: RDSSMessage
+            """
+        if not message.is_valid:
+            self.__move_to_invalid_stream(message.as_json)
+        else:
+            self._buffer.append(message.as_json)
+
+    def flush(self):
+        """ Put the buffered messages into the input stream, with as few
+            PutRecords requests as the request limits allow.
+            """
+        payloads, self._buffer = self._buffer, []
+        for batch in self.__batches(payloads):
+            self.__put_records(self.input_stream_name, batch)
+
+    def __batches(self, payloads):
+        """ Split payloads into batches within the record count and size
+            limits of a PutRecords request.
+            """
+        batch = []
+        batch_bytes = 0
+        for payload in payloads:
+            payload_bytes = len(payload.encode('utf-8')) + \
+                self.PARTITION_KEY_BYTES
+            if batch and (len(batch) == self.MAX_BATCH_RECORDS or
+                          batch_bytes + payload_bytes >
+                          self.MAX_BATCH_BYTES):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(payload)
+            batch_bytes += payload_bytes
+        if batch:
+            yield batch
+
+    def __put_records(self, stream_name, payloads):
+        """Attempt to put the payloads in the provided stream name, retrying
+        only those that fail."""
+        max_attempts = 6
+        attempt = 1
+
+        while attempt <= max_attempts:
+            payloads = self.__do_put_records(stream_name, payloads, attempt)
+            if not payloads:
+                return
+            sleep_seconds = pow(2, attempt) / 10
+            self.logger.info(
+                'Backing off for [%s] seconds before retrying [%s] payloads '
+                'after attempt [%s]/[%s]',
+                sleep_seconds,
+                len(payloads),
+                attempt,
+                max_attempts
+            )
+            time.sleep(sleep_seconds)
+            attempt += 1
+
+        for payload in payloads:
+            self.logger.error(
+                'Unable to add payload [%s] to Kinesis Stream [%s] - maximum '
+                'retries exceeded',
+                payload,
+                stream_name
+            )
+            self.move_to_error_stream(
+                payload,
+                'GENERR005',
+                'Maximum retry attempts [%s] exceed for stream [%s]' % (
+                    max_attempts,
+                    stream_name
+                )
+            )
+
+    def __do_put_records(self, stream_name, payloads, attempt):
+        """Put the payloads in the provided stream, returning those that
+        failed."""
+        self.logger.info(
+            'Executing attempt [%s] at adding [%s] payloads to stream [%s]',
+            attempt,
+            len(payloads),
+            stream_name
+        )
+
+        partition_key = int(time.time() * 1000)
+        try:
+            response = self.client.put_records(
+                StreamName=stream_name,
+                Records=[{'Data': payload,
+                          'PartitionKey': str(partition_key + index)}
+                         for index, payload in enumerate(payloads)]
+            )
+        except botocore.exceptions.ClientError as ce:
+            self.logger.exception('Exception: [%s]', ce)
+            self.logger.exception(
+                'An error occured adding [%s] payloads to stream [%s]',
+                len(payloads),
+                stream_name
+            )
+            return payloads
+
+        failed = [payload for payload, record in
+                  zip(payloads, response['Records'])
+                  if record.get('ErrorCode')]
+        if failed:
+            self.logger.warning(
+                'Failed to add [%s] of [%s] payloads to stream [%s]',
+                len(failed),
+                len(payloads),
+                stream_name
+            )
+        return failed
+
     def __put_record(self, stream_name, payload):
         """Attempt to put the payload in the provided stream name."""
         max_attempts = 6
@@ -1,73 +1,532 @@
-import boto3
-import os
-import json
-import io
-import urllib
-import logging
-from botocore.exceptions import ClientError
-
-logger = logging.getLogger(__name__)
-
-
-class BucketUploader(object):
-
-    def __init__(self, bucket_name, top_level_prefix=None):
-        """ Initialises a BucketUploader instance with the name of the bucket
-            being uploaded to, ensuring that the bucket is accessible.
-            :bucket_name: String
-            :top_level_prefix: String
-            """
-        self._bucket_name = bucket_name
-        self._top_level_prefix = top_level_prefix
-        try:
-            s3 = boto3.resource('s3')
-            self.bucket = s3.Bucket(self._bucket_name)
-            self.bucket.load()
-            logging.info('Successfully initialised connection to '
-                         's3 bucket %s', self.bucket.name)
-        except ClientError as e:
-            logging.exception('s3 Bucket initialisation: %s', e)
-
-    def _build_key(self, prefix, file_name):
-        """ Builds a full key for file upload to the s3 bucket, using the
-            uploader's additional top_level_prefix if provided.
-            :prefix: String
-            :file_name: String
-            :returns: String
-            """
-        if self._top_level_prefix:
-            return os.path.join(
-                self._top_level_prefix,
-                prefix,
-                os.path.basename(file_name)
-            )
-        else:
-            return os.path.join(
-                prefix,
-                os.path.basename(file_name)
-            )
-
-    def _s3_url(self, key):
-        """ Builds and returns an s3 url for the provided key in this
-            bucket, using the "s3://" scheme.
-            """
-        url_tuple = ('s3', self._bucket_name, key, '', '')
-        return urllib.parse.urlunsplit(url_tuple)
-
-    def upload_file(self, prefix, source_file):
-        """ Attempts to upload the provided file to the s3 bucket.
-            """
-        key = self._build_key(prefix, source_file)
-        logger.info('Uploading %s to %s.', source_file, key)
-        with open(source_file, 'rb') as data:
-            self.bucket.upload_fileobj(data, key)
-        return self._s3_url(key)
-
-    def upload_json_obj(self, prefix, file_name, json_obj):
-        """ Attempts to upload a json object to the s3 bucket.
-            """
-        key = self._build_key(prefix, file_name)
-        logger.info('Uploading json object to %s.', key)
-        json_data = io.BytesIO(json.dumps(json_obj, indent=2).encode('utf-8'))
-        self.bucket.upload_fileobj(json_data, key)
-        return self._s3_url(key)
+import base64
+import boto3
+import concurrent.futures
+import hashlib
+import inspect
+import itertools
+import threading
+import os
+import json
+import io
+import urllib
+import logging
+import zlib
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Only later versions of boto3 than the one pinned can cap bandwidth.
+SUPPORTS_MAX_BANDWIDTH = \
+    'max_bandwidth' in inspect.signature(TransferConfig).parameters
+
+
+class ChunkReader(io.RawIOBase):
+
+    """ A readable, unseekable file object over an iterable of chunks of
+        bytes, so that bytes can be uploaded as they are produced."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            self._chunk = next(self._chunks, None)
+            if self._chunk is None:
+                self._chunk = b''
+                return 0
+        bytes_read = min(len(buffer), len(self._chunk))
+        buffer[:bytes_read] = self._chunk[:bytes_read]
+        self._chunk = self._chunk[bytes_read:]
+        return bytes_read
+
+
+class BucketUploader(object):
+
+    # S3 allows at most 10,000 parts of up to 5 GiB in a multipart upload.
+    # The parts of a streamed upload, whose size is not known in advance,
+    # double in size every PARTS_PER_SIZE parts to stay within the limit.
+    MAX_PART_SIZE = 5 * 1024 ** 3
+    PARTS_PER_SIZE = 1000
+
+    def __init__(self, bucket_name, top_level_prefix=None,
+                 part_size=8 * 1024 * 1024, max_part_buffers=4,
+                 multipart_threshold=8 * 1024 * 1024, max_concurrency=10,
+                 max_bandwidth=None, size_classes=(), workers=4,
+                 skip_unchanged=False, json_compact=False, json_gzip=False,
+                 json_stream=False):
+        """ Initialises a BucketUploader instance with the name of the bucket
+            being uploaded to, ensuring that the bucket is accessible.
+            :bucket_name: String
+            :top_level_prefix: String
+            :part_size: Int: Bytes in each part of a multipart upload, at
+                least 5 MiB
+            :max_part_buffers: Int: Parts of a streamed upload held in memory
+                and uploaded concurrently, at least 2
+            :multipart_threshold: Int: Files of at least this many bytes are
+                sent as multipart uploads
+            :max_concurrency: Int: Parts of a file uploaded concurrently
+            :max_bandwidth: Int: Bytes per second each file is uploaded at,
+                or None for no limit. Raises ValueError if set with a boto3
+                that cannot cap bandwidth.
+            :size_classes: [(Int, dict)]: Transfer options overriding the
+                above for files of at least the given number of bytes
+            :workers: Int: Files uploaded concurrently by upload_files
+            :skip_unchanged: Boolean: Skip uploading files identical to the
+                objects already listed by existing_objects
+            :json_compact: Boolean: Serialise json objects without
+                indentation or whitespace between items
+            :json_gzip: Boolean: Store json objects gzip compressed, with a
+                gzip Content-Encoding
+            :json_stream: Boolean: Upload json objects as they are
+                serialised, rather than serialising them in memory first
+            """
+        self._bucket_name = bucket_name
+        self._top_level_prefix = top_level_prefix
+        self._part_size = part_size
+        self._max_part_buffers = max(max_part_buffers, 2)
+        self._workers = workers
+        self._skip_unchanged = skip_unchanged
+        self._json_encoder = json.JSONEncoder(
+            indent=None if json_compact else 2,
+            separators=(',', ':') if json_compact else None)
+        self._json_gzip = json_gzip
+        self._json_stream = json_stream
+        default_options = {
+            'multipart_threshold': multipart_threshold,
+            'part_size': part_size,
+            'max_concurrency': max_concurrency,
+            'max_bandwidth': max_bandwidth,
+        }
+        self._transfer_configs = sorted(
+            [(0, self._transfer_config(**default_options))] +
+            [(min_bytes, self._transfer_config(**{**default_options,
+                                                  **options}))
+             for min_bytes, options in size_classes],
+            key=lambda size_class: size_class[0])
+        try:
+            s3 = boto3.resource('s3')
+            self.bucket = s3.Bucket(self._bucket_name)
+            self.bucket.load()
+            logging.info('Successfully initialised connection to '
+                         's3 bucket %s', self.bucket.name)
+        except ClientError as e:
+            logging.exception('s3 Bucket initialisation: %s', e)
+
+    @staticmethod
+    def _transfer_config(multipart_threshold, part_size, max_concurrency,
+                         max_bandwidth):
+        options = {
+            'multipart_threshold': multipart_threshold,
+            'multipart_chunksize': part_size,
+            'max_concurrency': max_concurrency,
+        }
+        if max_bandwidth:
+            if not SUPPORTS_MAX_BANDWIDTH:
+                raise ValueError(
+                    'max_bandwidth is not supported by boto3 {}'.format(
+                        boto3.__version__))
+            options['max_bandwidth'] = max_bandwidth
+        return TransferConfig(**options)
+
+    def transfer_config(self, size):
+        """ The transfer configuration of the largest size class that a file
+            of the given number of bytes falls in.
+            :returns: TransferConfig
+            """
+        for min_bytes, config in reversed(self._transfer_configs):
+            if size >= min_bytes:
+                return config
+
+    def _build_key(self, prefix, file_name):
+        """ Builds a full key for file upload to the s3 bucket, using the
+            uploader's additional top_level_prefix if provided.
+            :prefix: String
+            :file_name: String
+            :returns: String
+            """
+        if self._top_level_prefix:
+            return os.path.join(
+                self._top_level_prefix,
+                prefix,
+                os.path.basename(file_name)
+            )
+        else:
+            return os.path.join(
+                prefix,
+                os.path.basename(file_name)
+            )
+
+    def _s3_url(self, key):
+        """ Builds and returns an s3 url for the provided key in this
+            bucket, using the "s3://" scheme.
+            """
+        url_tuple = ('s3', self._bucket_name, key, '', '')
+        return urllib.parse.urlunsplit(url_tuple)
+
+    def object_key(self, prefix, file_name):
+        """ The key a file is uploaded to.
+            :returns: String
+            """
+        return self._build_key(prefix, file_name)
+
+    def s3_url(self, prefix, file_name):
+        """ The s3 url a file is uploaded to, known before it is uploaded.
+            :returns: String
+            """
+        return self._s3_url(self._build_key(prefix, file_name))
+
+    def existing_objects(self, prefix):
+        """ Lists the objects already uploaded under a prefix, so that
+            unchanged files can be skipped without a request per file.
+            Returns None if unchanged files are not skipped.
+            :returns: {String: dict}: ListObjectsV2 entries by key
+            """
+        if not self._skip_unchanged:
+            return None
+        paginator = self.bucket.meta.client.get_paginator('list_objects_v2')
+        return {obj['Key']: obj
+                for page in paginator.paginate(
+                    Bucket=self._bucket_name,
+                    Prefix=self._build_key(prefix, ''))
+                for obj in page.get('Contents', [])}
+
+    def _unchanged(self, key, size, digests, existing):
+        """ Whether the object at key is identical to a file of the given
+            size and digests. The ETag of an object uploaded in a single
+            request is its md5 digest. That of a multipart upload is not,
+            so its sha256 metadata is fetched instead.
+            :existing: {String: dict}: As returned by existing_objects
+            :returns: Boolean
+            """
+        obj = (existing or {}).get(key)
+        if not obj or obj['Size'] != size or not digests:
+            return False
+        etag = obj['ETag'].strip('"')
+        if '-' not in etag and digests.get('md5'):
+            return etag == digests['md5']
+        if not digests.get('sha256'):
+            return False
+        metadata = self.bucket.meta.client.head_object(
+            Bucket=self._bucket_name, Key=key)['Metadata']
+        return metadata.get('sha256') == digests['sha256']
+
+    def upload_file(self, prefix, source_file, digests=None, existing=None):
+        """ Attempts to upload the provided file to the s3 bucket, with the
+            transfer configuration of its size class. A file small enough to
+            upload in a single request is sent with the md5 digest already
+            computed of it as its Content-MD5, rather than boto hashing it
+            again. The sha256 digest is stored in the object's metadata. The
+            upload is skipped if the object already in the bucket is
+            identical.
+            :digests: {String: String}: Hex digests of the file by algorithm
+            :existing: {String: dict}: As returned by existing_objects
+            """
+        key = self._build_key(prefix, source_file)
+        digests = digests or {}
+        md5 = digests.get('md5')
+        extra_args = {}
+        if digests.get('sha256'):
+            extra_args['Metadata'] = {'sha256': digests['sha256']}
+        with open(source_file, 'rb') as data:
+            size = os.fstat(data.fileno()).st_size
+            if self._unchanged(key, size, digests, existing):
+                logger.info('Skipping unchanged upload of %s to %s.',
+                            source_file, key)
+                return self._s3_url(key)
+            logger.info('Uploading %s to %s.', source_file, key)
+            config = self.transfer_config(size)
+            client = self.bucket.meta.client
+            if md5 and size < config.multipart_threshold:
+                client.put_object(
+                    Bucket=self._bucket_name, Key=key, Body=data,
+                    ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode(),
+                    **extra_args)
+            else:
+                client.upload_fileobj(data, self._bucket_name, key,
+                                      ExtraArgs=extra_args, Config=config)
+        return self._s3_url(key)
+
+    def copy_file(self, source_key, prefix, source_file, digests,
+                  existing=None):
+        """ Copies an object already in the bucket with the same sha256
+            digest as a file to the file's key, server side, rather than
+            uploading the file. The file is uploaded instead if the object
+            no longer exists or has since been replaced, as shown by its
+            sha256 metadata.
+            :source_key: String
+            :digests: {String: String}: Hex digests of the file by algorithm,
+                including sha256
+            :existing: {String: dict}: As returned by existing_objects
+            """
+        key = self._build_key(prefix, source_file)
+        size = os.path.getsize(source_file)
+        if self._unchanged(key, size, digests, existing):
+            logger.info('Skipping unchanged copy of %s to %s.', source_key,
+                        key)
+            return self._s3_url(key)
+        client = self.bucket.meta.client
+        try:
+            metadata = client.head_object(
+                Bucket=self._bucket_name, Key=source_key)['Metadata']
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            metadata = {}
+        if metadata.get('sha256') != digests['sha256']:
+            logger.warning('%s no longer holds a copy of %s, uploading it.',
+                           source_key, source_file)
+            return self.upload_file(prefix, source_file, digests, existing)
+        logger.info('Copying %s to %s.', source_key, key)
+        client.copy({'Bucket': self._bucket_name, 'Key': source_key},
+                    self._bucket_name, key, Config=self.transfer_config(size))
+        return self._s3_url(key)
+
+    def upload_files(self, files):
+        """ Uploads many files concurrently, up to workers at a time.
+            :files: iterable(tuple): The prefix, source file and
+                optionally the digests and existing objects of each file, as
+                passed to upload_file
+            :returns: [String]: s3 urls of the files, in the order given
+            """
+        return self.upload_all((self.upload_file, args) for args in files)
+
+    def upload_all(self, uploads):
+        """ Runs many uploads concurrently, up to workers at a time, as a
+            whole. If any upload fails, those not yet started are cancelled
+            and its error is raised once those already running finish. The
+            upload methods send requests through the bucket's client, which
+            unlike the bucket resource is safe to share between threads.
+            :uploads: iterable((function, tuple)): Upload methods of this
+                uploader and the arguments to call them with
+            :returns: [String]: s3 urls of the uploads, in the order given
+            """
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers) as executor:
+            futures = [executor.submit(upload, *args)
+                       for upload, args in uploads]
+            done, not_done = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in futures:
+                if future in done and future.exception():
+                    raise future.exception()
+            return [future.result() for future in futures]
+
+    def _streamed_part_size(self, number):
+        """ The size of a part of a streamed upload, which doubles every
+            PARTS_PER_SIZE parts so that a file of up to the 5 TiB S3 limit
+            fits in 10,000 parts of at least 5 MiB.
+            :number: Int: Part number, from 1
+            :returns: Int
+            """
+        return min(self._part_size * 2 ** ((number - 1) //
+                                           self.PARTS_PER_SIZE),
+                   self.MAX_PART_SIZE)
+
+    def _parts(self, chunks):
+        """ Gathers an iterable of chunks of bytes into parts of the
+            streamed part size, the last of which may be smaller. Only the
+            part being gathered is buffered, so a part is not read until the
+            generator is advanced.
+            :chunks: iterator(bytes)
+            :returns: generator(bytes)
+            """
+        buffer = bytearray()
+        for number in itertools.count(1):
+            part_size = self._streamed_part_size(number)
+            while len(buffer) < part_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                buffer += chunk
+            if not buffer:
+                return
+            with memoryview(buffer) as view:
+                part = bytes(view[:part_size])
+            del buffer[:part_size]
+            yield part
+
+    def upload_stream(self, prefix, file_name, chunks):
+        """ Uploads a file from an iterable of chunks of its bytes without
+            writing it to disk. A file larger than a part is sent as a
+            multipart upload, uploading parts concurrently while holding at
+            most max_part_buffers parts in memory, besides the part being
+            gathered from the chunks. The multipart upload is aborted if
+            reading or uploading any part fails.
+            :chunks: iterable(bytes)
+            :returns: String: s3 url of the file
+            """
+        key = self._build_key(prefix, file_name)
+        logger.info('Streaming upload to %s.', key)
+        parts = self._parts(iter(chunks))
+        first_parts = list(itertools.islice(parts, 2))
+        if len(first_parts) < 2:
+            self.bucket.meta.client.put_object(
+                Bucket=self._bucket_name, Key=key,
+                Body=b''.join(first_parts))
+            return self._s3_url(key)
+
+        client = self.bucket.meta.client
+        upload_id = client.create_multipart_upload(
+            Bucket=self._bucket_name, Key=key)['UploadId']
+        try:
+            etags = self._upload_parts(
+                key, upload_id, self._chain_parts(first_parts, parts))
+            client.complete_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': [
+                    {'ETag': etag, 'PartNumber': number}
+                    for number, etag in enumerate(etags, 1)]})
+        except BaseException:
+            logger.warning('Aborting streamed upload to %s.', key)
+            client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id)
+            raise
+        return self._s3_url(key)
+
+    @staticmethod
+    def _chain_parts(first_parts, parts):
+        """ Yields the parts already read, then the rest of parts, without
+            keeping a reference to a part once it has been yielded.
+            :first_parts: [bytes]: Emptied as it is yielded
+            :returns: generator(bytes)
+            """
+        while first_parts:
+            yield first_parts.pop(0)
+        yield from parts
+
+    def _upload_parts(self, key, upload_id, parts):
+        """ Uploads the parts of a multipart upload concurrently, waiting to
+            read each part until there is a free buffer for it.
+            :parts: iterator(bytes): Read lazily
+            :returns: [String]: ETags of the parts in order
+            """
+        client = self.bucket.meta.client
+        free_buffers = threading.BoundedSemaphore(self._max_part_buffers)
+
+        def upload_part(number, part):
+            try:
+                return client.upload_part(
+                    Bucket=self._bucket_name, Key=key, UploadId=upload_id,
+                    PartNumber=number, Body=part)['ETag']
+            finally:
+                free_buffers.release()
+
+        futures = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_part_buffers) as executor:
+            try:
+                for number in itertools.count(1):
+                    free_buffers.acquire()
+                    part = None
+                    if not any(f.done() and f.exception() for f in futures):
+                        part = next(parts, None)
+                    if part is None:
+                        free_buffers.release()
+                        break
+                    futures.append(
+                        executor.submit(upload_part, number, part))
+                    del part
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            return [future.result() for future in futures]
+
+    def _compressed(self, chunks):
+        """ Gzip compresses chunks of bytes if configured. Compressed objects
+            carry no timestamp, so that an unchanged object is compressed to
+            the same bytes.
+            :returns: generator(bytes)
+            """
+        if not self._json_gzip:
+            yield from chunks
+            return
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def _json_chunks(self, json_obj):
+        """ Serialises a json object in chunks of bytes, gzip compressed if
+            configured.
+            :returns: generator(bytes)
+            """
+        return self._compressed(
+            chunk.encode('utf-8')
+            for chunk in self._json_encoder.iterencode(json_obj))
+
+    def upload_json_obj(self, prefix, file_name, json_obj, existing=None):
+        """ Attempts to upload a json object to the s3 bucket, skipping the
+            upload if the object already in the bucket is identical. A
+            streamed object is only serialised in advance to compare it
+            with the existing object, hashing it without keeping it in
+            memory.
+            :existing: {String: dict}: As returned by existing_objects
+            """
+        return self._upload_json(
+            prefix, file_name, lambda: self._json_chunks(json_obj),
+            self._json_stream, existing)
+
+    def upload_json_bytes(self, prefix, file_name, json_bytes,
+                          existing=None):
+        """ Uploads json that has already been serialised, e.g. a response
+            body from Pure, unchanged but for gzip compression if
+            configured. The upload is skipped if the object already in the
+            bucket is identical.
+            :json_bytes: bytes
+            :existing: {String: dict}: As returned by existing_objects
+            """
+        return self._upload_json(
+            prefix, file_name, lambda: self._compressed([json_bytes]),
+            False, existing)
+
+    def _upload_json(self, prefix, file_name, json_chunks, stream, existing):
+        """ Uploads json with a json content type.
+            :json_chunks: Function returning an iterable of the bytes to
+                upload, called again for each pass over them
+            :stream: Boolean: Upload the chunks as they are produced rather
+                than joining them in memory first
+            """
+        key = self._build_key(prefix, file_name)
+        extra_args = {'ContentType': 'application/json'}
+        if self._json_gzip:
+            extra_args['ContentEncoding'] = 'gzip'
+        json_bytes = None
+        if not stream:
+            json_bytes = b''.join(json_chunks())
+        if existing is not None:
+            hashers = {'md5': hashlib.md5(), 'sha256': hashlib.sha256()}
+            size = 0
+            for chunk in ([json_bytes] if json_bytes is not None
+                          else json_chunks()):
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+                size += len(chunk)
+            digests = {algorithm: hasher.hexdigest()
+                       for algorithm, hasher in hashers.items()}
+            if self._unchanged(key, size, digests, existing):
+                logger.info('Skipping unchanged upload of json object to '
+                            '%s.', key)
+                return self._s3_url(key)
+            extra_args['Metadata'] = {'sha256': digests['sha256']}
+        elif json_bytes is not None:
+            extra_args['Metadata'] = {
+                'sha256': hashlib.sha256(json_bytes).hexdigest()}
+        logger.info('Uploading json object to %s.', key)
+        if json_bytes is not None:
+            json_data = io.BytesIO(json_bytes)
+        else:
+            json_data = io.BufferedReader(ChunkReader(json_chunks()),
+                                          buffer_size=1024 * 1024)
+        self.bucket.meta.client.upload_fileobj(
+            json_data, self._bucket_name, key, ExtraArgs=extra_args)
+        return self._s3_url(key)
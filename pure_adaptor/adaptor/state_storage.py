@@ -9,6 +9,7 @@ logger = logging.getLogger(__name__)
 
 class AdaptorStateStore(object):
     LATEST_TAG = 'LATEST'
+    FILE_LOCATION_TAG = 'sha256:{}'
 
     def __init__(self, table_name):
         """ Initialises the AdaptorStateStore with the name of the dynamodb
@@ -74,6 +75,37 @@ class AdaptorStateStore(object):
             logging.exception('AdaptorStateStore latest_modified_datetime \
                     failure.')
 
+    def get_file_location(self, digest):
+        """ Retrieves the s3 key of a file already uploaded by the adaptor
+            with the given sha256 digest, so that a copy of the file in
+            another dataset need not be uploaded again.
+            :digest: String
+            :returns: String, or None if no such file has been uploaded
+            """
+        try:
+            response = self.table.get_item(
+                Key={'uuid': self.FILE_LOCATION_TAG.format(digest)},
+                ProjectionExpression='s3_key',
+            )
+            return response.get('Item', {}).get('s3_key')
+        except ClientError:
+            logging.exception('AdaptorStateStore get_file_location failure.')
+            return None
+
+    def put_file_location(self, digest, s3_key):
+        """ Records the s3 key of an uploaded file with the given sha256
+            digest, overwriting any key previously recorded for it.
+            :digest: String
+            :s3_key: String
+            """
+        try:
+            self.table.put_item(Item={
+                'uuid': self.FILE_LOCATION_TAG.format(digest),
+                's3_key': s3_key,
+            })
+        except ClientError:
+            logging.exception('AdaptorStateStore put_file_location failure.')
+
     def update_latest_modified(self, dataset_state):
         """ Sets the provided DatasetState as the most recently modified dataset
             in the state store.
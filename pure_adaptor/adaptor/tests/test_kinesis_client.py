@@ -0,0 +1,88 @@
+import boto3
+import json
+import moto
+from collections import namedtuple
+
+from ..kinesis_client import KinesisClient
+
+Message = namedtuple('Message', ['is_valid', 'as_json'])
+
+
+def message(index):
+    return Message(True, json.dumps({'messageHeader': {'id': index}}))
+
+
+class TestKinesisClient(object):
+
+    def setup(self):
+        self.mock = moto.mock_kinesis()
+        self.mock.start()
+        self.kinesis = boto3.client('kinesis')
+        for stream_name in ('input', 'invalid', 'error'):
+            self.kinesis.create_stream(StreamName=stream_name, ShardCount=1)
+        self.client = KinesisClient('input', 'invalid', 'error')
+
+    def read_stream(self, stream_name):
+        shard_id = self.kinesis.describe_stream(StreamName=stream_name)[
+            'StreamDescription']['Shards'][0]['ShardId']
+        iterator = self.kinesis.get_shard_iterator(
+            StreamName=stream_name, ShardId=shard_id,
+            ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+        records = self.kinesis.get_records(ShardIterator=iterator)['Records']
+        return [json.loads(record['Data'].decode()) for record in records]
+
+    def test_flush(self, monkeypatch):
+        monkeypatch.setattr(KinesisClient, 'MAX_BATCH_RECORDS', 2)
+        requests = []
+        put_records = self.client.client.put_records
+        monkeypatch.setattr(
+            self.client.client, 'put_records',
+            lambda **kwargs: requests.append(kwargs) or put_records(**kwargs))
+        for index in range(5):
+            self.client.buffer_record(message(index))
+        assert self.read_stream('input') == []
+        self.client.flush()
+        assert [len(r['Records']) for r in requests] == [2, 2, 1]
+        assert self.read_stream('input') == [
+            {'messageHeader': {'id': index}} for index in range(5)]
+
+    def test_flush_batch_bytes(self, monkeypatch):
+        monkeypatch.setattr(KinesisClient, 'MAX_BATCH_BYTES', 100)
+        requests = []
+        monkeypatch.setattr(
+            self.client.client, 'put_records',
+            lambda **kwargs: requests.append(kwargs) or {'Records': [
+                {} for _ in kwargs['Records']]})
+        for index in range(3):
+            self.client.buffer_record(message(index))
+        self.client.flush()
+        assert [len(r['Records']) for r in requests] == [1, 1, 1]
+
+    def test_flush_retries_failed_records(self, monkeypatch):
+        """ Only the records that failed in a request are retried, until
+            they are moved to the error stream.
+            """
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        requests = []
+
+        def put_records(**kwargs):
+            requests.append([json.loads(r['Data'])['messageHeader']['id']
+                             for r in kwargs['Records']])
+            return {'Records': [
+                {'ErrorCode': 'ProvisionedThroughputExceededException'}
+                if json.loads(r['Data'])['messageHeader']['id'] == 1 or (
+                    len(requests) == 1 and index == 0) else {}
+                for index, r in enumerate(kwargs['Records'])]}
+
+        monkeypatch.setattr(self.client.client, 'put_records', put_records)
+        for index in range(3):
+            self.client.buffer_record(message(index))
+        self.client.flush()
+        assert requests == [[0, 1, 2], [0, 1]] + [[1]] * 4
+        error_messages = self.read_stream('error')
+        assert len(error_messages) == 1
+        assert error_messages[0]['messageHeader']['id'] == 1
+        assert error_messages[0]['messageHeader']['errorCode'] == 'GENERR005'
+
+    def teardown(self):
+        self.mock.stop()
@@ -1,4 +1,7 @@
+import base64
 import boto3
+import gzip
+import hashlib
 import moto
 import pytest
 import tempfile
@@ -6,6 +9,7 @@ import json
 import os
 import io
 
+from .. import s3_bucket
 from ..s3_bucket import BucketUploader
 
 
@@ -48,6 +52,317 @@ class TestBucketUploader(object):
 
         assert dl_data == orig_data
 
+    def test_file_upload_content_md5(self, test_file_path, monkeypatch):
+        """ The md5 digest of a file is sent as its Content-MD5.
+            """
+        with open(test_file_path, 'rb') as f_in:
+            md5 = hashlib.md5(f_in.read()).hexdigest()
+        uploader = BucketUploader(self.bucket_name)
+        put_calls = []
+        client = uploader.bucket.meta.client
+        put_object = client.put_object
+        monkeypatch.setattr(
+            client, 'put_object',
+            lambda **kwargs: put_calls.append(kwargs) or put_object(**kwargs))
+        uploader.upload_file(self.test_prefix, test_file_path,
+                             {'md5': md5, 'sha256': 'a_sha256'})
+
+        assert put_calls[0]['ContentMD5'] == \
+            base64.b64encode(bytes.fromhex(md5)).decode()
+        s3_obj = self.s3_client.head_object(
+            Bucket=self.bucket_name,
+            Key=os.path.join(self.test_prefix,
+                             os.path.basename(test_file_path)))
+        assert s3_obj['ETag'] == '"{}"'.format(md5)
+
+    def test_upload_files(self, tmpdir):
+        file_paths = []
+        for i in range(6):
+            file_path = tmpdir.join('file_{}.txt'.format(i))
+            file_path.write('file {}'.format(i))
+            file_paths.append(str(file_path))
+        uploader = BucketUploader(self.bucket_name, workers=3)
+        s3_urls = uploader.upload_files(
+            (self.test_prefix, file_path) for file_path in file_paths)
+
+        assert s3_urls == [
+            's3://{}/{}/file_{}.txt'.format(self.bucket_name,
+                                            self.test_prefix, i)
+            for i in range(6)]
+        for i in range(6):
+            assert self.read_object('file_{}.txt'.format(i)) == \
+                'file {}'.format(i).encode()
+
+    def test_upload_all_fails_as_a_whole(self):
+        """ An upload failing cancels those not yet started.
+            """
+        uploader = BucketUploader(self.bucket_name, workers=1)
+        started = []
+
+        def failing_upload(name):
+            started.append(name)
+            raise IOError(name)
+
+        with pytest.raises(IOError):
+            uploader.upload_all([(failing_upload, ('first',)),
+                                 (failing_upload, ('second',)),
+                                 (failing_upload, ('third',))])
+        assert started == ['first']
+
+    def test_transfer_config_size_classes(self):
+        uploader = BucketUploader(
+            self.bucket_name, part_size=16 * 1024 * 1024, max_concurrency=4,
+            size_classes=[(1024 ** 3, {'part_size': 64 * 1024 * 1024,
+                                       'max_concurrency': 16})])
+        small = uploader.transfer_config(1024)
+        large = uploader.transfer_config(2 * 1024 ** 3)
+        assert (small.multipart_chunksize, small.max_concurrency) == \
+            (16 * 1024 * 1024, 4)
+        assert (large.multipart_chunksize, large.max_concurrency) == \
+            (64 * 1024 * 1024, 16)
+        assert small.multipart_threshold == large.multipart_threshold
+
+    def test_max_bandwidth_unsupported(self, monkeypatch):
+        """ A bandwidth cap is rejected with a clear error by a boto3 that
+            cannot apply it.
+            """
+        monkeypatch.setattr(s3_bucket, 'SUPPORTS_MAX_BANDWIDTH', False)
+        with pytest.raises(ValueError):
+            BucketUploader(self.bucket_name, max_bandwidth=1024 * 1024)
+
+    def count_uploads(self, uploader, monkeypatch):
+        """ Counts the uploads made through the client, which unlike the
+            bucket resource is safe to share between upload threads. The
+            requests the client makes within an upload_fileobj are not
+            counted again.
+            """
+        uploads = []
+        active = []
+        client = uploader.bucket.meta.client
+        for method in ('put_object', 'upload_fileobj'):
+            def counted(*args, _upload=getattr(client, method), **kwargs):
+                if not active:
+                    uploads.append(args or kwargs)
+                active.append(True)
+                try:
+                    return _upload(*args, **kwargs)
+                finally:
+                    active.pop()
+
+            def not_thread_safe(*args, **kwargs):
+                raise AssertionError('Uploaded through the bucket resource')
+            monkeypatch.setattr(client, method, counted)
+            monkeypatch.setattr(uploader.bucket, method, not_thread_safe)
+        return uploads
+
+    def test_upload_file_skip_unchanged(self, tmpdir, monkeypatch):
+        file_path = tmpdir.join('a_file.txt')
+        file_path.write(b'some content', mode='wb')
+        digests = {'md5': hashlib.md5(b'some content').hexdigest(),
+                   'sha256': hashlib.sha256(b'some content').hexdigest()}
+        uploader = BucketUploader(self.bucket_name, skip_unchanged=True)
+        uploads = self.count_uploads(uploader, monkeypatch)
+
+        uploader.upload_file(self.test_prefix, str(file_path), digests,
+                             uploader.existing_objects(self.test_prefix))
+        s3_url = uploader.upload_file(
+            self.test_prefix, str(file_path), digests,
+            uploader.existing_objects(self.test_prefix))
+        assert len(uploads) == 1
+        assert s3_url == 's3://{}/{}/a_file.txt'.format(self.bucket_name,
+                                                        self.test_prefix)
+
+        file_path.write(b'other content', mode='wb')
+        uploader.upload_file(
+            self.test_prefix, str(file_path),
+            {'md5': hashlib.md5(b'other content').hexdigest()},
+            uploader.existing_objects(self.test_prefix))
+        assert len(uploads) == 2
+        assert self.read_object('a_file.txt') == b'other content'
+
+    def test_upload_file_skip_unchanged_multipart(self, tmpdir,
+                                                  monkeypatch):
+        """ Multipart uploads are compared by the sha256 digest in their
+            metadata, as their ETag is not an md5 digest.
+            """
+        content = bytes(6 * 1024 * 1024)
+        file_path = tmpdir.join('a_file.dat')
+        file_path.write(content, mode='wb')
+        digests = {'md5': hashlib.md5(content).hexdigest(),
+                   'sha256': hashlib.sha256(content).hexdigest()}
+        uploader = BucketUploader(self.bucket_name, skip_unchanged=True,
+                                  multipart_threshold=5 * 1024 * 1024,
+                                  part_size=5 * 1024 * 1024)
+        uploads = self.count_uploads(uploader, monkeypatch)
+        for _ in range(2):
+            uploader.upload_file(self.test_prefix, str(file_path), digests,
+                                 uploader.existing_objects(self.test_prefix))
+        assert len(uploads) == 1
+
+    def test_upload_json_obj_skip_unchanged(self, test_json_obj,
+                                            monkeypatch):
+        uploader = BucketUploader(self.bucket_name, skip_unchanged=True)
+        uploads = self.count_uploads(uploader, monkeypatch)
+        for json_obj in (test_json_obj, test_json_obj, {'a': 'change'}):
+            uploader.upload_json_obj(
+                self.test_prefix, 'metadata.json', json_obj,
+                uploader.existing_objects(self.test_prefix))
+        assert len(uploads) == 2
+        assert json.loads(self.read_object('metadata.json').decode()) == \
+            {'a': 'change'}
+
+    def test_upload_json_obj_compact_gzip(self, test_json_obj):
+        uploader = BucketUploader(self.bucket_name, json_compact=True,
+                                  json_gzip=True)
+        uploader.upload_json_obj(self.test_prefix, 'metadata.json',
+                                 test_json_obj)
+        s3_obj = self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=os.path.join(self.test_prefix, 'metadata.json'))
+        assert s3_obj['ContentEncoding'] == 'gzip'
+        assert s3_obj['ContentType'] == 'application/json'
+        assert gzip.decompress(s3_obj['Body'].read()) == \
+            b'{"a":{"test":["JSON","object"]}}'
+
+    @pytest.mark.parametrize('json_gzip', [False, True])
+    def test_upload_json_obj_stream(self, monkeypatch, json_gzip):
+        """ A streamed json object is uploaded as the same bytes, and is
+            still skipped when unchanged.
+            """
+        json_obj = {'items': [{'value': i} for i in range(10000)]}
+        uploader = BucketUploader(self.bucket_name, json_gzip=json_gzip)
+        uploader.upload_json_obj(self.test_prefix, 'metadata.json',
+                                 json_obj)
+        expected = self.read_object('metadata.json')
+        self.s3_client.delete_object(
+            Bucket=self.bucket_name,
+            Key=os.path.join(self.test_prefix, 'metadata.json'))
+
+        uploader = BucketUploader(self.bucket_name, json_gzip=json_gzip,
+                                  json_stream=True, skip_unchanged=True)
+        uploads = self.count_uploads(uploader, monkeypatch)
+        for _ in range(2):
+            uploader.upload_json_obj(
+                self.test_prefix, 'metadata.json', json_obj,
+                uploader.existing_objects(self.test_prefix))
+        assert len(uploads) == 1
+        assert self.read_object('metadata.json') == expected
+
+    def test_copy_file(self, tmpdir, monkeypatch):
+        file_path = tmpdir.join('a_file.txt')
+        file_path.write(b'shared content', mode='wb')
+        digests = {'sha256': hashlib.sha256(b'shared content').hexdigest()}
+        uploader = BucketUploader(self.bucket_name)
+        uploader.upload_file('a/source', str(file_path), digests)
+        uploads = self.count_uploads(uploader, monkeypatch)
+
+        s3_url = uploader.copy_file('a/source/a_file.txt', self.test_prefix,
+                                    str(file_path), digests)
+        assert s3_url == 's3://{}/{}/a_file.txt'.format(self.bucket_name,
+                                                        self.test_prefix)
+        assert uploads == []
+        assert self.read_object('a_file.txt') == b'shared content'
+        assert self.s3_client.head_object(
+            Bucket=self.bucket_name,
+            Key=os.path.join(self.test_prefix, 'a_file.txt')
+        )['Metadata'] == {'sha256': digests['sha256']}
+
+    @pytest.mark.parametrize('source_content', [None, b'other content'])
+    def test_copy_file_source_changed(self, tmpdir, monkeypatch,
+                                      source_content):
+        """ A file is uploaded if its copy is missing or has been replaced.
+            """
+        if source_content:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name, Key='a/source/a_file.txt',
+                Body=source_content, Metadata={
+                    'sha256': hashlib.sha256(source_content).hexdigest()})
+        file_path = tmpdir.join('a_file.txt')
+        file_path.write(b'shared content', mode='wb')
+        digests = {'sha256': hashlib.sha256(b'shared content').hexdigest()}
+        uploader = BucketUploader(self.bucket_name)
+        uploads = self.count_uploads(uploader, monkeypatch)
+        uploader.copy_file('a/source/a_file.txt', self.test_prefix,
+                           str(file_path), digests)
+        assert len(uploads) == 1
+        assert self.read_object('a_file.txt') == b'shared content'
+
+    def test_existing_objects_not_skipped(self):
+        uploader = BucketUploader(self.bucket_name)
+        assert uploader.existing_objects(self.test_prefix) is None
+
+    def read_object(self, file_name):
+        return self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=os.path.join(self.test_prefix, file_name))['Body'].read()
+
+    def test_upload_stream(self):
+        uploader = BucketUploader(self.bucket_name)
+        s3_url = uploader.upload_stream(self.test_prefix, 'a_file.txt',
+                                        iter([b'a ', b'small ', b'file']))
+        assert s3_url == 's3://{}/{}/a_file.txt'.format(self.bucket_name,
+                                                        self.test_prefix)
+        assert self.read_object('a_file.txt') == b'a small file'
+
+    def test_upload_stream_multipart(self):
+        part_size = 5 * 1024 * 1024
+        content = os.urandom(2 * part_size + 1024)
+        chunks = (content[i:i + 1024 * 1024]
+                  for i in range(0, len(content), 1024 * 1024))
+        uploader = BucketUploader(self.bucket_name, part_size=part_size,
+                                  max_part_buffers=2)
+        uploader.upload_stream(self.test_prefix, 'a_file.dat', chunks)
+        assert self.read_object('a_file.dat') == content
+
+    def test_streamed_part_size_grows(self):
+        """ Streamed parts double in size every thousand parts, so that the
+            largest object S3 accepts fits in 10,000 parts.
+            """
+        uploader = BucketUploader(self.bucket_name,
+                                  part_size=8 * 1024 * 1024)
+        assert uploader._streamed_part_size(1000) == 8 * 1024 * 1024
+        assert uploader._streamed_part_size(1001) == 16 * 1024 * 1024
+        assert sum(uploader._streamed_part_size(number)
+                   for number in range(1, 10001)) >= 5 * 1024 ** 4
+        assert uploader._streamed_part_size(10000) <= 5 * 1024 ** 3
+
+    def test_parts_read_lazily(self):
+        """ A part is only read from the chunks once it is asked for.
+            """
+        uploader = BucketUploader(self.bucket_name, part_size=4)
+        read = []
+
+        def chunks():
+            for chunk in (b'ab', b'cdefghij', b'kl'):
+                read.append(chunk)
+                yield chunk
+
+        parts = uploader._parts(chunks())
+        assert next(parts) == b'abcd'
+        assert read == [b'ab', b'cdefghij']
+        assert next(parts) == b'efgh'
+        assert read == [b'ab', b'cdefghij']
+        assert list(parts) == [b'ijkl']
+
+    def test_upload_stream_aborted(self):
+        """ A streamed upload whose source fails part way through is
+            aborted, leaving no object or incomplete upload behind.
+            """
+        part_size = 5 * 1024 * 1024
+
+        def failing_chunks():
+            yield bytes(2 * part_size)
+            raise IOError('dropped')
+
+        uploader = BucketUploader(self.bucket_name, part_size=part_size)
+        with pytest.raises(IOError):
+            uploader.upload_stream(self.test_prefix, 'a_file.dat',
+                                   failing_chunks())
+        assert 'Contents' not in self.s3_client.list_objects_v2(
+            Bucket=self.bucket_name)
+        assert 'Uploads' not in self.s3_client.list_multipart_uploads(
+            Bucket=self.bucket_name)
+
     def test_json_obj_upload(self, test_json_obj):
         uploader = BucketUploader(self.bucket_name)
         test_json_obj_name = 'test_obj.json'
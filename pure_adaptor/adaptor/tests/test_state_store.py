@@ -75,5 +75,12 @@ class TestStateStore:
         latest_datetime = state_store.latest_modified_datetime()
         assert latest_datetime == modified_date
 
+    def test_adaptor_state_store_file_location(self):
+        state_store = AdaptorStateStore(self.table_name)
+        assert state_store.get_file_location('a_digest') is None
+        state_store.put_file_location('a_digest', 'a/prefix/a_file.pdf')
+        assert state_store.get_file_location('a_digest') == \
+            'a/prefix/a_file.pdf'
+
     def teardown(self):
         self.mock.stop()
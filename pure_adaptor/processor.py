@@ -1,6 +1,14 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import inspect
+import itertools
 import os
 import logging
-from pure import versioned_pure_interface
+from pure import (CircuitOpenError, DiskBudgetExceededError,
+                  versioned_pure_interface)
 from adaptor.s3_bucket import BucketUploader
 from adaptor.kinesis_client import KinesisClient
 from adaptor.state_storage import AdaptorStateStore, DatasetState
@@ -18,41 +26,157 @@ class PureAdaptor(object):
                  instance_id,
                  input_stream,
                  invalid_stream,
-                 error_stream):
+                 error_stream,
+                 api_options=None,
+                 upload_options=None,
+                 stream_uploads=False,
+                 dedup_files=False,
+                 message_batch_size=None,
+                 dataset_prefetch=4):
 
         self.instance_id = instance_id
         self.api_version = api_version
         self.pure = versioned_pure_interface(api_version)
+        self.stream_uploads = stream_uploads
+        self.dedup_files = dedup_files
+        self.message_batch_size = message_batch_size
+        self._unflushed_states = []
+        self.dataset_prefetch = dataset_prefetch
 
         try:
             self.state_store = AdaptorStateStore(instance_id)
-            self.upload_manager = BucketUploader(instance_id)
+            self.upload_manager = BucketUploader(instance_id,
+                                                 **(upload_options or {}))
             self.kinesis_client = KinesisClient(input_stream,
                                                 invalid_stream,
                                                 error_stream)
-            self.pure_api = self.pure.API(api_url, api_key)
+            api_options, ignored = self.pure.API.supported_options(
+                api_options or {})
+            if ignored:
+                logger.warning('Ignoring options not supported by the %s '
+                               'Pure API: %s', api_version,
+                               ', '.join(ignored))
+            self.pure_api = self.pure.API(api_url, api_key, **api_options)
+            if stream_uploads and not hasattr(self.pure_api, 'stream_file'):
+                logger.warning('Streamed uploads are not supported by the '
+                               '%s Pure API, downloading files to disk.',
+                               api_version)
+                self.stream_uploads = False
         except Exception:
             logging.exception('PureAdaptor Initialisation failed.')
 
     def _poll_for_changed_datasets(self):
-        """ Scrape the API for datasets that have changed since the last time
-            the adaptor was run.
-            :returns: [PureDataset]
+        """ Scrape the API for the uuid and modified datetime of datasets that
+            have changed since the last time the adaptor was run, least
+            recently modified first.
+            :returns: [(String, DateTime)], or a coroutine returning them for
+                an asynchronous Pure API
             """
         latest_datetime = self.state_store.latest_modified_datetime()
-        changed_datasets = self.pure_api.changed_datasets(latest_datetime)
-        changed_datasets.sort(key=lambda ds: ds.modified_date)
-        return changed_datasets
+        return self.pure_api.changed_dataset_refs(latest_datetime)
+
+    def _prefetched_datasets(self, changed_datasets):
+        """ Gets the full record of each changed dataset in order, up to
+            dataset_prefetch records ahead of the dataset being processed
+            across a bounded pool of workers, so that getting records
+            overlaps processing them. Records not yet yielded when the
+            generator is closed are cancelled.
+            :changed_datasets: [(String, DateTime)]
+            :returns: generator(PureDataset)
+            """
+        uuids = (uuid for uuid, _ in changed_datasets)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.dataset_prefetch) as executor:
+            in_flight = collections.deque(
+                executor.submit(self.pure_api.get_dataset, uuid)
+                for uuid in itertools.islice(uuids, self.dataset_prefetch))
+            try:
+                while in_flight:
+                    dataset = in_flight.popleft().result()
+                    uuid = next(uuids, None)
+                    if uuid is not None:
+                        in_flight.append(
+                            executor.submit(self.pure_api.get_dataset, uuid))
+                    yield dataset
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    async def _prefetched_datasets_async(self, changed_datasets):
+        """ Gets the full record of each changed dataset in order from an
+            asynchronous Pure API, as _prefetched_datasets does.
+            :changed_datasets: [(String, DateTime)]
+            :returns: async generator(PureDataset)
+            """
+        uuids = (uuid for uuid, _ in changed_datasets)
+        in_flight = collections.deque(
+            asyncio.ensure_future(self.pure_api.get_dataset(uuid))
+            for uuid in itertools.islice(uuids, self.dataset_prefetch))
+        try:
+            while in_flight:
+                dataset = await in_flight.popleft()
+                uuid = next(uuids, None)
+                if uuid is not None:
+                    in_flight.append(asyncio.ensure_future(
+                        self.pure_api.get_dataset(uuid)))
+                yield dataset
+        finally:
+            for future in in_flight:
+                future.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
 
     def _process_dataset(self, dataset):
         """ Undertakes the processing of a single dataset, managing all data
             download and upload, as well as sending messages to the appropriate
-            stream.
+            stream. The downloaded files are removed once uploaded. A dataset
+            whose files would exceed the scratch disk budget is streamed to
+            S3 instead, if the Pure API can stream files.
+            :dataset: PureDataset
+            :returns: DatasetState
+            """
+        try:
+            if self.stream_uploads:
+                self._stream_dataset(dataset)
+            else:
+                try:
+                    dataset.download_files()
+                except DiskBudgetExceededError as e:
+                    if not hasattr(self.pure_api, 'stream_file'):
+                        raise
+                    logger.warning('Streaming the files of dataset %s: %s',
+                                   dataset.uuid, e)
+                    dataset.remove_local_files()
+                    self._stream_dataset(dataset)
+            return self._publish_dataset(dataset)
+        finally:
+            dataset.remove_local_files()
+
+    def _stream_dataset(self, dataset):
+        """ Streams the files of a dataset from Pure to S3 without writing
+            them to disk.
+            :dataset: PureDataset
+            """
+        dataset.stream_files(functools.partial(
+            self.upload_manager.upload_stream, dataset.doi_upload_key))
+
+    async def _process_dataset_async(self, dataset):
+        """ Undertakes the processing of a single dataset from an asynchronous
+            Pure API, downloading its files concurrently.
             :dataset: PureDataset
             :returns: DatasetState
             """
+        try:
+            await dataset.download_files_async()
+            return self._publish_dataset(dataset)
+        finally:
+            dataset.remove_local_files()
 
-        dataset.download_files()
+    def _publish_dataset(self, dataset):
+        """ Uploads a downloaded dataset and sends the message for it to the
+            appropriate stream.
+            :dataset: PureDataset
+            :returns: DatasetState
+            """
         self._upload_dataset(dataset)
         dataset_state = DatasetState.create_from_dataset(dataset)
         prev_dataset_state = self.state_store.get_dataset_state(dataset.uuid)
@@ -64,48 +188,147 @@ class PureAdaptor(object):
 
         message = message_creator.generate(dataset.rdss_canonical_metadata)
 
-        self.kinesis_client.put_record(message)
-        self._update_adaptor_state(dataset_state)
+        if self.message_batch_size:
+            self.kinesis_client.buffer_record(message)
+            self._unflushed_states.append(dataset_state)
+        else:
+            self.kinesis_client.put_record(message)
+            self.state_store.put_dataset_state(dataset_state)
+        return dataset_state
 
     def _upload_dataset(self, dataset):
         """ Effects the upload of dataset files and associated metadata to the
             appropriate S3 bucket for retrieval by other RDSS components.
+            The s3 urls of the files are known in advance, so that the files
+            and both metadata objects are uploaded concurrently. The dataset
+            fails as a whole if any upload fails.
             :dataset: PureDataset
             """
+        prefix = dataset.doi_upload_key
+        existing = self.upload_manager.existing_objects(prefix)
+        uploads = []
+        uploaded_keys = {}
         for file_path in dataset.local_files:
-            s3_url = self.upload_manager.upload_file(dataset.doi_upload_key,
-                                                     file_path)
-            dataset.file_s3_urls[os.path.basename(file_path)] = s3_url
-
-        self.upload_manager.upload_json_obj(
-            dataset.doi_upload_key,
-            'original_pure{}_metadata.json'.format(self.api_version),
-            dataset.original_metadata
-        )
-        self.upload_manager.upload_json_obj(
-            dataset.doi_upload_key,
-            'metadata.json',
-            dataset.rdss_canonical_metadata
-        )
+            file_name = os.path.basename(file_path)
+            digests = dataset.local_file_digests.get(file_name)
+            dataset.file_s3_urls[file_name] = self.upload_manager.s3_url(
+                prefix, file_name)
+            source_key = self._duplicate_file_key(prefix, file_name, digests)
+            if source_key:
+                uploads.append((self.upload_manager.copy_file, (
+                    source_key, prefix, file_path, digests, existing)))
+                continue
+            uploads.append((self.upload_manager.upload_file, (
+                prefix, file_path, digests, existing)))
+            if self.dedup_files and digests and digests.get('sha256'):
+                uploaded_keys[digests['sha256']] = \
+                    self.upload_manager.object_key(prefix, file_name)
+        original_file_name = 'original_pure{}_metadata.json'.format(
+            self.api_version)
+        original_bytes = dataset.original_metadata_bytes
+        if original_bytes is not None:
+            uploads.append((self.upload_manager.upload_json_bytes, (
+                prefix, original_file_name, original_bytes, existing)))
+        else:
+            uploads.append((self.upload_manager.upload_json_obj, (
+                prefix, original_file_name, dataset.original_metadata,
+                existing)))
+        uploads.append((self.upload_manager.upload_json_obj, (
+            prefix, 'metadata.json', dataset.rdss_canonical_metadata,
+            existing)))
+        self.upload_manager.upload_all(uploads)
+        for digest, key in uploaded_keys.items():
+            self.state_store.put_file_location(digest, key)
+
+    def _duplicate_file_key(self, prefix, file_name, digests):
+        """ The s3 key of a file with the same sha256 digest uploaded by the
+            adaptor to another key, e.g. for another dataset, if files are
+            deduplicated.
+            :returns: String or None
+            """
+        if not self.dedup_files or not (digests or {}).get('sha256'):
+            return None
+        source_key = self.state_store.get_file_location(digests['sha256'])
+        if source_key == self.upload_manager.object_key(prefix, file_name):
+            return None
+        return source_key
 
     def _update_adaptor_state(self, latest_dataset_state):
-        """ Updates the state store with the latest datetime from the set
-            of datasets downloaded during this run of the adaptor.
+        """ Updates the state store with the latest datetime from the most
+            recently modified dataset processed so far in this run. If
+            messages are batched, the state store is only updated once the
+            messages of a batch of datasets have been flushed.
             :latest_dataset_state: DatasetState
             """
-        self.state_store.put_dataset_state(latest_dataset_state)
-        self.state_store.update_latest_modified(latest_dataset_state)
+        if not self.message_batch_size:
+            self.state_store.update_latest_modified(latest_dataset_state)
+        elif len(self._unflushed_states) >= self.message_batch_size:
+            self._flush_messages()
 
-    def run(self):
-        """ Runs the adaptor.
+    def _flush_messages(self):
+        """ Sends the buffered messages of the datasets processed since the
+            last flush, then stores the states of those datasets, advancing
+            the latest modified datetime to the last of them. The states are
+            stored only once the messages are sent, so that a run failing
+            before a flush leaves the datasets to be processed again as
+            though they had never been.
             """
+        if not self._unflushed_states:
+            return
+        self.kinesis_client.flush()
+        for dataset_state in self._unflushed_states:
+            self.state_store.put_dataset_state(dataset_state)
+        self.state_store.update_latest_modified(self._unflushed_states[-1])
+        self._unflushed_states = []
 
-        changed_datasets = self._poll_for_changed_datasets()
+    def run(self):
+        """ Runs the adaptor, closing pooled Pure API connections on exit.
+            Changed datasets are processed least recently modified first,
+            advancing the latest modified datetime after each one, or each
+            batch of messages, so that a run which fails part way through is
+            resumed from the failed dataset by the next run. The full records
+            of the next few datasets are fetched while each is processed.
+            The run is ended early if the Pure API becomes unavailable.
+            """
+        if inspect.iscoroutinefunction(self.pure_api.changed_dataset_refs):
+            asyncio.get_event_loop().run_until_complete(self._run_async())
+            return
 
-        if not changed_datasets:
-            logger.info(
-                'No new datasets available from %s, exiting.', self.pure_api)
+        with self.pure_api:
+            try:
+                changed_datasets = self._poll_for_changed_datasets()
+                if not changed_datasets:
+                    logger.info('No new datasets available from %s, '
+                                'exiting.', self.pure_api)
+                datasets = self._prefetched_datasets(changed_datasets)
+                with contextlib.closing(datasets):
+                    for dataset in datasets:
+                        self._update_adaptor_state(
+                            self._process_dataset(dataset))
+            except CircuitOpenError:
+                logger.exception('Ending run as %s is unavailable.',
+                                 self.pure_api)
+            finally:
+                self._flush_messages()
 
-        else:
-            for dataset in changed_datasets:
-                self._process_dataset(dataset)
+    async def _run_async(self):
+        """ Runs the adaptor against an asynchronous Pure API.
+            """
+        async with self.pure_api:
+            try:
+                changed_datasets = await self._poll_for_changed_datasets()
+                if not changed_datasets:
+                    logger.info('No new datasets available from %s, '
+                                'exiting.', self.pure_api)
+                datasets = self._prefetched_datasets_async(changed_datasets)
+                try:
+                    async for dataset in datasets:
+                        self._update_adaptor_state(
+                            await self._process_dataset_async(dataset))
+                finally:
+                    await datasets.aclose()
+            except CircuitOpenError:
+                logger.exception('Ending run as %s is unavailable.',
+                                 self.pure_api)
+            finally:
+                self._flush_messages()
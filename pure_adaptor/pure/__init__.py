@@ -1,6 +1,7 @@
 import logging
 from collections import namedtuple
 from . import v59
+from .base import CircuitOpenError, DiskBudgetExceededError
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +19,12 @@ API_VERSION_MAPPINGS = {
         API=v59.PureAPI,
         Dataset=v59.PureDataset,
         DownloadManager=v59.PureDownloadManager,
-    )
+    ),
+    'v59_async': PureInterface(
+        API=v59.AsyncPureAPI,
+        Dataset=v59.PureDataset,
+        DownloadManager=v59.PureDownloadManager,
+    ),
 }
 
 
@@ -32,4 +38,5 @@ def versioned_pure_interface(api_version_tag):
         )
 
 
-__all__ = ['versioned_pure_interface']
+__all__ = ['CircuitOpenError', 'DiskBudgetExceededError',
+           'versioned_pure_interface']
@@ -1,7 +1,20 @@
 from .api import BasePureAPI
+from .page_size import AdaptivePageSize
 from .models import BasePureDataset
+from .disk_budget import DiskBudget, DiskBudgetExceededError
 from .download_manager import BasePureDownloadManager
+from .download_progress import DownloadProgress
+from .file_cache import FileCache
+from .hashing import StreamHasher
+from .json_stream import JSONPageStream
 from .remapper import JSONRemapper
+from .response_cache import ResponseCache
+from .resilience import (CircuitBreaker, CircuitOpenError, RetryPolicy,
+                         TokenBucket)
+from .timestamps import parse_iso8601
 
-__all__ = ['BasePureAPI', 'BasePureDataset',
-           'BasePureDownloadManager', 'JSONRemapper']
+__all__ = ['AdaptivePageSize', 'BasePureAPI', 'BasePureDataset',
+           'BasePureDownloadManager', 'CircuitBreaker', 'CircuitOpenError',
+           'DiskBudget', 'DiskBudgetExceededError', 'DownloadProgress',
+           'FileCache', 'JSONPageStream', 'JSONRemapper', 'ResponseCache',
+           'RetryPolicy', 'StreamHasher', 'TokenBucket', 'parse_iso8601']
@@ -1,21 +1,60 @@
 import abc
+import inspect
 
 
 class BasePureAPI(abc.ABC):
     """ An Abstract Base Class for interactions with PURE APIs """
 
+    @classmethod
+    def supported_options(cls, options):
+        """ Splits keyword options for the constructor into those it accepts
+            and those it does not, so that options configured for one Pure
+            API client can be dropped when another is used.
+            :options: dict
+            :returns: tuple(dict, [string])
+            """
+        parameters = inspect.signature(cls).parameters
+        supported = {name: value for name, value in options.items()
+                     if name in parameters}
+        ignored = sorted(name for name in options if name not in supported)
+        return supported, ignored
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Releases any resources, such as pooled connections, held by the
+            API client.
+            """
+        pass
+
     @abc.abstractmethod
     def changed_datasets(self, since_datetime=None):
         pass
 
+    @abc.abstractmethod
+    def iter_changed_datasets(self, since_datetime=None):
+        pass
+
+    @abc.abstractmethod
+    def changed_dataset_refs(self, since_datetime=None):
+        pass
+
     @abc.abstractmethod
     def list_all_datasets(self):
         pass
 
+    @abc.abstractmethod
+    def iter_all_datasets(self):
+        pass
+
     @abc.abstractmethod
     def get_dataset(self, uuid):
         pass
 
     @abc.abstractmethod
-    def download_file(self, url, dest):
+    def download_file(self, url, dest, hasher=None):
         pass
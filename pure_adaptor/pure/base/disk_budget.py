@@ -0,0 +1,74 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DiskBudgetExceededError(Exception):
+    """ Raised when the files of a single owner would exceed the budget on
+        their own, so could never be reserved.
+        """
+    pass
+
+
+class DiskBudget(object):
+
+    """ Tracks the bytes of scratch disk reserved for downloaded files
+        against a budget, each reservation held by an owner, such as the
+        download manager of a dataset, until the owner releases all of its
+        reservations at once. A reservation waits while other owners hold so
+        much of the budget that it would be exceeded, so the bytes reserved
+        never exceed the budget. A reservation that would take the files of
+        its owner alone over the budget fails, as waiting could not make
+        room for it."""
+
+    def __init__(self, max_bytes):
+        """
+        :max_bytes: Int: Bytes of scratch disk that may be reserved at once
+
+        """
+        self.max_bytes = max_bytes
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+        self._reservations = collections.defaultdict(dict)
+
+    def _fits(self, increase):
+        return increase <= 0 or \
+            self.reserved_bytes + increase <= self.max_bytes
+
+    def reserve(self, owner, key, nbytes):
+        """ Reserves the bytes for a file, replacing any earlier reservation
+            for the same file, e.g. one made before its size was known.
+            Blocks until the reservation fits in the budget.
+            :owner: Hashable: Holder of the reservation
+            :key: Hashable: Identifies the file within the owner
+            :nbytes: Int
+            :raises: DiskBudgetExceededError if the files of the owner would
+                exceed the budget by themselves
+            """
+        with self._condition:
+            owner_reservations = self._reservations[owner]
+            increase = nbytes - owner_reservations.get(key, 0)
+            owner_bytes = sum(owner_reservations.values()) + increase
+            if owner_bytes > self.max_bytes:
+                raise DiskBudgetExceededError(
+                    'Files of {} need {} bytes, exceeding the scratch disk '
+                    'budget of {} bytes'.format(owner, owner_bytes,
+                                                self.max_bytes))
+            if not self._fits(increase):
+                logger.info('Waiting for %s bytes of scratch disk, with %s '
+                            'of %s bytes reserved', increase,
+                            self.reserved_bytes, self.max_bytes)
+                self._condition.wait_for(lambda: self._fits(increase))
+            owner_reservations[key] = nbytes
+            self.reserved_bytes += increase
+
+    def release(self, owner):
+        """ Releases every reservation held by an owner, waking the
+            reservations waiting for space.
+            """
+        with self._condition:
+            self.reserved_bytes -= sum(
+                self._reservations.pop(owner, {}).values())
+            self._condition.notify_all()
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadProgress(object):
+
+    """ Records which segments of a segmented download have been written to
+        the destination file, persisted in a .progress file beside it so an
+        interrupted download can resume from the missing segments."""
+
+    def __init__(self, dest, url, size, validator, segment_size):
+        """
+        :dest: String: Path of the file being downloaded
+        :url: String: Url the file is downloaded from
+        :size: Int: Total size of the file in bytes
+        :validator: String: ETag or Last-Modified of the file, or None
+        :segment_size: Int: Bytes fetched by each ranged request
+
+        """
+        self.path = '{}.progress'.format(dest)
+        self._dest = dest
+        self._state = {
+            'url': url,
+            'size': size,
+            'validator': validator,
+            'segment_size': segment_size,
+        }
+        self._completed = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """ Restores the completed segments of a previous attempt at the same
+            download, as long as the file has not changed since.
+            """
+        try:
+            with open(self.path) as progress_in:
+                saved = json.load(progress_in)
+            dest_size = os.path.getsize(self._dest)
+        except (OSError, ValueError):
+            return
+        if not self._state['validator'] or dest_size != \
+                self._state['size'] or \
+                any(saved.get(k) != v for k, v in self._state.items()):
+            logger.info('Discarding stale download progress %s', self.path)
+            return
+        self._completed = set(saved.get('completed', []))
+        logger.info('Resuming download of %s with %s of %s segments '
+                    'complete', self._dest, len(self._completed),
+                    len(self.segments))
+
+    @property
+    def segments(self):
+        """ The inclusive byte ranges of every segment of the file.
+            :returns: [(int, int),]
+            """
+        size = self._state['size']
+        segment_size = self._state['segment_size']
+        return [(start, min(start + segment_size, size) - 1)
+                for start in range(0, size, segment_size)]
+
+    @property
+    def missing_segments(self):
+        return [(start, end) for start, end in self.segments
+                if start not in self._completed]
+
+    def is_complete(self, start):
+        """ Whether the segment starting at a byte offset has been written.
+            """
+        with self._lock:
+            return start in self._completed
+
+    @property
+    def resuming(self):
+        return bool(self._completed)
+
+    def complete(self, start):
+        """ Marks the segment starting at a byte offset as written, saving
+            the progress so far.
+            """
+        with self._lock:
+            self._completed.add(start)
+            data = json.dumps({**self._state,
+                               'completed': sorted(self._completed)})
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.path) or '.')
+            try:
+                with os.fdopen(fd, 'w') as progress_out:
+                    progress_out.write(data)
+                os.replace(temp_path, self.path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,224 @@
+import collections
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache(object):
+
+    """ A persistent on-disk cache of downloaded documents. Each distinct
+        document is stored once under its sha256 digest, and indexed by the
+        url it was downloaded from along with the ETag and Last-Modified
+        validators and digests of the download, for use in conditional
+        requests. The index is kept in a single file so that starting up
+        does not scan the cache. The cache is bounded in size, evicting the
+        least recently used documents."""
+
+    INDEX_FILE_NAME = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 * 1024 * 1024):
+        """
+        :cache_dir: String: Directory in which documents are stored
+        :max_bytes: Int: Total size of cached documents before eviction
+
+        """
+        self._cache_dir = cache_dir
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+        self._temp_dir = os.path.join(cache_dir, 'tmp')
+        self._index_path = os.path.join(cache_dir, self.INDEX_FILE_NAME)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._object_refs = collections.Counter()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(self._objects_dir, exist_ok=True)
+        # Downloads interrupted by a previous run are never inserted.
+        shutil.rmtree(self._temp_dir, ignore_errors=True)
+        os.makedirs(self._temp_dir, exist_ok=True)
+        self._load_index()
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_dir, digest)
+
+    def _load_index(self):
+        """ Restores the entries of the index, least recently used first.
+            """
+        try:
+            with open(self._index_path) as index_in:
+                entries = json.load(index_in)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning('Discarding unreadable download cache index %s',
+                           self._index_path)
+            return
+        for url, meta in entries:
+            self._add_entry(url, meta)
+
+    def _save_index(self):
+        """ Writes the index to a temporary file before moving it into place,
+            so an interrupted write leaves the previous index intact.
+            """
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as index_out:
+                json.dump(list(self._entries.items()), index_out)
+            os.replace(temp_path, self._index_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _add_entry(self, url, meta):
+        """ Adds the entry for a url, replacing any previous entry only once
+            the new document is referenced, so that an unchanged document is
+            not removed.
+            """
+        digest = meta['digest']
+        if not self._object_refs[digest]:
+            self._total_bytes += meta['size']
+        self._object_refs[digest] += 1
+        self._remove_entry(url)
+        self._entries[url] = meta
+
+    def _remove_entry(self, url):
+        """ Removes the entry for a url, and the document it refers to once
+            no other url refers to it.
+            """
+        meta = self._entries.pop(url, None)
+        if not meta:
+            return
+        digest = meta['digest']
+        self._object_refs[digest] -= 1
+        if self._object_refs[digest]:
+            return
+        del self._object_refs[digest]
+        self._total_bytes -= meta['size']
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self._max_bytes and self._entries:
+            url = next(iter(self._entries))
+            logger.debug('Evicting cached download of %s', url)
+            self._remove_entry(url)
+
+    def _link(self, source_path, dest):
+        """ Hard links a cached document to dest, copying it where dest is
+            on another filesystem.
+            """
+        try:
+            os.remove(dest)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(source_path, dest)
+        except OSError:
+            shutil.copyfile(source_path, dest)
+
+    def temp_dir(self):
+        """ Creates a temporary directory on the same filesystem as the
+            cache, to which cached documents can be hard linked.
+            :returns: tempfile.TemporaryDirectory
+            """
+        return tempfile.TemporaryDirectory(dir=self._temp_dir)
+
+    def temp_path(self):
+        """ Creates a file in the cache directory to download into, which can
+            be moved into the cache without copying it.
+            :returns: String
+            """
+        fd, temp_path = tempfile.mkstemp(dir=self._temp_dir)
+        os.close(fd)
+        return temp_path
+
+    def conditional_headers(self, url):
+        """ The If-None-Match and If-Modified-Since headers for a conditional
+            request, built from the validators of a cached download.
+            :returns: dict
+            """
+        with self._lock:
+            meta = self._entries.get(url)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def get(self, url, dest):
+        """ Links the cached download of a url to dest, marking it as
+            recently used. Returns None if the url is not cached.
+            :returns: {String: String}: Digests of the document by algorithm
+            """
+        with self._lock:
+            meta = self._entries.get(url)
+            if not meta:
+                return None
+            try:
+                self._link(self._object_path(meta['digest']), dest)
+            except FileNotFoundError:
+                logger.warning('Discarding missing cached download of %s',
+                               url)
+                self._remove_entry(url)
+                self._save_index()
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            self.bytes_saved += meta['size']
+            self._save_index()
+            return meta['digests']
+
+    def insert(self, url, source_path, dest, headers, digests):
+        """ Moves a downloaded document into the cache and links it to dest.
+            A document whose response carried no validators cannot be used
+            in a conditional request, so is moved to dest uncached.
+            :source_path: String: A path returned by temp_path
+            :headers: dict: Response headers of the download
+            :digests: {String: String}: Digests of the document by algorithm,
+                including sha256
+            """
+        meta = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'digest': digests['sha256'],
+            'digests': digests,
+            'size': os.path.getsize(source_path),
+        }
+        with self._lock:
+            self.misses += 1
+            if not (meta['etag'] or meta['last_modified']):
+                os.replace(source_path, dest)
+                return
+            object_path = self._object_path(meta['digest'])
+            if meta['digest'] in self._object_refs:
+                os.remove(source_path)
+            else:
+                os.replace(source_path, object_path)
+            self._link(object_path, dest)
+            self._add_entry(url, meta)
+            self._evict()
+            self._save_index()
+
+    @property
+    def stats(self):
+        """ Counters of the downloads served from and added to the cache.
+            :returns: dict
+            """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+            'cached_downloads': len(self._entries),
+            'cached_bytes': self._total_bytes,
+        }
@@ -0,0 +1,58 @@
+import hashlib
+import mmap
+import os
+
+
+class StreamHasher(object):
+
+    """ Hashes a stream of bytes with one or more algorithms as it is read,
+        so a download is hashed without reading the file back afterwards.
+        The hashes can be reset when a download restarts from the first
+        byte."""
+
+    def __init__(self, algorithms=('sha256',)):
+        """
+        :algorithms: [String]: Names of the hashlib algorithms to compute
+
+        """
+        self.algorithms = tuple(algorithms)
+        self.reset()
+
+    def reset(self):
+        self._hashers = [hashlib.new(a) for a in self.algorithms]
+        self.bytes_hashed = 0
+
+    def update(self, data):
+        for hasher in self._hashers:
+            hasher.update(data)
+        self.bytes_hashed += len(data)
+
+    def update_from_file(self, file_path, buffer_size=1024 * 1024,
+                         use_mmap=False):
+        """ Hashes the whole of a file, for files whose bytes were not
+            hashed as they were written.
+            :use_mmap: Boolean: Hash slices of the memory mapped file rather
+                than copying it into a buffer
+            """
+        with open(file_path, 'rb', buffering=0) as f_in:
+            size = os.fstat(f_in.fileno()).st_size
+            if use_mmap and size:
+                with mmap.mmap(f_in.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for start in range(0, size, buffer_size):
+                            self.update(view[start:start + buffer_size])
+                    finally:
+                        view.release()
+                return
+            buffer = memoryview(bytearray(buffer_size))
+            for bytes_read in iter(lambda: f_in.readinto(buffer), 0):
+                self.update(buffer[:bytes_read])
+
+    def hexdigests(self):
+        """ The digest of the bytes hashed so far by each algorithm.
+            :returns: {String: String}
+            """
+        return {algorithm: hasher.hexdigest()
+                for algorithm, hasher in zip(self.algorithms, self._hashers)}
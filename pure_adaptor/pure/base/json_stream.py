@@ -0,0 +1,197 @@
+import codecs
+import json
+import logging
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = ' \t\n\r'
+
+
+class _ChunkReader(object):
+
+    """ A minimal file-like reader over an iterable of byte chunks, as
+        expected by ijson."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        # ijson reads zero bytes to detect whether the file is binary.
+        if size == 0:
+            return b''
+        # An empty chunk would be taken as the end of the file.
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b''
+
+
+class JSONPageStream(object):
+
+    """ Incrementally parses a JSON object from an iterable of byte chunks,
+        yielding each element of one of its array members as soon as it has
+        been decoded. The other members of the object are available from
+        the page attribute once iteration has finished.
+
+        Uses the ijson library if it is installed, otherwise a parser built
+        on the standard library json decoder."""
+
+    def __init__(self, chunks, items_key='items', use_ijson=True):
+        """
+        :chunks: Iterable of bytes
+        :items_key: String: Member of the object holding the array to stream
+        :use_ijson: Boolean: Use ijson if it is installed
+
+        """
+        self._chunks = chunks
+        self._items_key = items_key
+        self._use_ijson = use_ijson and ijson is not None
+        self.page = None
+
+    def close(self):
+        """ Closes the underlying chunks, e.g. to release the connection of
+            a response that has not been read to the end.
+            """
+        close = getattr(self._chunks, 'close', None)
+        if close:
+            close()
+
+    def __iter__(self):
+        if self._use_ijson:
+            return self._ijson_items()
+        return self._decoder_items()
+
+    def _ijson_items(self):
+        """ Builds each element of the array from ijson parse events, and
+            the rest of the object from the remaining events.
+            """
+        item_prefix = '{}.item'.format(self._items_key)
+        page_builder = ijson.common.ObjectBuilder()
+        item_builder = None
+        depth = 0
+        events = ijson.parse(_ChunkReader(self._chunks), use_float=True)
+        for prefix, event, value in events:
+            if item_builder is None and prefix == item_prefix:
+                if event not in ('start_map', 'start_array'):
+                    yield value
+                    continue
+                item_builder = ijson.common.ObjectBuilder()
+            if item_builder is None:
+                page_builder.event(event, value)
+                continue
+            item_builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                yield item_builder.value
+                item_builder = None
+        self.page = page_builder.value
+
+    def _decoder_items(self):
+        return _DecoderParser(self._chunks, self._items_key).parse(self)
+
+
+class _DecoderParser(object):
+
+    """ Parses a JSON object incrementally with json.JSONDecoder.raw_decode,
+        reading further chunks whenever a value is incomplete."""
+
+    def __init__(self, chunks, items_key):
+        self._chunks = iter(chunks)
+        self._items_key = items_key
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def _read(self, min_chars=1):
+        """ Appends at least min_chars of further text to the buffer,
+            discarding text that has already been parsed.
+            :returns: Boolean: False if the chunks are exhausted
+            """
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        target = len(self._buffer) + min_chars
+        while len(self._buffer) < target:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._buffer += self._text_decoder.decode(b'', final=True)
+                self._exhausted = True
+                return False
+            self._buffer += self._text_decoder.decode(chunk)
+        return True
+
+    def _next_char(self):
+        """ Skips whitespace, returning the next character without consuming
+            it.
+            """
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                raise ValueError('Unexpected end of JSON stream.')
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError('Expected one of {!r} at position {} but '
+                             'found {!r}.'.format(chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """ Decodes the next complete value. A value that ends at the end of
+            the buffer may be truncated, e.g. a number, so more text is read
+            before accepting it unless the stream has ended.
+            """
+        self._next_char()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buffer, self._pos)
+                if end < len(self._buffer) or self._exhausted:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._exhausted:
+                    raise
+            # Read at least as much again as is pending so that large
+            # values are not decoded from the start too many times.
+            self._read(max(len(self._buffer) - self._pos, 1))
+
+    def parse(self, page_stream):
+        self._expect('{')
+        page = {}
+        if self._next_char() == '}':
+            self._pos += 1
+            page_stream.page = page
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == self._items_key and self._next_char() == '[':
+                self._pos += 1
+                page[key] = []
+                if self._next_char() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                page[key] = self._value()
+            if self._expect(',}') == '}':
+                break
+        page_stream.page = page
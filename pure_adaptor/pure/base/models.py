@@ -21,6 +21,15 @@ class BasePureDataset(abc.ABC):
         """
         pass
 
+    @property
+    def original_metadata_bytes(self):
+        """ The original metadata exactly as it was served, for upload
+            unchanged, or None if only the parsed metadata is available.
+        :returns: bytes
+
+        """
+        return None
+
     @abc.abstractproperty
     def rdss_canonical_metadata(self):
         """ The metadata for this dataset mapped to the schema from the
@@ -0,0 +1,64 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePageSize(object):
+
+    """ Adjusts the number of items requested per page of a paginated API,
+        growing or shrinking the page size within bounds so that each page
+        takes around a target time to fetch."""
+
+    # Limits on how far the page size may change after a single page, so
+    # that one unusually fast or slow response does not swing it wildly.
+    MAX_GROWTH = 2.0
+    MAX_SHRINK = 0.5
+
+    def __init__(self, initial_size=20, min_size=10, max_size=500,
+                 target_seconds=2.0, max_page_bytes=None):
+        """
+        :initial_size: Int: Page size of the first request
+        :min_size: Int
+        :max_size: Int
+        :target_seconds: Float: Time each page should take to fetch
+        :max_page_bytes: Int: Optional limit on the size of each response
+
+        """
+        if not 0 < min_size <= max_size:
+            raise ValueError('Page size bounds must satisfy '
+                             '0 < min_size <= max_size.')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_page_bytes = max_page_bytes
+        self.size = self._clamp(initial_size)
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def record(self, seconds, num_bytes):
+        """ Records the time taken and bytes received for a page of the
+            current size, adjusting the size for the next page.
+            :seconds: Float
+            :num_bytes: Int
+            """
+        scale = self.target_seconds / max(seconds, 1e-3)
+        if self.max_page_bytes and num_bytes:
+            scale = min(scale, self.max_page_bytes / num_bytes)
+        scale = max(self.MAX_SHRINK, min(self.MAX_GROWTH, scale))
+        new_size = self._clamp(self.size * scale)
+        if new_size != self.size:
+            logger.debug('Page of %s items took %.2fs for %s bytes, '
+                         'adjusting page size to %s.',
+                         self.size, seconds, num_bytes, new_size)
+        self.size = new_size
+
+    def back_off(self):
+        """ Halves the page size after a page failed to be served in time.
+            :returns: Boolean: False if already at the minimum page size
+            """
+        if self.size <= self.min_size:
+            return False
+        self.size = self._clamp(self.size * self.MAX_SHRINK)
+        logger.warning('Backing off page size to %s.', self.size)
+        return True
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+import email.utils
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of making a request while a CircuitBreaker is open.
+        """
+    pass
+
+
+class TokenBucket(object):
+
+    """ A token bucket rate limiter allowing a sustained rate of requests per
+        second, with bursts of up to a given number of requests."""
+
+    def __init__(self, rate, burst=1):
+        """
+        :rate: Float: Requests per second
+        :burst: Int: Requests that may be made at once after a quiet period
+
+        """
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ Takes a token from the bucket, returning how long the caller must
+            wait before making its request.
+            :returns: Float: seconds
+            """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._burst,
+                self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def acquire(self):
+        """ Blocks until a request may be made.
+            """
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class RetryPolicy(object):
+
+    """ Jittered exponential back off for retrying idempotent requests that
+        fail with a transient error, honouring any Retry-After header."""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_attempts=5, backoff_base=0.5, backoff_max=30.0,
+                 max_retry_after=600.0):
+        """
+        :max_attempts: Int: Attempts made before giving up, including the
+            first
+        :backoff_base: Float: Seconds of the first back off
+        :backoff_max: Float: Upper bound on the exponential back off
+        :max_retry_after: Float: Longest Retry-After that is waited for,
+            beyond which the request is given up
+
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+    def should_retry_status(self, status_code):
+        return status_code in self.RETRY_STATUSES
+
+    def _retry_after_seconds(self, retry_after):
+        """ Parses a Retry-After header given as either seconds or an HTTP
+            date, returning None if it cannot be parsed.
+            """
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+        if retry_date is None:
+            return None
+        return max(0.0, retry_date.timestamp() - time.time())
+
+    def backoff(self, attempt, retry_after=None):
+        """ Seconds to wait before the next attempt, after a given number of
+            failed attempts. A Retry-After is honoured in full, unless it is
+            longer than max_retry_after in which case None is returned and
+            the request should not be retried.
+            :attempt: Int
+            :retry_after: String: Optional Retry-After header value
+            :returns: Float or None
+            """
+        try:
+            retry_after_seconds = self._retry_after_seconds(retry_after)
+        except (TypeError, ValueError):
+            retry_after_seconds = None
+        if retry_after_seconds is not None:
+            if retry_after_seconds > self.max_retry_after:
+                return None
+            return retry_after_seconds
+        ceiling = min(self.backoff_max,
+                      self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker(object):
+
+    """ Stops requests being made to a service after a run of consecutive
+        failures, allowing a single trial request once a reset period has
+        passed."""
+
+    def __init__(self, failure_threshold=5, reset_seconds=60.0):
+        """
+        :failure_threshold: Int: Consecutive failures that open the circuit
+        :reset_seconds: Float: Time the circuit stays open before a trial
+            request is allowed
+
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_request(self):
+        """ Raises CircuitOpenError if requests are not currently allowed.
+            """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self._reset_seconds:
+                raise CircuitOpenError(
+                    'Circuit open after {} consecutive failures.'.format(
+                        self._failures))
+            # Allow one trial request, re-opening on its failure.
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._failure_threshold:
+                if self._opened_at is None:
+                    logger.error('Opening circuit after %s consecutive '
+                                 'failures.', self._failures)
+                self._opened_at = time.monotonic()
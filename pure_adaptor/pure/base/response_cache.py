@@ -0,0 +1,196 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import urllib
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+
+    """ An on-disk cache of HTTP response bodies along with their ETag and
+        Last-Modified validators, for use in conditional requests. The cache
+        is bounded in size, evicting the least recently used responses."""
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        """
+        :cache_dir: String: Directory in which responses are stored
+        :max_bytes: Int: Total size of cached bodies before eviction
+
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_entries()
+
+    def _path(self, key, extension):
+        return os.path.join(self._cache_dir, '{}.{}'.format(key, extension))
+
+    def _load_entries(self):
+        """ Indexes the responses already on disk, ordered by their last use
+            as recorded in the modification time of the body.
+            """
+        entries = []
+        for file_name in os.listdir(self._cache_dir):
+            key, extension = os.path.splitext(file_name)
+            if extension != '.json':
+                continue
+            try:
+                with open(self._path(key, 'json')) as meta_in:
+                    meta = json.load(meta_in)
+                last_used = os.path.getmtime(self._path(key, 'body'))
+            except (OSError, ValueError):
+                logger.warning('Discarding unreadable cached response %s',
+                               key)
+                self._remove_files(key)
+                continue
+            entries.append((last_used, key, meta))
+        for _, key, meta in sorted(entries, key=lambda e: e[0]):
+            self._entries[key] = meta
+            self._total_bytes += meta['size']
+
+    def _remove_files(self, key):
+        for extension in ('json', 'body'):
+            try:
+                os.remove(self._path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def _write_atomic(self, path, data):
+        """ Writes data to a temporary file in the cache directory before
+            moving it into place, so readers never see a partial file.
+            """
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f_out:
+                f_out.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _evict(self):
+        while self._total_bytes > self._max_bytes and self._entries:
+            key, meta = self._entries.popitem(last=False)
+            self._total_bytes -= meta['size']
+            logger.debug('Evicting cached response for %s', meta['url'])
+            self._remove_files(key)
+
+    def key(self, url, params=None):
+        """ Builds the cache key for a request url and its query parameters.
+            :returns: String
+            """
+        if params:
+            url = '{}?{}'.format(
+                url, urllib.parse.urlencode(sorted(params.items())))
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def conditional_headers(self, key):
+        """ The If-None-Match and If-Modified-Since headers for a conditional
+            request, built from the validators of a cached response.
+            :returns: dict
+            """
+        with self._lock:
+            meta = self._entries.get(key)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def cached_chunks(self, key, chunk_size=64 * 1024):
+        """ Returns an iterator over the cached body for a key, marking it as
+            recently used. Returns None if there is no cached body.
+            :returns: iterator(bytes)
+            """
+        with self._lock:
+            meta = self._entries.get(key)
+            if not meta:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += meta['size']
+        body_path = self._path(key, 'body')
+        try:
+            body_in = open(body_path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(body_path)
+        return self._read_chunks(body_in, chunk_size)
+
+    def _read_chunks(self, body_in, chunk_size):
+        with body_in:
+            for chunk in iter(lambda: body_in.read(chunk_size), b''):
+                yield chunk
+
+    def caching_chunks(self, key, url, headers, chunks):
+        """ Passes through the chunks of a response body, counting the
+            request as a miss. If the response carries validators that can
+            be used for a conditional request the body is written to the
+            cache as it streams, and stored once it is complete.
+            :headers: dict: Response headers
+            :chunks: iterable(bytes)
+            :returns: iterator(bytes)
+            """
+        with self._lock:
+            self.misses += 1
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'size': 0,
+        }
+        if not (meta['etag'] or meta['last_modified']):
+            yield from chunks
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as body_out:
+                for chunk in chunks:
+                    if meta['size'] <= self._max_bytes:
+                        body_out.write(chunk)
+                    meta['size'] += len(chunk)
+                    yield chunk
+            if meta['size'] > self._max_bytes:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, self._path(key, 'body'))
+        except BaseException:
+            # Includes GeneratorExit when the body is not read to the end.
+            os.remove(temp_path)
+            raise
+        self._write_atomic(self._path(key, 'json'),
+                           json.dumps(meta).encode('utf-8'))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous['size']
+            self._entries[key] = meta
+            self._total_bytes += meta['size']
+            self._evict()
+
+    @property
+    def stats(self):
+        """ Counters of the requests served from and added to the cache.
+            :returns: dict
+            """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+            'cached_responses': len(self._entries),
+            'cached_bytes': self._total_bytes,
+        }
@@ -0,0 +1,42 @@
+import pytest
+import threading
+
+from ..disk_budget import DiskBudget, DiskBudgetExceededError
+
+
+def test_reserve_and_release():
+    budget = DiskBudget(100)
+    budget.reserve('a_dataset', 'a_file', 60)
+    budget.reserve('a_dataset', 'a_file', 40)
+    assert budget.reserved_bytes == 40
+    budget.release('a_dataset')
+    assert budget.reserved_bytes == 0
+
+
+def test_owner_exceeding_budget_fails():
+    """ The files of a single owner that exceed the budget by themselves
+        fail to be reserved, rather than waiting on the owner forever.
+        """
+    budget = DiskBudget(100)
+    budget.reserve('a_dataset', 'a_file', 80)
+    with pytest.raises(DiskBudgetExceededError):
+        budget.reserve('a_dataset', 'another_file', 80)
+    assert budget.reserved_bytes == 80
+
+
+def test_waits_for_other_owners():
+    budget = DiskBudget(100)
+    budget.reserve('a_dataset', 'a_file', 80)
+    reserved = threading.Event()
+
+    def reserve():
+        budget.reserve('another_dataset', 'a_file', 80)
+        reserved.set()
+
+    thread = threading.Thread(target=reserve)
+    thread.start()
+    assert not reserved.wait(0.1)
+    budget.release('a_dataset')
+    assert reserved.wait(5)
+    thread.join()
+    assert budget.reserved_bytes == 80
@@ -0,0 +1,42 @@
+import pytest
+
+from ..download_progress import DownloadProgress
+
+
+@pytest.fixture
+def dest(tmpdir):
+    path = str(tmpdir.join('a_file.dat'))
+    with open(path, 'wb') as f_out:
+        f_out.truncate(100)
+    return path
+
+
+def test_segments(dest):
+    progress = DownloadProgress(dest, 'https://pure/a_file.dat', 100,
+                                '"v1"', 40)
+    assert progress.segments == [(0, 39), (40, 79), (80, 99)]
+    assert progress.missing_segments == progress.segments
+    assert not progress.resuming
+
+
+def test_resumes_completed_segments(dest):
+    progress = DownloadProgress(dest, 'https://pure/a_file.dat', 100,
+                                '"v1"', 40)
+    progress.complete(40)
+    resumed = DownloadProgress(dest, 'https://pure/a_file.dat', 100,
+                               '"v1"', 40)
+    assert resumed.resuming
+    assert resumed.missing_segments == [(0, 39), (80, 99)]
+    resumed.remove()
+    assert not DownloadProgress(dest, 'https://pure/a_file.dat', 100,
+                                '"v1"', 40).resuming
+
+
+@pytest.mark.parametrize('validator, size', [('"v2"', 100), (None, 100)])
+def test_discards_stale_progress(dest, validator, size):
+    progress = DownloadProgress(dest, 'https://pure/a_file.dat', 100,
+                                validator, 40)
+    progress.complete(0)
+    stale = DownloadProgress(dest, 'https://pure/a_file.dat', size,
+                             '"v1"' if validator else None, 40)
+    assert not stale.resuming
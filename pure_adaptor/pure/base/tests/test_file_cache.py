@@ -0,0 +1,93 @@
+import hashlib
+import os
+import pytest
+
+from ..file_cache import FileCache
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    return str(tmpdir.join('cache'))
+
+
+def download(cache, content):
+    path = cache.temp_path()
+    with open(path, 'wb') as f_out:
+        f_out.write(content)
+    return path, {'sha256': hashlib.sha256(content).hexdigest()}
+
+
+def read(path):
+    with open(path, 'rb') as f_in:
+        return f_in.read()
+
+
+def test_insert_and_get(cache_dir, tmpdir):
+    cache = FileCache(cache_dir)
+    path, digests = download(cache, b'a document')
+    dest = str(tmpdir.join('a_file.txt'))
+    cache.insert('https://pure/a_file.txt', path, dest, {'ETag': '"v1"'},
+                 digests)
+    assert read(dest) == b'a document'
+    assert not os.path.exists(path)
+
+    reloaded = FileCache(cache_dir)
+    assert reloaded.conditional_headers('https://pure/a_file.txt') == {
+        'If-None-Match': '"v1"'}
+    other_dest = str(tmpdir.join('another_file.txt'))
+    assert reloaded.get('https://pure/a_file.txt', other_dest) == digests
+    assert read(other_dest) == b'a document'
+    assert reloaded.stats['hits'] == 1
+    assert reloaded.get('https://pure/missing.txt', other_dest) is None
+
+
+def test_without_validators(cache_dir, tmpdir):
+    cache = FileCache(cache_dir)
+    path, digests = download(cache, b'a document')
+    dest = str(tmpdir.join('a_file.txt'))
+    cache.insert('https://pure/a_file.txt', path, dest, {}, digests)
+    assert read(dest) == b'a document'
+    assert cache.conditional_headers('https://pure/a_file.txt') == {}
+
+
+def test_identical_documents_stored_once(cache_dir, tmpdir):
+    cache = FileCache(cache_dir)
+    dest = str(tmpdir.join('a_file.txt'))
+    for url in ('https://pure/a_file.txt', 'https://pure/a_copy.txt'):
+        path, digests = download(cache, b'a document')
+        cache.insert(url, path, dest, {'ETag': '"v1"'}, digests)
+    assert cache.stats['cached_downloads'] == 2
+    assert cache.stats['cached_bytes'] == len(b'a document')
+    assert len(os.listdir(os.path.join(cache_dir, 'objects'))) == 1
+
+
+def test_unchanged_document_reinserted(cache_dir, tmpdir):
+    cache = FileCache(cache_dir)
+    dest = str(tmpdir.join('a_file.txt'))
+    for etag in ('"v1"', '"v2"'):
+        path, digests = download(cache, b'a document')
+        cache.insert('https://pure/a_file.txt', path, dest, {'ETag': etag},
+                     digests)
+    assert cache.get('https://pure/a_file.txt', dest) == digests
+    assert cache.conditional_headers('https://pure/a_file.txt') == {
+        'If-None-Match': '"v2"'}
+
+
+def test_evicts_least_recently_used(cache_dir, tmpdir):
+    cache = FileCache(cache_dir, max_bytes=25)
+    dest = str(tmpdir.join('a_file.txt'))
+    for name in ('one', 'two', 'three'):
+        path, digests = download(cache, name.encode() * 3)
+        cache.insert('https://pure/' + name, path, dest, {'ETag': '"v1"'},
+                     digests)
+        if name == 'two':
+            cache.get('https://pure/one', dest)
+    assert cache.get('https://pure/two', dest) is None
+    assert cache.get('https://pure/one', dest)
+    assert cache.stats['cached_bytes'] == 9 + 15
+
+
+def test_interrupted_downloads_removed(cache_dir):
+    path = FileCache(cache_dir).temp_path()
+    FileCache(cache_dir)
+    assert not os.path.exists(path)
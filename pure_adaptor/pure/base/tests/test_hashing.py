@@ -0,0 +1,40 @@
+import hashlib
+
+from ..hashing import StreamHasher
+
+
+def test_hexdigests():
+    hasher = StreamHasher(('sha256', 'md5'))
+    hasher.update(b'some ')
+    hasher.update(memoryview(b'bytes'))
+    assert hasher.hexdigests() == {
+        'sha256': hashlib.sha256(b'some bytes').hexdigest(),
+        'md5': hashlib.md5(b'some bytes').hexdigest()}
+
+
+def test_reset():
+    hasher = StreamHasher()
+    hasher.update(b'a truncated download')
+    hasher.reset()
+    hasher.update(b'complete!')
+    assert hasher.hexdigests() == {
+        'sha256': hashlib.sha256(b'complete!').hexdigest()}
+
+
+def test_update_from_file(tmpdir):
+    path = tmpdir.join('a_file.dat')
+    path.write_binary(bytes(range(256)) * 10)
+    hasher = StreamHasher()
+    hasher.update_from_file(str(path), buffer_size=100)
+    assert hasher.hexdigests()['sha256'] == \
+        hashlib.sha256(bytes(range(256)) * 10).hexdigest()
+
+
+def test_update_from_file_mmap(tmpdir):
+    path = tmpdir.join('a_file.dat')
+    path.write_binary(bytes(range(256)) * 10)
+    hasher = StreamHasher()
+    hasher.update_from_file(str(path), buffer_size=100, use_mmap=True)
+    assert hasher.bytes_hashed == 2560
+    assert hasher.hexdigests()['sha256'] == \
+        hashlib.sha256(bytes(range(256)) * 10).hexdigest()
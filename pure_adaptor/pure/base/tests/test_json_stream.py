@@ -0,0 +1,63 @@
+import json
+import pytest
+
+from .. import json_stream
+from ..json_stream import JSONPageStream
+
+PAGE = {
+    'count': 3,
+    'items': [
+        {'uuid': 'a', 'title': 'Café ☕', 'size': 1.5e3},
+        {'uuid': 'b', 'nested': {'list': [1, [2, 3], {}]}, 'empty': []},
+        {'uuid': 'c', 'flag': True, 'none': None, 'number': -12},
+    ],
+    'navigationLink': [{'ref': 'next', 'href': 'https://pure/datasets'}],
+}
+
+BACKENDS = [False]
+if json_stream.ijson is not None:
+    BACKENDS.append(True)
+
+
+def chunked(data, chunk_size):
+    return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+
+@pytest.mark.parametrize('use_ijson', BACKENDS)
+@pytest.mark.parametrize('chunk_size', [1, 3, 64 * 1024])
+def test_items_and_page(use_ijson, chunk_size):
+    body = json.dumps(PAGE, indent=2).encode('utf-8')
+    stream = JSONPageStream(chunked(body, chunk_size), use_ijson=use_ijson)
+    assert list(stream) == PAGE['items']
+    assert stream.page == {'count': 3, 'items': [],
+                           'navigationLink': PAGE['navigationLink']}
+
+
+@pytest.mark.parametrize('use_ijson', BACKENDS)
+def test_items_yielded_incrementally(use_ijson):
+    body = json.dumps(PAGE).encode('utf-8')
+    read = []
+
+    def chunks():
+        for chunk in chunked(body, 8):
+            read.append(chunk)
+            yield chunk
+
+    items = iter(JSONPageStream(chunks(), use_ijson=use_ijson))
+    assert next(items)['uuid'] == 'a'
+    assert len(b''.join(read)) < len(body)
+
+
+@pytest.mark.parametrize('use_ijson', BACKENDS)
+@pytest.mark.parametrize('body', [b'{}', b'{"count": 0, "items": []}'])
+def test_empty_page(use_ijson, body):
+    stream = JSONPageStream(chunked(body, 2), use_ijson=use_ijson)
+    assert list(stream) == []
+    assert stream.page.get('count', 0) == 0
+
+
+@pytest.mark.parametrize('use_ijson', BACKENDS)
+def test_truncated_page(use_ijson):
+    body = json.dumps(PAGE).encode('utf-8')[:-20]
+    with pytest.raises(Exception):
+        list(JSONPageStream(chunked(body, 16), use_ijson=use_ijson))
@@ -0,0 +1,42 @@
+import pytest
+
+from ..page_size import AdaptivePageSize
+
+
+def test_grows_towards_target_time():
+    page_size = AdaptivePageSize(20, 10, 200, target_seconds=2.0)
+    page_size.record(1.0, 1000)
+    assert page_size.size == 40
+    page_size.record(0.01, 1000)
+    assert page_size.size == 80
+
+
+def test_shrinks_towards_target_time():
+    page_size = AdaptivePageSize(100, 10, 200, target_seconds=2.0)
+    page_size.record(2.5, 1000)
+    assert page_size.size == 80
+    page_size.record(60.0, 1000)
+    assert page_size.size == 40
+
+
+def test_limited_by_page_bytes():
+    page_size = AdaptivePageSize(100, 10, 200, max_page_bytes=1000)
+    page_size.record(0.1, 1250)
+    assert page_size.size == 80
+
+
+def test_bounds():
+    page_size = AdaptivePageSize(150, 10, 200)
+    page_size.record(0.1, 1000)
+    assert page_size.size == 200
+    with pytest.raises(ValueError):
+        AdaptivePageSize(20, 50, 10)
+
+
+def test_back_off():
+    page_size = AdaptivePageSize(40, 10, 200)
+    assert page_size.back_off() is True
+    assert page_size.size == 20
+    assert page_size.back_off() is True
+    assert page_size.back_off() is False
+    assert page_size.size == 10
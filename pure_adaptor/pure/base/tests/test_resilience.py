@@ -0,0 +1,56 @@
+import pytest
+
+from ..resilience import (CircuitBreaker, CircuitOpenError, RetryPolicy,
+                          TokenBucket)
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_retry_backoff_is_bounded():
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=4.0)
+    for attempt in range(1, 10):
+        delay = policy.backoff(attempt)
+        assert 0 <= delay <= min(4.0, 0.5 * 2 ** (attempt - 1))
+
+
+def test_retry_after():
+    policy = RetryPolicy(backoff_max=30.0)
+    assert policy.backoff(1, '7') == 7.0
+    assert policy.backoff(1, '120') == 120.0
+    assert policy.backoff(1, 'Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_retry_after_beyond_limit():
+    policy = RetryPolicy(max_retry_after=60.0)
+    assert policy.backoff(1, '60') == 60.0
+    assert policy.backoff(1, '61') is None
+
+
+def test_retry_statuses():
+    policy = RetryPolicy()
+    assert policy.should_retry_status(503)
+    assert policy.should_retry_status(429)
+    assert not policy.should_retry_status(404)
+
+
+def test_circuit_breaker_opens_and_resets():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.0)
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+
+
+def test_circuit_breaker_open_error():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60.0)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
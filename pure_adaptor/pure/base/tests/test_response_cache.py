@@ -0,0 +1,84 @@
+import os
+import pytest
+import tempfile
+
+from ..response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache_dir():
+    temp_dir = tempfile.TemporaryDirectory()
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+@pytest.fixture
+def validators():
+    return {'ETag': '"an_etag"',
+            'Last-Modified': 'Wed, 05 Jul 2016 15:53:57 GMT'}
+
+
+def store(cache, key, url, headers, body):
+    """ Streams a response body through the cache in two chunks. """
+    chunks = [body[:len(body) // 2], body[len(body) // 2:]]
+    return b''.join(cache.caching_chunks(key, url, headers, chunks))
+
+
+def cached_body(cache, key):
+    chunks = cache.cached_chunks(key, chunk_size=4)
+    return None if chunks is None else b''.join(chunks)
+
+
+def test_conditional_request(cache_dir, validators):
+    cache = ResponseCache(cache_dir)
+    key = cache.key('https://pure/datasets', {'size': 20})
+    assert cache.conditional_headers(key) == {}
+    body = store(cache, key, 'https://pure/datasets', validators,
+                 b'{"items": []}')
+    assert body == b'{"items": []}'
+    assert cache.conditional_headers(key) == {
+        'If-None-Match': '"an_etag"',
+        'If-Modified-Since': 'Wed, 05 Jul 2016 15:53:57 GMT'}
+    assert cached_body(cache, key) == b'{"items": []}'
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+    assert cache.stats['bytes_saved'] == 13
+
+
+def test_response_without_validators(cache_dir):
+    cache = ResponseCache(cache_dir)
+    key = cache.key('https://pure/datasets')
+    assert store(cache, key, 'https://pure/datasets', {}, b'{}') == b'{}'
+    assert cached_body(cache, key) is None
+
+
+def test_partially_read_response(cache_dir, validators):
+    cache = ResponseCache(cache_dir)
+    key = cache.key('https://pure/datasets')
+    chunks = cache.caching_chunks(key, 'https://pure/datasets', validators,
+                                  [b'{"items"', b': []}'])
+    next(chunks)
+    chunks.close()
+    assert cached_body(cache, key) is None
+    assert os.listdir(cache_dir) == []
+
+
+def test_persisted_across_instances(cache_dir, validators):
+    key = ResponseCache(cache_dir).key('https://pure/datasets')
+    store(ResponseCache(cache_dir), key, 'https://pure/datasets',
+          validators, b'{}')
+    assert cached_body(ResponseCache(cache_dir), key) == b'{}'
+
+
+def test_lru_eviction(cache_dir, validators):
+    cache = ResponseCache(cache_dir, max_bytes=20)
+    keys = [cache.key('https://pure/datasets/{}'.format(i))
+            for i in range(3)]
+    store(cache, keys[0], 'first', validators, b'0' * 10)
+    store(cache, keys[1], 'second', validators, b'1' * 10)
+    cached_body(cache, keys[0])
+    store(cache, keys[2], 'third', validators, b'2' * 10)
+    assert cached_body(cache, keys[1]) is None
+    assert cached_body(cache, keys[0]) == b'0' * 10
+    assert cached_body(cache, keys[2]) == b'2' * 10
+    assert cache.stats['cached_bytes'] == 20
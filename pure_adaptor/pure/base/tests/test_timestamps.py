@@ -0,0 +1,42 @@
+import datetime
+import dateutil.parser
+import pytest
+
+from ..timestamps import parse_iso8601
+
+
+@pytest.mark.parametrize('date_string', [
+    '2017-05-16T15:50:27.337+0000',
+    '2017-05-16T15:50:27.337+01:00',
+    '2017-05-16T15:50:27-0530',
+    '2017-05-16T15:50:27.123456Z',
+    '2017-05-16 15:50:27+02',
+    '2017-05-16T15:50:27',
+])
+def test_matches_dateutil(date_string):
+    parsed = parse_iso8601(date_string)
+    expected = dateutil.parser.parse(date_string)
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+def test_utc_offsets():
+    assert parse_iso8601('2017-05-16T15:50:27.337+0000').tzinfo is \
+        datetime.timezone.utc
+    assert parse_iso8601('2017-05-16T15:50:27Z').tzinfo is \
+        datetime.timezone.utc
+
+
+def test_fraction_beyond_microseconds():
+    parsed = parse_iso8601('2017-05-16T15:50:27.123456789Z')
+    assert parsed.microsecond == 123456
+
+
+def test_isoformat_round_trip():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert parse_iso8601(now.isoformat()) == now
+
+
+def test_falls_back_to_dateutil():
+    assert parse_iso8601('16 May 2017 15:50') == \
+        datetime.datetime(2017, 5, 16, 15, 50)
@@ -0,0 +1,54 @@
+import datetime
+import functools
+import re
+
+import dateutil.parser
+
+# The ISO-8601 timestamps produced by Pure, e.g. 2017-05-16T15:50:27.337+0000
+ISO_8601_PATTERN = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})'
+    r'(?:[.,](\d{1,6})\d*)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)?$'
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _timezone(offset):
+    """ The fixed offset timezone for a UTC offset such as Z, +0100 or
+        -05:30.
+        :returns: datetime.tzinfo
+        """
+    if offset == 'Z':
+        return datetime.timezone.utc
+    sign = -1 if offset[0] == '-' else 1
+    digits = offset[1:].replace(':', '')
+    minutes = int(digits[:2]) * 60 + int(digits[2:] or 0)
+    if not minutes:
+        return datetime.timezone.utc
+    return datetime.timezone(datetime.timedelta(minutes=sign * minutes))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_iso8601(date_string):
+    """ Parses an ISO-8601 timestamp with a regular expression, falling back
+        to dateutil for any other format. Recently parsed timestamps are
+        cached, as the same modified date is typically parsed more than once
+        per dataset.
+        :date_string: String
+        :returns: datetime.datetime
+        """
+    match = ISO_8601_PATTERN.match(date_string)
+    if not match:
+        return dateutil.parser.parse(date_string)
+    (year, month, day, hour, minute, second,
+     fraction, offset) = match.groups()
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    tzinfo = _timezone(offset) if offset else None
+    try:
+        return datetime.datetime(
+            int(year), int(month), int(day), int(hour), int(minute),
+            int(second), microsecond, tzinfo)
+    except ValueError:
+        # e.g. a leap second, which dateutil rejects or handles as it sees
+        # fit.
+        return dateutil.parser.parse(date_string)
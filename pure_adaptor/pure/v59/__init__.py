@@ -1,5 +1,6 @@
 from .api import PureAPI
+from .async_api import AsyncPureAPI
 from .models import PureDataset
 from .download_manager import PureDownloadManager
 
-__all__ = ['PureAPI', 'PureDataset', 'PureDownloadManager']
+__all__ = ['AsyncPureAPI', 'PureAPI', 'PureDataset', 'PureDownloadManager']
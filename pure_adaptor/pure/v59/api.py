@@ -1,54 +1,68 @@
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import json
+import os
 import requests
+import shutil
+import tempfile
+import time
 import urllib
-import dateutil.parser
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError, SSLError
 import logging
 
-from ..base import BasePureAPI
-from .models import PureDataset
+from ..base import (AdaptivePageSize, BasePureAPI, CircuitBreaker,
+                    DiskBudget, DownloadProgress, FileCache, JSONPageStream,
+                    ResponseCache, RetryPolicy, TokenBucket, parse_iso8601)
+from .checksum import ChecksumGenerator
+from .models import CHECKSUM_ALGORITHM, PureDataset
 
 logger = logging.getLogger(__name__)
 
 
-class PureAPI(BasePureAPI):
+class IncompleteDownloadError(requests.exceptions.RequestException):
+    """ Raised when fewer bytes are received than the response advertised.
+        """
+    pass
 
-    """Abstraction over the Pure API v5.9"""
 
-    def __init__(self, endpoint_url, api_key):
+class RangeIgnoredError(requests.exceptions.RequestException):
+    """ Raised when a ranged request is answered with the whole file, e.g.
+        because the file has changed since the download began.
         """
-        :endpoint_url: The base url of the API endpoint
-        :api_key: The api key provided for authentication
+    pass
 
-        """
-        self._endpoint_url = endpoint_url
-        self._split_endpoint_url = urllib.parse.urlsplit(endpoint_url)
-        self._api_key = api_key
-        try:
-            self._api_is_accessible()
-        except requests.exceptions.RequestException:
-            logging.exception('PureAPI v59 initialisation failed.')
 
-    def __str__(self):
-        return 'Pure REST API v5.9: {}'.format(self._endpoint_url)
+class PureAPIMixin(object):
 
-    def _api_is_accessible(self, **kwargs):
-        """ Checks that the API is accessible and it is possible to
-            authenticate against it.
-            :returns: Boolean
+    """ Request building and response handling shared by the v5.9 clients,
+        which expect the endpoint url to be set as _endpoint_url and
+        _split_endpoint_url."""
+
+    # Fields of a listing item needed to find changed datasets, as listed by
+    # changed_dataset_refs.
+    TWO_PHASE_LISTING_FIELDS = ('uuid', 'info.modifiedDate')
+
+    def _to_dataset(self, dataset_json=None, raw_json=None):
+        """ Initialise a PureDataset from dataset json, or the raw bytes of
+            a response holding it, binding this API client instance to it
+            for use by the PureDownloadManager.
             """
-        endpoint = '/datasets'
-        url = self._create_url(endpoint)
-        kwargs = self._update_headers(kwargs, {'api-key': self._api_key})
-        try:
-            response = requests.head(url, **kwargs)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logging.exception('Unable to access Pure API v59 due to: %s', e)
+        return PureDataset(dataset_json, self, raw_json=raw_json)
 
-    def _to_dataset(self, dataset_json):
-        """ Initialise a PureDataset from dataset json, binding this instance
-            of the PureAPI to it for use by the PureDownloadManager.
+    def _checksum_algorithms(self, algorithms):
+        """ Validates the names of the hash algorithms computed of each
+            document, adding the algorithm of the checksums recorded in the
+            dataset state.
+            :returns: (String,)
             """
-        return PureDataset(dataset_json, self)
+        for algorithm in algorithms:
+            hashlib.new(algorithm)
+        return (CHECKSUM_ALGORITHM,) + tuple(
+            a for a in algorithms if a != CHECKSUM_ALGORITHM)
 
     def _create_path(self, path):
         path_parts = self._split_endpoint_url[2].split('/')
@@ -65,18 +79,6 @@ class PureAPI(BasePureAPI):
         ]
         return urllib.parse.urlunsplit(url_parts)
 
-    def _update_headers(self, kwargs_dict, new_headers):
-        """ Update the headers in kwargs with new values.
-
-        :kwargs_dict: dict
-        :new_headers: dict
-        :returns: dict
-
-        """
-        headers = kwargs_dict.get('headers', dict())
-        kwargs_dict['headers'] = {**headers, **new_headers}
-        return kwargs_dict
-
     def _navigation_links(self, json_dict):
         """ Extracts and returns navigation links from a json response.
 
@@ -89,68 +91,944 @@ class PureAPI(BasePureAPI):
             navigation_links[nav_link['ref']] = nav_link['href']
         return navigation_links
 
-    def _response_items(self, json_dict, items=list(), cont_func=None):
-        """ Extracts items from a response and appends them to an existing set
-            of responses if provided. If a continue function is provided this
-            will be used to filter items and conditionally set a continue flag
-            (otherwise True).
+    def _response_items(self, json_dict, cont_func=None):
+        """ Extracts items from a response. If a continue function is provided
+            this will be used to filter items and conditionally set a continue
+            flag (otherwise True).
 
             :returns: tuple(bool, list)
             """
-        new_items = json_dict.get('items', list())
+        items = json_dict.get('items', list())
         cont = True
         if cont_func:
-            filtered_new_items = list(filter(cont_func, new_items))
-            if len(filtered_new_items) != len(new_items):
-                new_items = filtered_new_items
+            filtered_items = list(filter(cont_func, items))
+            if len(filtered_items) != len(items):
+                items = filtered_items
                 cont = False
-        return cont, items + new_items
+        return cont, items
 
-    def _get(self, url, *args, **kwargs):
-        """ Abstraction over requests.get that includes PURE api key.
+    def _dataset_ref(self, dataset_json):
+        """ The uuid and modified datetime of a dataset listing item.
+            :returns: tuple(string, datetime)
             """
-        kwargs = self._update_headers(kwargs, {'api-key': self._api_key})
-        return requests.get(url, *args, **kwargs)
+        return (dataset_json['uuid'],
+                parse_iso8601(dataset_json['info']['modifiedDate']))
+
+    def _changed_since(self, since_datetime):
+        """ Builds a continue function for _response_items that filters out
+            datasets not modified since the provided datetime.
+            """
+        def changed_since(dataset_json):
+            updated = dataset_json.get('info').get('modifiedDate')
+            return parse_iso8601(updated) > since_datetime
+        return changed_since
+
+
+class PureAPI(PureAPIMixin, BasePureAPI):
+
+    """Abstraction over the Pure API v5.9"""
+
+    # Bytes read at a time from the body of a json response.
+    JSON_CHUNK_SIZE = 64 * 1024
+
+    # Transient failures after which an idempotent request is retried.
+    RETRYABLE_EXCEPTIONS = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        IncompleteDownloadError,
+    )
+
+    def __init__(self, endpoint_url, api_key, pool_size=10,
+                 download_pool_size=4, prefetch_workers=1,
+                 cache_dir=None, cache_max_bytes=256 * 1024 * 1024,
+                 timeout=None, min_page_size=10, max_page_size=None,
+                 target_page_seconds=2.0, max_page_bytes=None,
+                 rate_limit=None, rate_burst=1,
+                 max_attempts=5, max_retry_after=600.0,
+                 circuit_failure_threshold=5,
+                 circuit_reset_seconds=60.0, stream_json=False,
+                 segment_size=None, segment_workers=4,
+                 partial_download_dir=None,
+                 partial_download_max_age=7 * 24 * 60 * 60,
+                 download_buffer_size=1024 * 1024,
+                 preallocate_downloads=False, checksum_workers=None,
+                 checksum_algorithms=('md5', 'sha256'), file_cache_dir=None,
+                 file_cache_max_bytes=10 * 1024 * 1024 * 1024,
+                 scratch_max_bytes=None):
+        """
+        :endpoint_url: The base url of the API endpoint
+        :api_key: The api key provided for authentication
+        :pool_size: Keep-alive connections pooled per host for API requests
+        :download_pool_size: Keep-alive connections pooled per host for
+            document downloads from the Pure portal
+        :prefetch_workers: Listing pages requested concurrently, the default
+            of 1 follows navigation links one page at a time
+        :cache_dir: Directory of an on-disk cache of json responses, which
+            are revalidated with conditional requests. Disabled if None.
+        :cache_max_bytes: Size of the response cache before the least
+            recently used responses are evicted
+        :timeout: Seconds to wait for a response from Pure, or None to wait
+            indefinitely
+        :min_page_size: Lower bound of the adaptive page size
+        :max_page_size: Upper bound of the adaptive page size. If set, and
+            pages are not prefetched, the page size is adapted to the
+            response time of each page rather than fixed.
+        :target_page_seconds: Response time the adaptive page size aims for
+        :max_page_bytes: Response size the adaptive page size is kept
+            within, or None for no limit
+        :rate_limit: Requests per second made to Pure, or None for no limit
+        :rate_burst: Requests that may be made at once under the rate limit
+        :max_attempts: Attempts made at idempotent requests that fail
+            transiently, with jittered exponential back off in between
+        :max_retry_after: Longest Retry-After period that is waited for
+            before retrying, beyond which the request fails
+        :circuit_failure_threshold: Consecutive failed requests after which
+            further requests fail immediately with CircuitOpenError
+        :circuit_reset_seconds: Time before a request is tried again once
+            the circuit has opened
+        :stream_json: Parse linked listing pages as they are received,
+            yielding each dataset before the rest of its page has arrived
+        :segment_size: Bytes fetched by each ranged request when a document
+            larger than this is downloaded in segments, resuming from the
+            missing segments if interrupted. Disabled if None.
+        :segment_workers: Segments of a document downloaded concurrently,
+            which should not exceed the download pool size
+        :partial_download_dir: Directory segmented downloads are written to,
+            keyed by url, until they complete. Must persist between runs for
+            downloads to be resumed, and should be on the same filesystem as
+            the downloaded documents so that a completed download is renamed
+            rather than copied. Defaults to a directory in the document
+            cache if there is one, otherwise in the system temporary
+            directory.
+        :partial_download_max_age: Seconds after which a partial download
+            that has not been resumed is removed
+        :download_buffer_size: Bytes read from a download at a time
+        :preallocate_downloads: Reserve the disk space for a document from
+            its Content-Length before writing it
+        :checksum_workers: Documents hashed concurrently when they could not
+            be hashed as they were downloaded, defaults to the number of CPUs
+        :checksum_algorithms: Digests computed of each document in a single
+            read of its bytes. A sha256 digest is always computed.
+        :file_cache_dir: Directory of a persistent cache of downloaded
+            documents, which are revalidated with conditional requests.
+            Disabled if None.
+        :file_cache_max_bytes: Size of the document cache before the least
+            recently used documents are evicted
+        :scratch_max_bytes: Bytes of scratch disk the downloaded documents
+            of datasets may take up at once, reserved from the
+            Content-Length of a HEAD request before they are requested.
+            Downloading a dataset whose documents exceed it by themselves
+            fails with DiskBudgetExceededError. Unlimited if None.
+
+        """
+        self._endpoint_url = endpoint_url
+        self._split_endpoint_url = urllib.parse.urlsplit(endpoint_url)
+        self._api_key = api_key
+        self._prefetch_workers = prefetch_workers
+        self._timeout = timeout
+        self._min_page_size = min_page_size
+        self._max_page_size = max_page_size
+        self._target_page_seconds = target_page_seconds
+        self._max_page_bytes = max_page_bytes
+        self._stream_json = stream_json
+        self._segment_size = segment_size
+        self._segment_workers = segment_workers
+        if not partial_download_dir:
+            partial_download_dir = os.path.join(
+                tempfile.gettempdir(), 'pure_adaptor_partial_downloads')
+            if file_cache_dir:
+                partial_download_dir = os.path.join(file_cache_dir,
+                                                    'partial')
+        self._partial_download_dir = partial_download_dir
+        self._partial_download_max_age = partial_download_max_age
+        self._download_buffer_size = download_buffer_size
+        self._preallocate_downloads = preallocate_downloads
+        self.checksum_algorithms = self._checksum_algorithms(
+            checksum_algorithms)
+        self.checksum_generator = ChecksumGenerator(
+            workers=checksum_workers,
+            extra_algorithms=self.checksum_algorithms)
+        self.file_cache = None
+        if file_cache_dir:
+            self.file_cache = FileCache(file_cache_dir, file_cache_max_bytes)
+        self.disk_budget = None
+        if scratch_max_bytes:
+            self.disk_budget = DiskBudget(scratch_max_bytes)
+        self._rate_limiter = None
+        if rate_limit:
+            self._rate_limiter = TokenBucket(rate_limit, rate_burst)
+        self._retry_policy = RetryPolicy(
+            max_attempts, max_retry_after=max_retry_after)
+        self._circuit_breaker = CircuitBreaker(circuit_failure_threshold,
+                                               circuit_reset_seconds)
+        self._response_cache = None
+        if cache_dir:
+            self._response_cache = ResponseCache(cache_dir, cache_max_bytes)
+        self._session = self._create_session(
+            pool_size,
+            {'api-key': api_key, 'Accept': 'application/json'}
+        )
+        self._download_session = self._create_session(
+            download_pool_size,
+            {'api-key': api_key}
+        )
+        if segment_size:
+            self._remove_stale_partial_downloads()
+        try:
+            self._api_is_accessible()
+        except requests.exceptions.RequestException:
+            logging.exception('PureAPI v59 initialisation failed.')
+
+    def __str__(self):
+        return 'Pure REST API v5.9: {}'.format(self._endpoint_url)
+
+    def _create_session(self, pool_size, headers):
+        """ Creates a requests Session holding a pool of keep-alive
+            connections per host, with headers sent on every request.
+            :pool_size: int
+            :headers: dict
+            :returns: requests.Session
+            """
+        session = requests.Session()
+        session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        """ Closes all pooled connections held by this instance.
+            """
+        if self._response_cache:
+            logger.info('Pure API response cache stats: %s',
+                        self._response_cache.stats)
+        if self.file_cache:
+            logger.info('Pure document cache stats: %s',
+                        self.file_cache.stats)
+        self._session.close()
+        self._download_session.close()
+
+    def _api_is_accessible(self, **kwargs):
+        """ Checks that the API is accessible and it is possible to
+            authenticate against it.
+            :returns: Boolean
+            """
+        endpoint = '/datasets'
+        url = self._create_url(endpoint)
+        try:
+            response = self._with_retries(
+                lambda: self._send(self._session.head, url, **kwargs))
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.exception('Unable to access Pure API v59 due to: %s', e)
+
+    def _send(self, send, url, *args, **kwargs):
+        """ Makes a single request through the rate limiter and circuit
+            breaker, raising an HTTPError for responses with a status that
+            is worth retrying.
+            :send: Bound request method of a session, e.g. Session.get
+            :returns: requests.Response
+            """
+        self._circuit_breaker.before_request()
+        if self._rate_limiter:
+            self._rate_limiter.acquire()
+        kwargs.setdefault('timeout', self._timeout)
+        try:
+            response = send(url, *args, **kwargs)
+        except self.RETRYABLE_EXCEPTIONS:
+            self._circuit_breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self._circuit_breaker.record_failure()
+        elif response.status_code != requests.codes.too_many_requests:
+            self._circuit_breaker.record_success()
+        if self._retry_policy.should_retry_status(response.status_code):
+            # Release the connection of a streamed response to the pool.
+            response.close()
+            response.raise_for_status()
+        return response
+
+    def _retry_delay(self, error, attempt, max_attempts):
+        """ The back off before retrying a request that failed with error on
+            the given attempt, or None if it should not be retried.
+            :returns: Float or None
+            """
+        if attempt >= max_attempts:
+            return None
+        if isinstance(error, requests.exceptions.HTTPError):
+            if not self._retry_policy.should_retry_status(
+                    error.response.status_code):
+                return None
+            retry_after = error.response.headers.get('Retry-After')
+        elif isinstance(error, self.RETRYABLE_EXCEPTIONS):
+            retry_after = None
+        else:
+            return None
+        delay = self._retry_policy.backoff(attempt, retry_after)
+        if delay is None:
+            logger.error('Giving up after attempt %s of %s failed, as '
+                         'Retry-After %s is too long: %s', attempt,
+                         max_attempts, retry_after, error)
+            return None
+        logger.warning('Retrying in %.2fs after attempt %s of %s '
+                       'failed: %s', delay, attempt, max_attempts, error)
+        return delay
+
+    def _with_retries(self, attempt_func, retry=True):
+        """ Calls attempt_func, retrying with back off if it fails with a
+            transient error. Only to be used for idempotent requests.
+            :attempt_func: Function making a single attempt at a request
+            :retry: Boolean: If False a single attempt is made
+            """
+        max_attempts = self._retry_policy.max_attempts if retry else 1
+        for attempt in itertools.count(1):
+            try:
+                return attempt_func()
+            except requests.exceptions.RequestException as e:
+                delay = self._retry_delay(e, attempt, max_attempts)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    def _get(self, url, *args, retry=True, **kwargs):
+        """ GET from the Pure API using the pooled API session, which
+            includes the PURE api key, retrying transient failures.
+            """
+        return self._with_retries(
+            lambda: self._send(self._session.get, url, *args, **kwargs),
+            retry)
 
     def _get_json(self, url, *args, **kwargs):
         """ GET json from url and return json object
             """
-        kwargs = self._update_headers(kwargs, {'Accept': 'application/json'})
+        return json.loads(self._get_json_body(url, *args, **kwargs))
+
+    def _get_json_body(self, url, *args, retry=True, **kwargs):
+        """ GET the body of a json response from url, retrying if reading
+            the body fails.
+            :returns: bytes
+            """
+        return self._with_retries(
+            lambda: b''.join(
+                self._get_json_chunks(url, *args, retry=False, **kwargs)),
+            retry)
+
+    def _get_json_chunks(self, url, *args, retry=True, **kwargs):
+        """ GET a json response from url, streaming its body in chunks. If
+            the response cache is enabled the request is made conditional on
+            the validators of any cached response, reusing its body if not
+            modified, and a modified body is cached as it streams.
+            :returns: iterator(bytes)
+            """
         logger.info('Getting json response from %s.', url)
-        response = self._get(url, *args, **kwargs)
-        return response.json()
+        kwargs['stream'] = True
+        if not self._response_cache:
+            response = self._get(url, *args, retry=retry, **kwargs)
+            return self._iter_response(response)
+
+        cache_key = self._response_cache.key(url, kwargs.get('params'))
+        headers = kwargs.pop('headers', {})
+        conditional_headers = {
+            **headers, **self._response_cache.conditional_headers(cache_key)}
+        response = self._get(url, *args, retry=retry,
+                             headers=conditional_headers, **kwargs)
+        if response.status_code == requests.codes.not_modified:
+            response.close()
+            chunks = self._response_cache.cached_chunks(
+                cache_key, self.JSON_CHUNK_SIZE)
+            if chunks is not None:
+                logger.debug('Using cached response for %s.', url)
+                return chunks
+            response = self._get(url, *args, retry=retry, headers=headers,
+                                 **kwargs)
+        return self._response_cache.caching_chunks(
+            cache_key, url, response.headers, self._iter_response(response))
 
-    def download_file(self, url, dest, *args, **kwargs):
-        """ Wrapper around the get method to use for streaming download
-            of files.
+    def _iter_response(self, response):
+        """ Raises an HTTPError for an unsuccessful streamed response,
+            otherwise returns an iterator over the chunks of its body that
+            closes the response once read.
+            :returns: iterator(bytes)
             """
-        with self._get(url, stream=True) as r:
-            with open(dest, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    f.write(chunk)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+
+        def chunks():
+            with response:
+                yield from response.iter_content(self.JSON_CHUNK_SIZE)
+        return chunks()
+
+    def _check_complete(self, response, bytes_received):
+        """ Raises IncompleteDownloadError if fewer bytes were received than
+            the Content-Length of an unencoded response.
+            """
+        content_length = response.headers.get('Content-Length')
+        if content_length is None or \
+                response.headers.get('Content-Encoding', 'identity') \
+                != 'identity':
+            return
+        if bytes_received != int(content_length):
+            raise IncompleteDownloadError(
+                'Received {} of {} bytes from {}'.format(
+                    bytes_received, content_length, response.url))
+
+    def _write_response(self, response, f_out, hasher=None):
+        """ Writes the body of a streamed response to an unbuffered file.
+            Unless the body has a content encoding to decode, it is read
+            from the underlying http.client response straight into a single
+            reusable buffer, rather than through urllib3's read, which
+            allocates a bytes object for every chunk.
+            :hasher: StreamHasher updated with each chunk as it is written,
+                or None
+            :returns: Int: bytes written
+            """
+        bytes_received = 0
+        if response.headers.get('Content-Encoding', 'identity') != \
+                'identity':
+            for chunk in response.iter_content(
+                    chunk_size=self._download_buffer_size):
+                self._write_all(f_out, chunk)
+                if hasher:
+                    hasher.update(chunk)
+                bytes_received += len(chunk)
+            return bytes_received
+
+        raw = response.raw
+        buffer = memoryview(bytearray(self._download_buffer_size))
+        while True:
+            bytes_read = self._readinto(raw, buffer)
+            if not bytes_read:
+                return bytes_received
+            self._write_all(f_out, buffer[:bytes_read])
+            if hasher:
+                hasher.update(buffer[:bytes_read])
+            bytes_received += bytes_read
+
+    def _readinto(self, raw, buffer):
+        """ Reads from the raw urllib3 response into buffer, raising the
+            requests exceptions that iter_content would for a failed read so
+            that the download is retried. The file object urllib3 wraps is
+            read directly, within urllib3's error handling so that its
+            exceptions are raised and the connection is returned to the pool
+            once the body has been read.
+            :returns: Int: bytes read
+            """
+        fp = getattr(raw, '_fp', None)
+        try:
+            if fp is None or not hasattr(raw, '_error_catcher'):
+                return raw.readinto(buffer)
+            with raw._error_catcher():
+                return fp.readinto(buffer)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+        except SSLError as e:
+            raise requests.exceptions.SSLError(e)
+
+    def _write_all(self, f_out, data):
+        """ Writes all of data to an unbuffered file, which may accept less
+            than it is given in a single write.
+            """
+        data = memoryview(data)
+        while data:
+            data = data[f_out.write(data):]
+
+    def _preallocate(self, f_out, size):
+        """ Reserves size bytes of disk for a file, falling back to
+            extending it where the platform or filesystem cannot allocate
+            space up front.
+            """
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f_out.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f_out.truncate(size)
+
+    def download_file(self, url, dest, hasher=None, reserve=None):
+        """ Downloads a file over the pooled download session, as described
+            by download_file_if_modified.
+            :hasher: StreamHasher updated with the bytes of the file as
+                they are written, or None
+            :reserve: Callable given the size of the file before it is
+                requested, or None
+            """
+        self.download_file_if_modified(url, dest, hasher=hasher,
+                                       reserve=reserve)
         return dest
 
-    def list_all_datasets(self, size=20, order='-modified', cont_func=None):
-        """ List the metadata objects for all datasets.
-            Defaults to most recently modified objects first.
-        :returns: [PureDataset]
+    def download_file_if_modified(self, url, dest, conditional_headers=None,
+                                  hasher=None, reserve=None):
+        """ Downloads a file over the pooled download session, unless Pure
+            responds Not Modified to the conditional headers. If the
+            instance has a segment size, files larger than it are downloaded
+            in concurrent ranged segments when the server accepts ranges.
+            Otherwise the file is streamed, downloading it again if the
+            transfer fails or is truncated.
+            :conditional_headers: dict: If-None-Match and If-Modified-Since
+                headers of a previously downloaded copy of the file
+            :hasher: StreamHasher updated with the bytes of the file as
+                they are written, or None. A file downloaded in segments is
+                hashed as each segment extends the contiguous prefix of the
+                file that has been written.
+            :reserve: Callable given the size of the file from the
+                Content-Length of a HEAD request, or 0 if it is not known,
+                before the file is requested, e.g. to reserve disk space for
+                it. It may block, as no connection is held open while it
+                does, or raise to abandon the download.
+            :returns: The headers of the download response, or None if the
+                file has not been modified
+            """
+        conditional_headers = conditional_headers or {}
+        head_response = None
+        if self._segment_size or reserve:
+            head_response = self._head(url, conditional_headers)
+            if head_response is not None and head_response.status_code == \
+                    requests.codes.not_modified:
+                return None
+        if reserve:
+            size = 0
+            if head_response is not None and head_response.ok:
+                size = int(head_response.headers.get('Content-Length') or 0)
+            reserve(size)
+        if self._segment_size:
+            segmented_info = self._segmented_download_info(head_response)
+            if segmented_info:
+                partial_path = self._partial_download_path(url)
+                try:
+                    self._download_segments(url, partial_path,
+                                            *segmented_info, hasher=hasher)
+                except RangeIgnoredError as e:
+                    logger.warning('Downloading %s as a single stream: %s',
+                                   url, e)
+                else:
+                    shutil.move(partial_path, dest)
+                    return head_response.headers
+        return self._download_stream(url, dest, hasher, conditional_headers)
 
-        """
+    def stream_file(self, url, hasher=None):
+        """ Yields the body of a file as it is received, without writing it
+            to disk. If the transfer fails part way through, it is resumed
+            from the bytes already yielded with a ranged request, as long as
+            the file has a validator to show it has not changed since.
+            Otherwise the failure is raised, and the caller must start
+            again.
+            :hasher: StreamHasher updated with each chunk as it is yielded,
+                or None
+            :returns: generator(bytes)
+            """
+        bytes_yielded = 0
+        validator = None
+        for attempt in itertools.count(1):
+            headers = {}
+            if bytes_yielded:
+                headers['Range'] = 'bytes={}-'.format(bytes_yielded)
+                headers['If-Range'] = validator
+            try:
+                with self._send(self._download_session.get, url, stream=True,
+                                headers=headers) as r:
+                    r.raise_for_status()
+                    if bytes_yielded and \
+                            r.status_code != requests.codes.partial_content:
+                        raise RangeIgnoredError(
+                            'Requested bytes {}- of {} but received status '
+                            '{}'.format(bytes_yielded, url, r.status_code))
+                    if not bytes_yielded and r.headers.get(
+                            'Content-Encoding', 'identity') == 'identity':
+                        validator = self._range_validator(r.headers)
+                    bytes_received = 0
+                    for chunk in r.iter_content(self._download_buffer_size):
+                        if hasher:
+                            hasher.update(chunk)
+                        bytes_received += len(chunk)
+                        bytes_yielded += len(chunk)
+                        yield chunk
+                    self._check_complete(r, bytes_received)
+                return
+            except requests.exceptions.RequestException as e:
+                delay = None
+                if validator or not bytes_yielded:
+                    delay = self._retry_delay(
+                        e, attempt, self._retry_policy.max_attempts)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    def _partial_download_path(self, url):
+        """ The path a segmented download is written to until it completes,
+            which is the same for a url in every run so that a later run can
+            resume it.
+            :returns: String
+            """
+        os.makedirs(self._partial_download_dir, exist_ok=True)
+        return os.path.join(
+            self._partial_download_dir,
+            '{}.partial'.format(hashlib.sha256(url.encode()).hexdigest()))
+
+    def _remove_stale_partial_downloads(self):
+        """ Removes partial downloads that have not been resumed within the
+            maximum age, e.g. those of documents removed from Pure.
+            """
+        try:
+            file_names = os.listdir(self._partial_download_dir)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - self._partial_download_max_age
+        for file_name in file_names:
+            path = os.path.join(self._partial_download_dir, file_name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    logger.info('Removing stale partial download %s', path)
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _download_stream(self, url, dest, hasher=None,
+                         conditional_headers=None):
+        def attempt_download():
+            if hasher:
+                hasher.reset()
+            with self._send(self._download_session.get, url, stream=True,
+                            headers=conditional_headers) as r:
+                r.raise_for_status()
+                if r.status_code == requests.codes.not_modified:
+                    return None
+                content_length = r.headers.get('Content-Length')
+                with open(dest, 'wb', buffering=0) as f_out:
+                    if self._preallocate_downloads and content_length:
+                        self._preallocate(f_out, int(content_length))
+                    bytes_received = self._write_response(r, f_out, hasher)
+                    f_out.truncate(bytes_received)
+                self._check_complete(r, bytes_received)
+                return r.headers
+        return self._with_retries(attempt_download)
+
+    def _head(self, url, headers):
+        """ Requests the headers of a file, or None if the request fails.
+            """
+        try:
+            return self._with_retries(lambda: self._send(
+                self._download_session.head, url, allow_redirects=True,
+                headers=headers))
+        except requests.exceptions.HTTPError as e:
+            logger.warning('Unable to find whether %s accepts ranges: %s',
+                           url, e)
+            return None
+
+    def _segmented_download_info(self, response):
+        """ Finds the size and validator of a file that can be downloaded in
+            ranged segments from the response to a HEAD request, or None if
+            the request failed, the server does not accept ranges or the
+            file is no larger than a segment.
+            :returns: tuple(int, string) or None
+            """
+        if response is None or not response.ok:
+            return None
+        headers = response.headers
+        if headers.get('Accept-Ranges', 'none').lower() != 'bytes' or \
+                headers.get('Content-Encoding', 'identity') != 'identity':
+            return None
+        size = int(headers.get('Content-Length', 0))
+        if size <= self._segment_size:
+            return None
+        return size, self._range_validator(headers)
+
+    def _range_validator(self, headers):
+        """ The validator of a response for use in an If-Range header, which
+            only accepts a strong ETag or a Last-Modified date.
+            :returns: String or None
+            """
+        etag = headers.get('ETag')
+        if etag and etag.startswith('W/'):
+            etag = None
+        return etag or headers.get('Last-Modified')
+
+    def _download_segments(self, url, dest, size, validator, hasher=None):
+        """ Downloads the missing segments of a file concurrently, each
+            written at its offset in the preallocated file, recording
+            progress so an interrupted download can be resumed.
+            :hasher: StreamHasher updated with each segment, read back while
+                it is still in the page cache, as soon as every segment
+                before it has been written, or None
+            """
+        progress = DownloadProgress(dest, url, size, validator,
+                                    self._segment_size)
+        if not progress.resuming:
+            with open(dest, 'wb', buffering=0) as f_out:
+                if self._preallocate_downloads:
+                    self._preallocate(f_out, size)
+                else:
+                    f_out.truncate(size)
+        hash_prefix = None
+        if hasher:
+            hasher.reset()
+            hash_prefix = self._prefix_hasher(dest, progress, hasher)
+            next(hash_prefix)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._segment_workers) as executor:
+            futures = [
+                executor.submit(self._download_segment, url, dest, start,
+                                end, validator)
+                for start, end in progress.missing_segments]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    progress.complete(future.result())
+                    if hash_prefix:
+                        next(hash_prefix)
+            except BaseException as e:
+                for future in futures:
+                    future.cancel()
+                if isinstance(e, RangeIgnoredError):
+                    progress.remove()
+                    os.remove(dest)
+                raise
+            finally:
+                if hash_prefix:
+                    hash_prefix.close()
+        progress.remove()
+        return dest
+
+    def _prefix_hasher(self, dest, progress, hasher):
+        """ A generator that, each time it is resumed, hashes the completed
+            segments of dest that follow the bytes hashed so far, stopping
+            at the first segment still missing.
+            """
+        buffer = memoryview(bytearray(self._download_buffer_size))
+        with open(dest, 'rb', buffering=0) as f_in:
+            for start, end in progress.segments:
+                while not progress.is_complete(start):
+                    yield
+                f_in.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    bytes_read = f_in.readinto(buffer[:remaining])
+                    if not bytes_read:
+                        break
+                    hasher.update(buffer[:bytes_read])
+                    remaining -= bytes_read
+        while True:
+            yield
+
+    def _download_segment(self, url, dest, start, end, validator):
+        """ Downloads the inclusive byte range of a file from start to end
+            into the same range of dest, retrying if it fails or is
+            truncated.
+            :returns: Int: start
+            """
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if validator:
+            headers['If-Range'] = validator
+
+        def attempt_segment():
+            with self._send(self._download_session.get, url, headers=headers,
+                            stream=True) as r:
+                r.raise_for_status()
+                if r.status_code != requests.codes.partial_content:
+                    raise RangeIgnoredError(
+                        'Requested bytes {}-{} of {} but received status '
+                        '{}'.format(start, end, url, r.status_code))
+                with open(dest, 'r+b', buffering=0) as f_out:
+                    f_out.seek(start)
+                    bytes_received = self._write_response(r, f_out)
+            if bytes_received != end - start + 1:
+                raise IncompleteDownloadError(
+                    'Received {} of {} bytes from {}'.format(
+                        bytes_received, end - start + 1, url))
+            return start
+        return self._with_retries(attempt_segment)
+
+    def _linked_pages(self, url, query):
+        """ Yields listing pages one at a time, following the next navigation
+            link of each page. If json is streamed each page is yielded as a
+            generator of its items, which must be read before the next page
+            is requested.
+            """
+        params = query
+        while url:
+            if self._stream_json:
+                json_response = {}
+                items = self._streamed_page_items(url, params, json_response)
+                try:
+                    yield items
+                finally:
+                    items.close()
+            else:
+                json_response = self._get_json(url, params=params)
+                yield json_response
+            url = self._navigation_links(json_response).get('next')
+            params = None
+
+    def _streamed_page_items(self, url, params, page):
+        """ Yields the items of a listing page as they are parsed, updating
+            page with the rest of its members once it has been read. If the
+            page fails part way through, it is requested again with back
+            off, skipping the items already yielded.
+            :page: dict
+            """
+        items_yielded = 0
+        for attempt in itertools.count(1):
+            stream = JSONPageStream(self._get_json_chunks(url, params=params))
+            try:
+                for index, item in enumerate(stream):
+                    if index >= items_yielded:
+                        items_yielded += 1
+                        yield item
+                page.update(stream.page)
+                return
+            except requests.exceptions.RequestException as e:
+                delay = self._retry_delay(
+                    e, attempt, self._retry_policy.max_attempts)
+                if delay is None:
+                    raise
+            finally:
+                stream.close()
+            time.sleep(delay)
+
+    def _prefetched_pages(self, url, query):
+        """ Yields listing pages in order, using the count from the first
+            page to request the remaining pages by offset across a bounded
+            pool of workers. Pages not yet consumed when the generator is
+            closed are cancelled.
+            """
+        json_response = self._get_json(url, params=query)
+        yield json_response
+        size = query['size']
+        offsets = iter(range(size, json_response.get('count', 0), size))
+
+        def submit(executor, offset):
+            return executor.submit(
+                self._get_json, url, params={**query, 'offset': offset})
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._prefetch_workers) as executor:
+            in_flight = collections.deque(
+                submit(executor, offset) for offset in
+                itertools.islice(offsets, self._prefetch_workers))
+            try:
+                while in_flight:
+                    json_response = in_flight.popleft().result()
+                    offset = next(offsets, None)
+                    if offset is not None:
+                        in_flight.append(submit(executor, offset))
+                    yield json_response
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _adaptive_pages(self, url, query):
+        """ Yields listing pages one at a time by offset, adapting the page
+            size to the time taken by each page and backing off when pages
+            time out. Other failures, including time outs at the minimum page
+            size, are retried with back off.
+            """
+        page_size = AdaptivePageSize(
+            query['size'], self._min_page_size, self._max_page_size,
+            self._target_page_seconds, self._max_page_bytes)
+        offset = 0
+        attempt = 0
+        while True:
+            page_query = {**query, 'size': page_size.size, 'offset': offset}
+            start = time.monotonic()
+            try:
+                body = self._get_json_body(url, params=page_query,
+                                           retry=False)
+            except requests.exceptions.RequestException as e:
+                if self._is_page_timeout(e) and page_size.back_off():
+                    continue
+                attempt += 1
+                delay = self._retry_delay(
+                    e, attempt, self._retry_policy.max_attempts)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            attempt = 0
+            page_size.record(time.monotonic() - start, len(body))
+            json_response = json.loads(body)
+            yield json_response
+            items = json_response.get('items', list())
+            offset += len(items)
+            if not items or offset >= json_response.get('count', 0):
+                return
+
+    def _is_page_timeout(self, exception):
+        """ Whether a request failed because Pure, or a gateway in front of
+            it, took too long to serve a page.
+            """
+        if isinstance(exception, requests.exceptions.Timeout):
+            return True
+        response = getattr(exception, 'response', None)
+        return response is not None and response.status_code in (
+            requests.codes.bad_gateway,
+            requests.codes.service_unavailable,
+            requests.codes.gateway_timeout)
+
+    def _iter_listing_items(self, size=20, order='-modified',
+                            cont_func=None, fields=None):
+        """ Yields the json of each item of the dataset listing a page at a
+            time. If the instance has more than one prefetch worker, pages
+            are requested concurrently by offset, otherwise if the instance
+            has a maximum page size the page size is adapted from the initial
+            size to the response time of each page. Items from a streamed
+            page are yielded as they are parsed.
+            :fields: String: Value of the fields query parameter, or None
+                for all fields
+            :returns: generator(dict)
+            """
         endpoint = '/datasets'
         query = {'size': size, 'order': order}
+        if fields:
+            query['fields'] = fields
         url = self._create_url(endpoint)
-        json_response = self._get_json(url, params=query)
-        cont, items = self._response_items(
-            json_response, list(), cont_func)
-        next_url = self._navigation_links(json_response).get('next')
+        if self._prefetch_workers > 1:
+            pages = self._prefetched_pages(url, query)
+        elif self._max_page_size:
+            pages = self._adaptive_pages(url, query)
+        else:
+            pages = self._linked_pages(url, query)
+
+        with contextlib.closing(pages):
+            for page in pages:
+                if isinstance(page, dict):
+                    items = page.get('items', list())
+                else:
+                    items = page
+                # Filters items as _response_items does, without first
+                # reading the whole of a streamed page.
+                cont = True
+                for dataset_json in items:
+                    if cont_func and not cont_func(dataset_json):
+                        cont = False
+                        continue
+                    yield dataset_json
+                if not cont:
+                    return
+
+    def iter_all_datasets(self, size=20, order='-modified', cont_func=None):
+        """ Yields the metadata objects for all datasets a page at a time.
+            Defaults to most recently modified objects first.
+        :returns: generator(PureDataset)
+
+        """
+        items = self._iter_listing_items(size, order, cont_func)
+        with contextlib.closing(items):
+            for dataset_json in items:
+                yield self._to_dataset(dataset_json)
 
-        while next_url and cont:
-            json_response = self._get_json(next_url)
-            cont, items = self._response_items(
-                json_response, items, cont_func)
-            next_url = self._navigation_links(json_response).get('next')
+    def list_all_datasets(self, size=20, order='-modified', cont_func=None):
+        """ List the metadata objects for all datasets.
+            Defaults to most recently modified objects first.
+        :returns: [PureDataset]
 
-        return [self._to_dataset(dataset_json) for dataset_json in items]
+        """
+        return list(self.iter_all_datasets(size, order, cont_func))
 
     def get_dataset(self, uuid):
         """ Get the metadata object for a single dataset.
@@ -160,8 +1038,25 @@ class PureAPI(BasePureAPI):
 
         """
         endpoint = '/datasets/{uuid}'.format(uuid=uuid)
-        dataset_json = self._get_json(self._create_url(endpoint))
-        return self._to_dataset(dataset_json)
+        body = self._get_json_body(self._create_url(endpoint))
+        return self._to_dataset(raw_json=body)
+
+    def iter_changed_datasets(self, since_datetime=None):
+        """ Yields the metadata objects for all datasets that have been
+            modified since the provided datetime, most recently modified
+            first. If no datetime object is provided then will default to
+            yielding all the datasets.
+        :since_datetime: DateTime
+        :returns: generator(PureDataset)
+        """
+        if since_datetime:
+            logger.info('Getting all datasets updated since %s from %s.',
+                        since_datetime, self._endpoint_url)
+            return self.iter_all_datasets(
+                cont_func=self._changed_since(since_datetime))
+        else:
+            logger.info('Getting all datasets from %s.', self._endpoint_url)
+            return self.iter_all_datasets()
 
     def changed_datasets(self, since_datetime=None):
         """ List the metadata objects for all datasets that have been modified
@@ -170,13 +1065,22 @@ class PureAPI(BasePureAPI):
         :since_datetime: DateTime
         :returns: [PureDataset]
         """
-        def changed_since(dataset_json):
-            updated = dataset_json.get('info').get('modifiedDate')
-            return dateutil.parser.parse(updated) > since_datetime
+        return list(self.iter_changed_datasets(since_datetime))
+
+    def changed_dataset_refs(self, since_datetime=None):
+        """ List the uuid and modified datetime of all datasets that have
+            been modified since the provided datetime, least recently
+            modified first, from a listing of only those fields.
+        :since_datetime: DateTime
+        :returns: [(String, DateTime)]
+        """
+        cont_func = None
         if since_datetime:
-            logger.info('Getting all datasets updated since %s from %s.',
-                        since_datetime, self._endpoint_url)
-            return self.list_all_datasets(cont_func=changed_since)
-        else:
-            logger.info('Getting all datasets from %s.', self._endpoint_url)
-            return self.list_all_datasets()
+            cont_func = self._changed_since(since_datetime)
+        items = self._iter_listing_items(
+            cont_func=cont_func,
+            fields=','.join(self.TWO_PHASE_LISTING_FIELDS))
+        with contextlib.closing(items):
+            refs = [self._dataset_ref(dataset_json) for dataset_json in items]
+        refs.sort(key=lambda ref: ref[1])
+        return refs
@@ -0,0 +1,441 @@
+import asyncio
+import concurrent.futures
+import json
+import urllib
+import aiohttp
+import logging
+
+from ..base import (BasePureAPI, CircuitBreaker, DiskBudget, FileCache,
+                    RetryPolicy, TokenBucket)
+from .api import PureAPIMixin
+from .checksum import ChecksumGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPureAPI(PureAPIMixin, BasePureAPI):
+
+    """Asynchronous abstraction over the Pure API v5.9, for use with
+        `async with` from a running event loop."""
+
+    # Transient failures after which an idempotent request is retried.
+    RETRYABLE_EXCEPTIONS = (
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    )
+
+    def __init__(self, endpoint_url, api_key, pool_size=100,
+                 download_pool_size=20, max_concurrent_downloads=20,
+                 timeout=None, chunk_size=1024 * 1024, rate_limit=None,
+                 rate_burst=1, max_attempts=5, max_retry_after=600.0,
+                 circuit_failure_threshold=5,
+                 circuit_reset_seconds=60.0, checksum_workers=None,
+                 checksum_algorithms=('md5', 'sha256'), file_cache_dir=None,
+                 file_cache_max_bytes=10 * 1024 * 1024 * 1024,
+                 scratch_max_bytes=None):
+        """
+        :endpoint_url: The base url of the API endpoint
+        :api_key: The api key provided for authentication
+        :pool_size: Connections held open per host for API requests
+        :download_pool_size: Connections held open per host for document
+            downloads from the Pure portal
+        :max_concurrent_downloads: Document downloads in flight at once
+        :timeout: Seconds to wait to connect to Pure, or for each read of a
+            response, or None to wait indefinitely. A download may take
+            longer in total.
+        :chunk_size: Bytes read from a download stream at a time
+        :rate_limit: Requests per second made to Pure, or None for no limit
+        :rate_burst: Requests that may be made at once under the rate limit
+        :max_attempts: Attempts made at idempotent requests that fail
+            transiently, with jittered exponential back off in between
+        :max_retry_after: Longest Retry-After period that is waited for
+            before retrying, beyond which the request fails
+        :circuit_failure_threshold: Consecutive failed requests after which
+            further requests fail immediately with CircuitOpenError
+        :circuit_reset_seconds: Time before a request is tried again once
+            the circuit has opened
+        :checksum_workers: Documents hashed concurrently when they could not
+            be hashed as they were downloaded, defaults to the number of CPUs
+        :checksum_algorithms: Digests computed of each document in a single
+            read of its bytes. A sha256 digest is always computed.
+        :file_cache_dir: Directory of a persistent cache of downloaded
+            documents, which are revalidated with conditional requests.
+            Disabled if None.
+        :file_cache_max_bytes: Size of the document cache before the least
+            recently used documents are evicted
+        :scratch_max_bytes: Bytes of scratch disk the downloaded documents
+            of datasets may take up at once, reserved from their
+            size once they are written, so a dataset is only failed with
+            DiskBudgetExceededError after its documents have been
+            downloaded. Unlimited if None.
+
+        """
+        self._endpoint_url = endpoint_url
+        self._split_endpoint_url = urllib.parse.urlsplit(endpoint_url)
+        self._api_key = api_key
+        self._pool_size = pool_size
+        self._download_pool_size = download_pool_size
+        self._max_concurrent_downloads = max_concurrent_downloads
+        self._timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=timeout, sock_read=timeout)
+        self._chunk_size = chunk_size
+        self._session = None
+        self._download_session = None
+        self._download_semaphore = None
+        self._rate_limiter = None
+        if rate_limit:
+            self._rate_limiter = TokenBucket(rate_limit, rate_burst)
+        self._retry_policy = RetryPolicy(
+            max_attempts, max_retry_after=max_retry_after)
+        self._circuit_breaker = CircuitBreaker(circuit_failure_threshold,
+                                               circuit_reset_seconds)
+        self.checksum_algorithms = self._checksum_algorithms(
+            checksum_algorithms)
+        self.checksum_generator = ChecksumGenerator(
+            workers=checksum_workers,
+            extra_algorithms=self.checksum_algorithms)
+        self.file_cache = None
+        if file_cache_dir:
+            self.file_cache = FileCache(file_cache_dir, file_cache_max_bytes)
+        self.disk_budget = None
+        if scratch_max_bytes:
+            self.disk_budget = DiskBudget(scratch_max_bytes)
+
+    def __str__(self):
+        return 'Async Pure REST API v5.9: {}'.format(self._endpoint_url)
+
+    async def __aenter__(self):
+        await self._open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _open(self):
+        """ Creates the client sessions, which must be done from within the
+            event loop they are used in, and checks the API is accessible.
+            """
+        if self._session:
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self._pool_size),
+            headers={'api-key': self._api_key, 'Accept': 'application/json'},
+            timeout=self._timeout,
+        )
+        self._download_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=self._download_pool_size),
+            headers={'api-key': self._api_key},
+            timeout=self._timeout,
+        )
+        self._download_semaphore = asyncio.Semaphore(
+            self._max_concurrent_downloads)
+        await self._api_is_accessible()
+
+    async def close(self):
+        """ Closes all connections held by this instance.
+            """
+        if self.file_cache:
+            logger.info('Pure document cache stats: %s',
+                        self.file_cache.stats)
+        if self._session:
+            await self._session.close()
+            await self._download_session.close()
+            self._session = None
+            self._download_session = None
+
+    async def _api_is_accessible(self):
+        """ Checks that the API is accessible and it is possible to
+            authenticate against it.
+            """
+        url = self._create_url('/datasets')
+
+        async def attempt_head():
+            response = await self._send(self._session.head, url)
+            response.release()
+            response.raise_for_status()
+
+        try:
+            await self._with_retries(attempt_head)
+        except aiohttp.ClientError as e:
+            logging.exception('Unable to access Pure API v59 due to: %s', e)
+
+    async def _send(self, send, url, **kwargs):
+        """ Makes a single request through the rate limiter and circuit
+            breaker, raising a ClientResponseError for responses with a
+            status that is worth retrying.
+            :send: Bound request method of a session, e.g. ClientSession.get
+            :returns: aiohttp.ClientResponse
+            """
+        self._circuit_breaker.before_request()
+        if self._rate_limiter:
+            await asyncio.sleep(self._rate_limiter.reserve())
+        try:
+            response = await send(url, **kwargs)
+        except self.RETRYABLE_EXCEPTIONS:
+            self._circuit_breaker.record_failure()
+            raise
+        if response.status >= 500:
+            self._circuit_breaker.record_failure()
+        elif response.status != 429:
+            self._circuit_breaker.record_success()
+        if self._retry_policy.should_retry_status(response.status):
+            response.release()
+            response.raise_for_status()
+        return response
+
+    async def _with_retries(self, attempt_func, retry=True):
+        """ Awaits attempt_func, retrying with back off if it fails with a
+            transient error. Only to be used for idempotent requests.
+            :attempt_func: Coroutine function making a single attempt at a
+                request
+            :retry: Boolean: If False a single attempt is made
+            """
+        max_attempts = self._retry_policy.max_attempts if retry else 1
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return await attempt_func()
+            except aiohttp.ClientResponseError as e:
+                if attempt == max_attempts or \
+                        not self._retry_policy.should_retry_status(e.status):
+                    raise
+                error = e
+                retry_after = (getattr(e, 'headers', None) or {}).get(
+                    'Retry-After')
+            except self.RETRYABLE_EXCEPTIONS as e:
+                if attempt == max_attempts:
+                    raise
+                error = e
+                retry_after = None
+            delay = self._retry_policy.backoff(attempt, retry_after)
+            if delay is None:
+                logger.error('Giving up after attempt %s of %s failed, as '
+                             'Retry-After %s is too long: %s', attempt,
+                             max_attempts, retry_after, error)
+                raise error
+            logger.warning('Retrying in %.2fs after attempt %s of %s '
+                           'failed: %s', delay, attempt, max_attempts, error)
+            await asyncio.sleep(delay)
+
+    async def _get_json(self, url, params=None):
+        """ GET json from url and return json object
+            """
+        return json.loads(
+            (await self._get_json_body(url, params)).decode('utf-8'))
+
+    async def _get_json_body(self, url, params=None):
+        """ GET the body of a json response from url.
+            :returns: bytes
+            """
+        await self._open()
+        logger.info('Getting json response from %s.', url)
+
+        async def attempt_get():
+            response = await self._send(self._session.get, url,
+                                        params=params)
+            try:
+                response.raise_for_status()
+                return await response.read()
+            finally:
+                response.release()
+
+        return await self._with_retries(attempt_get)
+
+    async def download_file(self, url, dest, hasher=None):
+        """ Streams the download of a file to dest, as described by
+            download_file_if_modified.
+            :hasher: StreamHasher updated with each chunk as it is written,
+                or None
+            """
+        await self.download_file_if_modified(url, dest, hasher=hasher)
+        return dest
+
+    async def download_file_if_modified(self, url, dest,
+                                        conditional_headers=None,
+                                        hasher=None):
+        """ Streams the download of a file to dest unless Pure responds Not
+            Modified to the conditional headers, limited to the maximum
+            number of concurrent downloads, downloading it again if the
+            transfer fails or is truncated.
+            :conditional_headers: dict: If-None-Match and If-Modified-Since
+                headers of a previously downloaded copy of the file
+            :hasher: StreamHasher updated with each chunk as it is written,
+                or None
+            :returns: The headers of the download response, or None if the
+                file has not been modified
+            """
+        await self._open()
+
+        async def attempt_download():
+            if hasher:
+                hasher.reset()
+            response = await self._send(self._download_session.get, url,
+                                        headers=conditional_headers)
+            try:
+                response.raise_for_status()
+                if response.status == 304:
+                    return None
+                bytes_received = await self._write_chunks(
+                    response.content.iter_chunked(self._chunk_size), dest,
+                    hasher)
+                if response.content_length is not None and \
+                        bytes_received != response.content_length and \
+                        'Content-Encoding' not in response.headers:
+                    raise aiohttp.ClientPayloadError(
+                        'Received {} of {} bytes from {}'.format(
+                            bytes_received, response.content_length, url))
+            finally:
+                response.release()
+            return response.headers
+
+        async with self._download_semaphore:
+            return await self._with_retries(attempt_download)
+
+    @staticmethod
+    async def _write_chunks(chunks, dest, hasher=None):
+        """ Writes each chunk to dest, and updates the hasher with it, on a
+            writer thread dedicated to the file so that disk writes and
+            hashing never block the event loop. The next chunk is received
+            while the previous one is written.
+            :chunks: async iterable(bytes)
+            :returns: int: The number of bytes written
+            """
+        loop = asyncio.get_event_loop()
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        def write(f, chunk):
+            f.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+
+        bytes_written = 0
+        pending = None
+        try:
+            f = await loop.run_in_executor(writer, open, dest, 'wb')
+            try:
+                async for chunk in chunks:
+                    if pending:
+                        await pending
+                    pending = loop.run_in_executor(writer, write, f, chunk)
+                    bytes_written += len(chunk)
+                if pending:
+                    await pending
+            finally:
+                # Runs after any write still queued on the writer thread.
+                await loop.run_in_executor(writer, f.close)
+        finally:
+            writer.shutdown(wait=False)
+        return bytes_written
+
+    async def download_files(self, url_dest_pairs, hashers=None):
+        """ Downloads many files concurrently.
+            :url_dest_pairs: [(string, string),]
+            :hashers: [StreamHasher]: Updated with the bytes of the file at
+                the same position in url_dest_pairs, or None
+            :returns: [string]
+            """
+        hashers = hashers or [None] * len(url_dest_pairs)
+        return await asyncio.gather(
+            *(self.download_file(url, dest, hasher) for (url, dest), hasher
+              in zip(url_dest_pairs, hashers)))
+
+    async def _iter_listing_items(self, size=20, order='-modified',
+                                  cont_func=None, fields=None):
+        """ Asynchronously iterates over the json of each item of the dataset
+            listing a page at a time, following the next navigation link of
+            each page.
+            :fields: String: Value of the fields query parameter, or None
+                for all fields
+            :returns: async generator(dict)
+            """
+        url = self._create_url('/datasets')
+        params = {'size': size, 'order': order}
+        if fields:
+            params['fields'] = fields
+        while url:
+            json_response = await self._get_json(url, params=params)
+            cont, items = self._response_items(json_response, cont_func)
+            for dataset_json in items:
+                yield dataset_json
+            if not cont:
+                return
+            url = self._navigation_links(json_response).get('next')
+            params = None
+
+    async def iter_all_datasets(self, size=20, order='-modified',
+                                cont_func=None):
+        """ Asynchronously iterates over the metadata objects for all
+            datasets a page at a time, following the next navigation link of
+            each page. Defaults to most recently modified objects first.
+        :returns: async generator(PureDataset)
+
+        """
+        async for dataset_json in self._iter_listing_items(
+                size, order, cont_func):
+            yield self._to_dataset(dataset_json)
+
+    async def changed_dataset_refs(self, since_datetime=None):
+        """ List the uuid and modified datetime of all datasets that have
+            been modified since the provided datetime, least recently
+            modified first, from a listing of only those fields.
+        :since_datetime: DateTime
+        :returns: [(String, DateTime)]
+        """
+        cont_func = None
+        if since_datetime:
+            cont_func = self._changed_since(since_datetime)
+        refs = [self._dataset_ref(dataset_json)
+                async for dataset_json in self._iter_listing_items(
+                    cont_func=cont_func,
+                    fields=','.join(self.TWO_PHASE_LISTING_FIELDS))]
+        refs.sort(key=lambda ref: ref[1])
+        return refs
+
+    async def list_all_datasets(self, size=20, order='-modified',
+                                cont_func=None):
+        """ List the metadata objects for all datasets.
+            Defaults to most recently modified objects first.
+        :returns: [PureDataset]
+
+        """
+        return [dataset async for dataset in
+                self.iter_all_datasets(size, order, cont_func)]
+
+    async def get_dataset(self, uuid):
+        """ Get the metadata object for a single dataset.
+
+        :uuid: String: ID of the dataset
+        :returns: PureDataset
+
+        """
+        endpoint = '/datasets/{uuid}'.format(uuid=uuid)
+        body = await self._get_json_body(self._create_url(endpoint))
+        return self._to_dataset(raw_json=body)
+
+    def iter_changed_datasets(self, since_datetime=None):
+        """ Asynchronously iterates over the metadata objects for all
+            datasets that have been modified since the provided datetime,
+            most recently modified first. If no datetime object is provided
+            then will default to iterating over all the datasets.
+        :since_datetime: DateTime
+        :returns: async generator(PureDataset)
+        """
+        if since_datetime:
+            logger.info('Getting all datasets updated since %s from %s.',
+                        since_datetime, self._endpoint_url)
+            return self.iter_all_datasets(
+                cont_func=self._changed_since(since_datetime))
+        else:
+            logger.info('Getting all datasets from %s.', self._endpoint_url)
+            return self.iter_all_datasets()
+
+    async def changed_datasets(self, since_datetime=None):
+        """ List the metadata objects for all datasets that have been modified
+            since the provided datetime. If no datetime object is provided then
+            will default to listing all the datasets.
+        :since_datetime: DateTime
+        :returns: [PureDataset]
+        """
+        return [dataset async for dataset in
+                self.iter_changed_datasets(since_datetime)]
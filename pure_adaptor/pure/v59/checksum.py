@@ -1,26 +1,71 @@
-import hashlib
+import concurrent.futures
 import os
 import logging
 
+from ..base import StreamHasher
+
 logger = logging.getLogger(__name__)
 
 
 class ChecksumGenerator(object):
 
-    def __init__(self):
-        self.hasher = hashlib.sha256
+    """ Hashes the local files of datasets across a pool of threads, as
+        hashlib releases the GIL while hashing large reads."""
+
+    def __init__(self, algorithm='sha256', workers=None,
+                 buffer_size=8 * 1024 * 1024, use_mmap=True,
+                 extra_algorithms=()):
+        """
+        :algorithm: String: Name of the hashlib algorithm of the checksums
+        :workers: Int: Files hashed concurrently, defaults to the number of
+            CPUs
+        :buffer_size: Int: Bytes hashed at a time
+        :use_mmap: Boolean: Hash memory mapped files rather than copying
+            them into a buffer
+        :extra_algorithms: [String]: Further digests computed in the same
+            read of each file by file_digests
 
-    def _hash_file(self, file_path, buf_size=4096):
-        """ Generates the hash of an individual file.
+        """
+        self.algorithm = algorithm
+        self.algorithms = (algorithm,) + tuple(
+            a for a in extra_algorithms if a != algorithm)
+        self.workers = workers or os.cpu_count() or 1
+        self.buffer_size = buffer_size
+        self.use_mmap = use_mmap
+
+    def _hash_file(self, file_path):
+        """ Generates the hashes of an individual file by every algorithm,
+            in a single read of the file.
             :file_path: String
-            :returns: String
+            :returns: {String: String}
+            """
+        logger.info('Generating %s checksums for %s',
+                    ', '.join(self.algorithms), file_path)
+        hasher = StreamHasher(self.algorithms)
+        hasher.update_from_file(file_path, self.buffer_size, self.use_mmap)
+        return hasher.hexdigests()
+
+    def file_digests(self, file_paths):
+        """ Generates the hashes of many files by every algorithm
+            concurrently.
+            :file_paths: [String]
+            :returns: dict: Digests by algorithm, keyed by file name
+            """
+        if not file_paths:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.workers, len(file_paths))) as executor:
+            path_digests = executor.map(self._hash_file, file_paths)
+            return {os.path.basename(f_path): digests
+                    for f_path, digests in zip(file_paths, path_digests)}
+
+    def hash_files(self, file_paths):
+        """ Generates checksums for many files concurrently.
+            :file_paths: [String]
+            :returns: dict: Checksums keyed by file name
             """
-        file_hasher = self.hasher()
-        logger.debug('Generating checksum for %s', file_path)
-        with open(file_path, 'rb') as f_in:
-            for file_chunk in iter(lambda: f_in.read(buf_size), b''):
-                file_hasher.update(file_chunk)
-        return file_hasher.hexdigest()
+        return {file_name: digests[self.algorithm] for file_name, digests
+                in self.file_digests(file_paths).items()}
 
     def file_checksums(self, dataset):
         """ Generates checksums for every local file in a dataset,
@@ -29,21 +74,14 @@ class ChecksumGenerator(object):
             :dataset: PureDataset
             :returns: dict
             """
-        checksum_dict = {}
         if not dataset.files:
             logger.debug('%s has no associated files to generate checksums'
                          ' for.', dataset)
-            return checksum_dict
+            return {}
 
         if not dataset.local_files:
             logger.error('%s files have not been downloaded prior to checksum'
                          ' generation.', dataset)
-            return checksum_dict
-
-        for f_path in dataset.local_files:
-            logger.info('Generating %s checksum for %s',
-                        self.hasher().name, f_path)
-            path_hash = self._hash_file(f_path)
-            file_name = os.path.basename(f_path)
-            checksum_dict[file_name] = path_hash
-        return checksum_dict
+            return {}
+
+        return self.hash_files(dataset.local_files)
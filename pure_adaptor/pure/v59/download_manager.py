@@ -1,25 +1,40 @@
+import asyncio
+import functools
 import tempfile
 import os
 import logging
 
 from ..base import BasePureDownloadManager
+from ..base import StreamHasher
 
 logger = logging.getLogger(__name__)
 
 
 class PureDownloadManager(BasePureDownloadManager):
 
-    def __init__(self, pure_api):
+    def __init__(self, pure_api, hash_algorithms=('sha256',)):
+        """
+        :pure_api: The PureAPI or AsyncPureAPI client to download through
+        :hash_algorithms: [String]: Digests computed of each file as it
+            is downloaded
+
+        """
         self._pure_api = pure_api
+        self._file_cache = pure_api.file_cache
+        self._disk_budget = pure_api.disk_budget
+        self._hash_algorithms = hash_algorithms
         self._temp_dir = None
 
     @property
     def temp_dir(self):
         """ Initialises a temporary directory to store data files from this
-            dataset.
+            dataset, beside the document cache if there is one.
             """
         if not self._temp_dir:
-            self._temp_dir = tempfile.TemporaryDirectory()
+            if self._file_cache:
+                self._temp_dir = self._file_cache.temp_dir()
+            else:
+                self._temp_dir = tempfile.TemporaryDirectory()
         return self._temp_dir.name
 
     def _document_temp_path(self, file_name):
@@ -27,8 +42,142 @@ class PureDownloadManager(BasePureDownloadManager):
             """
         return os.path.join(self.temp_dir, file_name)
 
+    def _reserve(self, dest):
+        """ A callable reserving scratch disk for a file from its size, or
+            None without a disk budget.
+            """
+        if not self._disk_budget:
+            return None
+        return functools.partial(self._disk_budget.reserve, self, dest)
+
+    def cleanup(self):
+        """ Removes the files downloaded by this manager, releasing the
+            scratch disk reserved for them.
+            """
+        if self._temp_dir:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+        if self._disk_budget:
+            self._disk_budget.release(self)
+
+    def _digests(self, dest, hasher):
+        """ The digests of a downloaded file, or None if it was not hashed
+            in full as it was written.
+            """
+        if hasher.bytes_hashed != os.path.getsize(dest):
+            return None
+        return hasher.hexdigests()
+
     def download_file(self, url, file_name):
+        """ Downloads a file, hashing it as it is written, once there is
+            scratch disk for it within the disk budget.
+            :returns: (String, {String: String}): The path of the file and
+                its digest by each hash algorithm, or None if the file could
+                not be hashed as it was written
+            """
         dest = self._document_temp_path(file_name)
         logger.info('Downloading %s to %s', url, dest)
-        self._pure_api.download_file(url, dest)
-        return dest
+        hasher = StreamHasher(self._hash_algorithms)
+        reserve = self._reserve(dest)
+        if not self._file_cache:
+            self._pure_api.download_file(url, dest, hasher=hasher,
+                                         reserve=reserve)
+            self._reserve_downloaded([(dest, None)])
+            return dest, self._digests(dest, hasher)
+
+        conditional_headers = self._file_cache.conditional_headers(url)
+        while True:
+            download_path = self._file_cache.temp_path()
+            headers = self._pure_api.download_file_if_modified(
+                url, download_path, conditional_headers, hasher, reserve)
+            digests = self._cache_download(url, dest, download_path,
+                                           headers, hasher)
+            if headers is not None:
+                self._reserve_downloaded([(dest, None)])
+            if digests is not False:
+                return dest, digests
+            conditional_headers = {}
+
+    async def _download_file_cached(self, url, dest):
+        """ Downloads a file through an AsyncPureAPI and the document cache.
+            :returns: {String: String} or None
+            """
+        hasher = StreamHasher(self._hash_algorithms)
+        conditional_headers = self._file_cache.conditional_headers(url)
+        while True:
+            download_path = self._file_cache.temp_path()
+            headers = await self._pure_api.download_file_if_modified(
+                url, download_path, conditional_headers, hasher)
+            digests = self._cache_download(url, dest, download_path,
+                                           headers, hasher)
+            if digests is not False:
+                return digests
+            conditional_headers = {}
+
+    def _cache_download(self, url, dest, download_path, headers, hasher):
+        """ Provides dest from the document cache if the file has not been
+            modified, otherwise adds the download to the cache.
+            :headers: Response headers of the download, or None if the file
+                has not been modified since it was cached
+            :returns: The digests of the file, None if the cached digests do
+                not include every hash algorithm, or False if the file must
+                be downloaded again as it is no longer cached
+            """
+        if headers is None:
+            os.remove(download_path)
+            digests = self._file_cache.get(url, dest)
+            if digests is None:
+                return False
+            if not set(self._hash_algorithms) <= set(digests):
+                return None
+            logger.info('Using cached download of %s', url)
+            return digests
+        digests = self._digests(download_path, hasher)
+        if digests is None:
+            hasher.reset()
+            hasher.update_from_file(download_path, use_mmap=True)
+            digests = hasher.hexdigests()
+        self._file_cache.insert(url, download_path, dest, headers, digests)
+        return digests
+
+    async def download_files_async(self, url_name_pairs):
+        """ Downloads many files concurrently through an AsyncPureAPI,
+            hashing each as it is written. The files are counted against the
+            disk budget once downloaded.
+            :url_name_pairs: [(string, string),]
+            :returns: [(string, {string: string}),]
+            """
+        dest_digests = await self._download_files_async(url_name_pairs)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._reserve_downloaded, dest_digests)
+        return dest_digests
+
+    def _reserve_downloaded(self, dest_digests):
+        """ Reserves scratch disk for downloaded files from their size on
+            disk, which replaces any reservation made from an unknown or
+            inaccurate Content-Length.
+            """
+        if not self._disk_budget:
+            return
+        for dest, _ in dest_digests:
+            self._disk_budget.reserve(self, dest, os.path.getsize(dest))
+
+    async def _download_files_async(self, url_name_pairs):
+        """ Downloads many files concurrently, through the document cache if
+            there is one.
+            """
+        url_dest_pairs = [(url, self._document_temp_path(file_name))
+                          for url, file_name in url_name_pairs]
+        for url, dest in url_dest_pairs:
+            logger.info('Downloading %s to %s', url, dest)
+        if self._file_cache:
+            digests = await asyncio.gather(
+                *(self._download_file_cached(url, dest)
+                  for url, dest in url_dest_pairs))
+            return [(dest, file_digests) for (url, dest), file_digests
+                    in zip(url_dest_pairs, digests)]
+        hashers = [StreamHasher(self._hash_algorithms)
+                   for _ in url_dest_pairs]
+        dests = await self._pure_api.download_files(url_dest_pairs, hashers)
+        return [(dest, self._digests(dest, hasher))
+                for dest, hasher in zip(dests, hashers)]
@@ -1,19 +1,26 @@
+import asyncio
+import json
 import os
-import dateutil.parser
 import urllib
 import jmespath
 import logging
 from ..base import BasePureDataset
 from ..base import JSONRemapper
+from ..base import StreamHasher
+from ..base import parse_iso8601
 
 from .download_manager import PureDownloadManager
-from .checksum import ChecksumGenerator
 
 logger = logging.getLogger(__name__)
 
+# The hash algorithm of the checksums of downloaded files.
+CHECKSUM_ALGORITHM = 'sha256'
+# The digests emitted in the fileChecksum of the canonical metadata, by the
+# values of the checksumType enumeration. There is no sha1 checksumType.
+CHECKSUM_TYPES = (('sha256', 2), ('md5', 1))
+
 pure_to_canonical_mapper = JSONRemapper(
     os.path.join(os.path.dirname(__file__), 'research_object_mapping.txt'))
-checksum_generator = ChecksumGenerator()
 
 
 def ws_url_remap(pure_data_url):
@@ -36,20 +43,37 @@ class PureDataset(BasePureDataset):
     """Abstraction around the dataset responses from the Pure API.
         """
 
-    def __init__(self, dataset_json, pure_api_instance=None):
+    def __init__(self, dataset_json=None, pure_api_instance=None,
+                 raw_json=None):
         """ Initialises the dataset with the dataset json object returned
             from the Pure API
+            :param raw_json: bytes: The body of the response the dataset was
+                read from, in place of the dataset json. It is parsed when
+                a field is first read, and archived unchanged as the
+                original metadata.
             """
+        self._pure_api = pure_api_instance
+        self._download_manager = None
         if pure_api_instance:
-            self._download_manager = PureDownloadManager(pure_api_instance)
-        self._dataset_json = dataset_json
+            self._download_manager = PureDownloadManager(
+                pure_api_instance, pure_api_instance.checksum_algorithms)
+        self._parsed_json = dataset_json
+        self._raw_json = raw_json
         self.local_files = []
         self.local_file_checksums = {}
+        self.local_file_digests = {}
         self.file_s3_urls = {}
+        self._modified_date = None
 
     def __str__(self):
         return 'PureDataset: {}'.format(self.uuid)
 
+    @property
+    def _dataset_json(self):
+        if self._parsed_json is None:
+            self._parsed_json = json.loads(self._raw_json.decode('utf-8'))
+        return self._parsed_json
+
     def query_dataset_json(self, query):
         return jmespath.search(query, self._dataset_json)
 
@@ -61,10 +85,13 @@ class PureDataset(BasePureDataset):
         return url, file_name
 
     def _format_checksum(self, file_name):
+        digests = self.local_file_digests.get(file_name, {
+            CHECKSUM_ALGORITHM: self.local_file_checksums.get(file_name)})
         return [{
-            'checksumType': 2,  # sha256
-            'checksumValue': self.local_file_checksums.get(file_name)
-        }]
+            'checksumType': checksum_type,
+            'checksumValue': digests[algorithm]
+        } for algorithm, checksum_type in CHECKSUM_TYPES
+            if algorithm in digests]
 
     def _format_local_data(self, obj_file):
         file_name = file_name_from_url(obj_file['fileIdentifier'])
@@ -103,6 +130,13 @@ class PureDataset(BasePureDataset):
     def original_metadata(self):
         return self._dataset_json
 
+    @property
+    def original_metadata_bytes(self):
+        """ The full dataset record exactly as served by Pure, or None if it
+            was parsed from a listing page.
+            """
+        return self._raw_json
+
     @property
     def rdss_canonical_metadata(self):
         logger.info('Remapping pure dataset %s to canonical metadata.',
@@ -117,16 +151,75 @@ class PureDataset(BasePureDataset):
 
     @property
     def modified_date(self):
-        date_string = self.query_dataset_json('info.modifiedDate')
-        return dateutil.parser.parse(date_string)
+        if self._modified_date is None:
+            date_string = self.query_dataset_json('info.modifiedDate')
+            self._modified_date = parse_iso8601(date_string)
+        return self._modified_date
 
     @property
     def uuid(self):
         return self._dataset_json.get('uuid')
 
+    def _add_local_file(self, file_path, digests):
+        """ Records a downloaded file and the checksum computed as it was
+            written, if it could be hashed as it was written.
+            """
+        self.local_files.append(file_path)
+        if digests:
+            self._add_digests(os.path.basename(file_path), digests)
+
+    def _add_digests(self, file_name, digests):
+        self.local_file_digests[file_name] = digests
+        self.local_file_checksums[file_name] = digests[CHECKSUM_ALGORITHM]
+
+    def _hash_unhashed_files(self):
+        """ Hashes the downloaded files that were not hashed as they were
+            written, concurrently.
+            """
+        unhashed_files = [
+            f_path for f_path in self.local_files
+            if os.path.basename(f_path) not in self.local_file_checksums]
+        if not unhashed_files:
+            return
+        file_digests = self._pure_api.checksum_generator.file_digests(
+            unhashed_files)
+        for file_name, digests in file_digests.items():
+            self._add_digests(file_name, digests)
+
     def download_files(self):
         for url, file_name in self.files:
-            self.local_files.append(
-                self._download_manager.download_file(url, file_name)
-            )
-        self.local_file_checksums = checksum_generator.file_checksums(self)
+            self._add_local_file(
+                *self._download_manager.download_file(url, file_name))
+        self._hash_unhashed_files()
+
+    def stream_files(self, upload_stream):
+        """ Streams each file from Pure to its destination without writing
+            it to disk, hashing it on the way, for datasets bound to a
+            PureAPI.
+            :upload_stream: Callable given the name of a file and an
+                iterator over its bytes, returning the s3 url of the file
+            """
+        for url, file_name in self.files:
+            hasher = StreamHasher(self._pure_api.checksum_algorithms)
+            self.file_s3_urls[file_name] = upload_stream(
+                file_name, self._pure_api.stream_file(url, hasher))
+            self._add_digests(file_name, hasher.hexdigests())
+
+    def remove_local_files(self):
+        """ Removes the downloaded files of the dataset, releasing the
+            scratch disk reserved for them.
+            """
+        if self._download_manager:
+            self._download_manager.cleanup()
+        self.local_files = []
+
+    async def download_files_async(self):
+        """ Downloads all files concurrently, for datasets bound to an
+            AsyncPureAPI.
+            """
+        for file_path, digests in \
+                await self._download_manager.download_files_async(
+                    self.files):
+            self._add_local_file(file_path, digests)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._hash_unhashed_files)
@@ -1,26 +1,64 @@
+import hashlib
+import io
 import pytest
 import urllib
 import datetime
+import json
+import os
+import requests
+import time
+import urllib3
 
 from collections import namedtuple
 
+from urllib3.exceptions import ProtocolError
+
+from ...base import CircuitOpenError, StreamHasher
 from ..api import PureAPI
 
-PureAPIDatasetResponse = namedtuple(
-    'PureAPIDatasetResponse', ['json'])
 
-PureHeadResponse = namedtuple(
-    'PureHeadResponse', ['raise_for_status'])
+class PureAPIResponse(namedtuple(
+        'PureAPIResponse', ['status_code', 'headers', 'content'])):
+    url = 'https://pure_endpoint_url.ac.uk/ws/api/59/'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def close(self):
+        self.__dict__['closed'] = True
+
+    @property
+    def raw(self):
+        """ The body as a file-like object, read once like a real response.
+            """
+        if 'raw' not in self.__dict__:
+            self.__dict__['raw'] = io.BytesIO(self.content)
+        return self.__dict__['raw']
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    @property
+    def ok(self):
+        return self.status_code < 400
 
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
 
-def format_dataset_json(items, next_link=None):
+
+def format_dataset_json(items, count, next_link=None):
     response = {
-        'count': 22,
+        'count': count,
         'items': items
     }
     if next_link:
         response['navigationLink'] = [{'ref': 'next', 'href': next_link}]
-    return lambda: response
+    return PureAPIResponse(200, {}, json.dumps(response).encode('utf-8'))
 
 
 def mock_dataset(modified_datetime):
@@ -45,31 +83,34 @@ def a_month_of_datasets(a_month_of_dates):
 @pytest.fixture(autouse=True)
 def pure_get(monkeypatch, a_month_of_datasets):
 
-    def mock_pure_get(url, *args, **kwargs):
+    def mock_pure_get(session, url, *args, **kwargs):
         parsed_url = urllib.parse.urlsplit(url)
         qs = urllib.parse.parse_qs(parsed_url[3])
-        if qs.get('offset'):
-            items = a_month_of_datasets[20:]
-            return PureAPIDatasetResponse(format_dataset_json(items))
-        else:
-            items = a_month_of_datasets[:20]
-            qs['offset'] = 20
+        qs.update({k: [str(v)]
+                   for k, v in (kwargs.get('params') or {}).items()})
+        offset = int(qs.get('offset', [0])[0])
+        size = int(qs.get('size', [20])[0])
+        count = len(a_month_of_datasets)
+        items = a_month_of_datasets[offset:offset + size]
+        next_url = None
+        if offset + size < count:
+            qs['offset'] = offset + size
             next_url = urllib.parse.urlunsplit((
                 *parsed_url[:3],
                 urllib.parse.urlencode(qs, doseq=True),
                 ''))
-            return PureAPIDatasetResponse(format_dataset_json(items, next_url))
+        return format_dataset_json(items, count, next_url)
 
-    monkeypatch.setattr('requests.get', mock_pure_get)
+    monkeypatch.setattr('requests.Session.get', mock_pure_get)
 
 
 @pytest.fixture(autouse=True)
 def pure_head(monkeypatch):
 
-    def mock_pure_head(url, *args, **kwargs):
-        return PureHeadResponse(lambda: True)
+    def mock_pure_head(session, url, *args, **kwargs):
+        return PureAPIResponse(200, {}, b'')
 
-    monkeypatch.setattr('requests.head', mock_pure_head)
+    monkeypatch.setattr('requests.Session.head', mock_pure_head)
 
 
 class TestPureAPI:
@@ -100,5 +141,590 @@ class TestPureAPI:
         assert len(ten_days) == len(ten_datasets)
         assert len(twenty_two_days) == len(twenty_two_datasets)
 
+    def test_list_all_datasets_prefetched(self, a_month_of_datasets):
+        """ Prefetching pages by offset returns all datasets in the same
+            order as following navigation links.
+            """
+        api = PureAPI(self.endpoint_url, self.api_key, prefetch_workers=3)
+        datasets = api.list_all_datasets(size=7)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+
+    def test_changed_datasets_prefetched_with_since_datetime(
+            self, a_month_of_dates):
+        api = PureAPI(self.endpoint_url, self.api_key, prefetch_workers=3)
+        eleventh_day = a_month_of_dates[10]
+        twenty_third_day = a_month_of_dates[22]
+        assert len(api.changed_datasets(eleventh_day)) == 10
+        assert len(api.changed_datasets(twenty_third_day)) == 22
+
+    def test_changed_datasets_streamed(self, a_month_of_dates,
+                                       a_month_of_datasets):
+        api = PureAPI(self.endpoint_url, self.api_key, stream_json=True)
+        datasets = api.list_all_datasets(size=7)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert len(api.changed_datasets(a_month_of_dates[22])) == 22
+
+    def test_streamed_page_dropped(self, monkeypatch, a_month_of_datasets):
+        """ A streamed page whose connection drops part way through is
+            requested again, without yielding its first items twice.
+            """
+        mock_get = requests.Session.get
+        dropped = []
+
+        class DroppedResponse(PureAPIResponse):
+            def iter_content(self, chunk_size):
+                yield self.content[:len(self.content) // 2]
+                raise requests.exceptions.ChunkedEncodingError('reset')
+
+        def dropping_get(session, url, *args, **kwargs):
+            response = mock_get(session, url, *args, **kwargs)
+            if not dropped:
+                dropped.append(url)
+                return DroppedResponse(*response)
+            return response
+
+        monkeypatch.setattr('requests.Session.get', dropping_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        api = PureAPI(self.endpoint_url, self.api_key, stream_json=True)
+        datasets = api.list_all_datasets(size=20)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert dropped
+
+    def test_changed_dataset_refs(self, a_month_of_dates):
+        """ Changed datasets are listed by uuid and modified date only, least
+            recently modified first.
+            """
+        requested_params = []
+
+        def get_json(url, params=None):
+            requested_params.append(params)
+            return {'items': [
+                {'uuid': str(i), 'info': {'modifiedDate': d.isoformat()}}
+                for i, d in enumerate(a_month_of_dates[:5])]}
+
+        self.api._get_json = get_json
+        refs = self.api.changed_dataset_refs(a_month_of_dates[3])
+        assert refs == [(str(i), a_month_of_dates[i]) for i in (2, 1, 0)]
+        assert requested_params[0]['fields'] == 'uuid,info.modifiedDate'
+
+    def test_iter_changed_datasets(self, a_month_of_dates):
+        """ Datasets are yielded page by page, most recently modified first.
+            """
+        datasets = self.api.iter_changed_datasets(a_month_of_dates[25])
+        first_page = [next(datasets) for _ in range(20)]
+        assert [d.modified_date for d in first_page] == a_month_of_dates[:20]
+        assert len(list(datasets)) == 5
+
+    def test_get_dataset_raw_json(self, monkeypatch):
+        """ A dataset keeps the body it was served in, parsing it only when
+            a field is read.
+            """
+        body = b'{"uuid": "a_uuid",\n "title": "A title"}'
+        monkeypatch.setattr(
+            'requests.Session.get',
+            lambda session, url, **kwargs: PureAPIResponse(200, {}, body))
+        dataset = self.api.get_dataset('a_uuid')
+        assert dataset._parsed_json is None
+        assert dataset.original_metadata_bytes == body
+        assert dataset.uuid == 'a_uuid'
+        assert dataset.original_metadata == json.loads(body.decode())
+
+    def test_checksum_algorithms(self):
+        api = PureAPI(self.endpoint_url, self.api_key,
+                      checksum_algorithms=('md5', 'sha1'))
+        assert api.checksum_algorithms == ('sha256', 'md5', 'sha1')
+        with pytest.raises(ValueError):
+            PureAPI(self.endpoint_url, self.api_key,
+                    checksum_algorithms=('not_a_hash',))
+
+    def test_get_json_not_modified(self, monkeypatch, tmpdir):
+        """ With a response cache, a 304 response reuses the cached body.
+            """
+        responses = [
+            PureAPIResponse(200, {'ETag': '"v1"'}, b'{"count": 1}'),
+            PureAPIResponse(304, {'ETag': '"v1"'}, b''),
+        ]
+        requested_headers = []
+
+        def mock_get(session, url, headers=None, **kwargs):
+            requested_headers.append(headers)
+            return responses.pop(0)
+
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        api = PureAPI(self.endpoint_url, self.api_key,
+                      cache_dir=str(tmpdir))
+        url = api._create_url('/datasets')
+        assert api._get_json(url) == {'count': 1}
+        assert api._get_json(url) == {'count': 1}
+        assert requested_headers == [{}, {'If-None-Match': '"v1"'}]
+        assert api._response_cache.stats['hits'] == 1
+
+    def test_adaptive_page_size(self, monkeypatch, a_month_of_datasets):
+        """ Pages served quickly grow the page size up to the maximum, while
+            still returning every dataset in order.
+            """
+        requested_sizes = []
+        mock_get = requests.Session.get
+
+        def recording_get(session, url, *args, **kwargs):
+            requested_sizes.append(kwargs['params']['size'])
+            return mock_get(session, url, *args, **kwargs)
+
+        monkeypatch.setattr('requests.Session.get', recording_get)
+        api = PureAPI(self.endpoint_url, self.api_key, min_page_size=2,
+                      max_page_size=16)
+        datasets = api.list_all_datasets(size=2)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert requested_sizes == [2, 4, 8, 16]
+
+    def test_adaptive_page_size_back_off(self, monkeypatch,
+                                         a_month_of_datasets):
+        """ A page that times out is requested again at half the size.
+            """
+        requested_sizes = []
+        mock_get = requests.Session.get
+
+        def timing_out_get(session, url, *args, **kwargs):
+            requested_sizes.append(kwargs['params']['size'])
+            if kwargs['params']['size'] > 10:
+                raise requests.exceptions.ReadTimeout()
+            return mock_get(session, url, *args, **kwargs)
+
+        monkeypatch.setattr('requests.Session.get', timing_out_get)
+        api = PureAPI(self.endpoint_url, self.api_key, min_page_size=5,
+                      max_page_size=40, target_page_seconds=0)
+        datasets = api.list_all_datasets(size=20)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert requested_sizes[:3] == [20, 10, 5]
+
+    def test_adaptive_page_size_retries(self, monkeypatch,
+                                        a_month_of_datasets):
+        """ Failures other than a time out, and time outs at the minimum
+            page size, are retried without changing the page size.
+            """
+        requested_sizes = []
+        failures = [requests.exceptions.ConnectionError(),
+                    requests.exceptions.ReadTimeout()]
+        mock_get = requests.Session.get
+
+        def failing_get(session, url, *args, **kwargs):
+            requested_sizes.append(kwargs['params']['size'])
+            if failures:
+                raise failures.pop(0)
+            return mock_get(session, url, *args, **kwargs)
+
+        monkeypatch.setattr('requests.Session.get', failing_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        api = PureAPI(self.endpoint_url, self.api_key, min_page_size=10,
+                      max_page_size=40, target_page_seconds=0)
+        datasets = api.list_all_datasets(size=10)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert requested_sizes[:3] == [10, 10, 10]
+
+    def test_adaptive_page_size_max_bytes(self, monkeypatch,
+                                          a_month_of_datasets):
+        """ The page size shrinks to keep responses within the byte limit.
+            """
+        requested_sizes = []
+        mock_get = requests.Session.get
+
+        def recording_get(session, url, *args, **kwargs):
+            requested_sizes.append(kwargs['params']['size'])
+            return mock_get(session, url, *args, **kwargs)
+
+        monkeypatch.setattr('requests.Session.get', recording_get)
+        page_bytes = len(format_dataset_json(
+            a_month_of_datasets[:8], len(a_month_of_datasets)).content)
+        api = PureAPI(self.endpoint_url, self.api_key, min_page_size=2,
+                      max_page_size=16, max_page_bytes=page_bytes // 2)
+        datasets = api.list_all_datasets(size=8)
+        assert [d.original_metadata for d in datasets] == a_month_of_datasets
+        assert requested_sizes[:2] == [8, 4]
+
+    def test_get_json_retries(self, monkeypatch):
+        """ Requests failing with a transient error are retried.
+            """
+        responses = [
+            requests.exceptions.ConnectionError(),
+            PureAPIResponse(503, {'Retry-After': '0'}, b''),
+            PureAPIResponse(200, {}, b'{"count": 1}'),
+        ]
+
+        def mock_get(session, url, **kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        assert self.api._get_json('https://pure') == {'count': 1}
+        assert not responses
+
+    def test_retried_response_closed(self, monkeypatch):
+        """ The connection of a response that is retried is released.
+            """
+        unavailable = PureAPIResponse(503, {'Retry-After': '0'}, b'')
+        responses = [unavailable, PureAPIResponse(200, {}, b'{}')]
+        monkeypatch.setattr('requests.Session.get',
+                            lambda session, url, **kwargs: responses.pop(0))
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        assert self.api._get_json('https://pure') == {}
+        assert unavailable.__dict__.get('closed')
+
+    def test_retry_after_too_long(self, monkeypatch):
+        responses = [PureAPIResponse(429, {'Retry-After': '3600'}, b'')]
+        monkeypatch.setattr('requests.Session.get',
+                            lambda session, url, **kwargs: responses.pop(0))
+        with pytest.raises(requests.exceptions.HTTPError):
+            self.api._get_json('https://pure')
+        assert not responses
+
+    def test_circuit_breaker(self, monkeypatch):
+        """ Once enough consecutive requests fail, further requests fail
+            immediately without reaching Pure.
+            """
+        attempts = []
+
+        def failing_get(session, url, **kwargs):
+            attempts.append(url)
+            raise requests.exceptions.ConnectionError()
+
+        monkeypatch.setattr('requests.Session.get', failing_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        api = PureAPI(self.endpoint_url, self.api_key, max_attempts=3,
+                      circuit_failure_threshold=3)
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api._get_json('https://pure')
+        with pytest.raises(CircuitOpenError):
+            api._get_json('https://pure')
+        assert len(attempts) == 3
+
+    def test_download_file_truncated(self, monkeypatch, tmpdir):
+        """ A download that ends early is downloaded again.
+            """
+        bodies = [b'trunc', b'complete!']
+
+        def mock_get(session, url, **kwargs):
+            return PureAPIResponse(
+                200, {'Content-Length': '9'}, bodies.pop(0))
+
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        dest = str(tmpdir.join('a_file.txt'))
+        hasher = StreamHasher()
+        self.api.download_file('https://pure/portal/a_file.txt', dest,
+                               hasher=hasher)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == b'complete!'
+        assert hasher.hexdigests() == {
+            'sha256': hashlib.sha256(b'complete!').hexdigest()}
+
+    def test_download_file_connection_reset(self, monkeypatch, tmpdir):
+        """ A connection reset while reading the body of a download is
+            retried like any other dropped connection.
+            """
+        class ResetRaw(object):
+            def readinto(self, buffer):
+                raise ProtocolError('Connection reset by peer')
+
+        responses = [PureAPIResponse(200, {'Content-Length': '9'}, b''),
+                     PureAPIResponse(200, {'Content-Length': '9'},
+                                     b'complete!')]
+        responses[0].__dict__['raw'] = ResetRaw()
+
+        monkeypatch.setattr('requests.Session.get',
+                            lambda session, url, **kwargs: responses.pop(0))
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        dest = str(tmpdir.join('a_file.txt'))
+        self.api.download_file('https://pure/portal/a_file.txt', dest)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == b'complete!'
+
+    def test_download_file_reads_into_buffer(self, monkeypatch, tmpdir):
+        """ The body of a download is read into the buffer from the file
+            urllib3 wraps, without allocating a bytes object per chunk
+            through HTTPResponse.read.
+            """
+        raw = urllib3.HTTPResponse(body=io.BytesIO(b'complete!'),
+                                   preload_content=False)
+
+        def read(*args, **kwargs):
+            raise AssertionError('read copies each chunk')
+
+        raw.read = read
+        response = PureAPIResponse(200, {'Content-Length': '9'}, b'')
+        response.__dict__['raw'] = raw
+        monkeypatch.setattr('requests.Session.get',
+                            lambda session, url, **kwargs: response)
+        api = PureAPI(self.endpoint_url, self.api_key, download_buffer_size=4)
+        dest = str(tmpdir.join('a_file.txt'))
+        hasher = StreamHasher()
+        api.download_file('https://pure/portal/a_file.txt', dest, hasher)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == b'complete!'
+        assert hasher.hexdigests()['sha256'] == \
+            hashlib.sha256(b'complete!').hexdigest()
+
+    def test_download_file_not_modified(self, monkeypatch, tmpdir):
+        """ A conditional download is not written if Pure responds Not
+            Modified.
+            """
+        requested_headers = []
+
+        def mock_get(session, url, headers=None, **kwargs):
+            requested_headers.append(headers)
+            return PureAPIResponse(304, {}, b'')
+
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        dest = str(tmpdir.join('a_file.txt'))
+        assert self.api.download_file_if_modified(
+            'https://pure/portal/a_file.txt', dest,
+            {'If-None-Match': '"v1"'}) is None
+        assert requested_headers == [{'If-None-Match': '"v1"'}]
+        assert not tmpdir.join('a_file.txt').exists()
+
+    def test_download_file_reserved(self, monkeypatch, tmpdir):
+        """ Space for a download is reserved from the Content-Length of a
+            HEAD request before the file is requested.
+            """
+        requested = []
+
+        def mock_head(session, url, **kwargs):
+            requested.append('HEAD')
+            return PureAPIResponse(200, {'Content-Length': '9'}, b'')
+
+        def mock_get(session, url, **kwargs):
+            requested.append('GET')
+            return PureAPIResponse(200, {'Content-Length': '9'},
+                                   b'complete!')
+
+        monkeypatch.setattr('requests.Session.head', mock_head)
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        dest = tmpdir.join('a_file.txt')
+        self.api.download_file(
+            'https://pure/portal/a_file.txt', str(dest),
+            reserve=lambda size: requested.append(size))
+        assert requested == ['HEAD', 9, 'GET']
+        assert dest.read_binary() == b'complete!'
+
+    def mock_dropped_file(self, monkeypatch, content, response_headers):
+        """ Serves a file whose first response drops half way through,
+            recording the headers of each request.
+            """
+        requested = []
+
+        class DroppedResponse(PureAPIResponse):
+            def iter_content(self, chunk_size):
+                yield self.content[:len(self.content) // 2]
+                raise requests.exceptions.ChunkedEncodingError('reset')
+
+        def mock_get(session, url, headers=None, **kwargs):
+            requested.append(headers)
+            if len(requested) == 1:
+                return DroppedResponse(200, {
+                    'Content-Length': str(len(content)),
+                    **response_headers},
+                    content)
+            start = int(headers['Range'][len('bytes='):-1])
+            return PureAPIResponse(206, {}, content[start:])
+
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        return requested
+
+    def test_stream_file_resumed(self, monkeypatch):
+        """ A streamed file that fails part way through is resumed from the
+            bytes already yielded.
+            """
+        content = bytes(range(100))
+        requested = self.mock_dropped_file(monkeypatch, content,
+                                           {'ETag': '"v1"'})
+        hasher = StreamHasher()
+        chunks = self.api.stream_file('https://pure/portal/a_file.dat',
+                                      hasher)
+        assert b''.join(chunks) == content
+        assert requested[1] == {'Range': 'bytes=50-', 'If-Range': '"v1"'}
+        assert hasher.hexdigests()['sha256'] == \
+            hashlib.sha256(content).hexdigest()
+
+    def test_stream_file_without_validator(self, monkeypatch):
+        """ A streamed file without a validator cannot be resumed safely.
+            """
+        self.mock_dropped_file(monkeypatch, bytes(100), {})
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            list(self.api.stream_file('https://pure/portal/a_file.dat'))
+
+    def test_download_file_preallocated(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(
+            'requests.Session.get', lambda session, url, **kwargs:
+            PureAPIResponse(200, {'Content-Length': '9'}, b'complete!'))
+        api = PureAPI(self.endpoint_url, self.api_key,
+                      download_buffer_size=4, preallocate_downloads=True)
+        dest = str(tmpdir.join('a_file.txt'))
+        api.download_file('https://pure/portal/a_file.txt', dest)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == b'complete!'
+
+    def mock_ranged_file(self, monkeypatch, content, headers, fail=(),
+                         head_status=200):
+        """ Serves a file that accepts ranged requests, recording the ranges
+            requested and failing the first request for each range in fail.
+            """
+        requested = []
+        fail = set(fail)
+
+        def mock_head(session, url, **kwargs):
+            return PureAPIResponse(
+                head_status,
+                {'Content-Length': str(len(content)), **headers}, b'')
+
+        def mock_get(session, url, headers=None, **kwargs):
+            byte_range = (headers or {}).get('Range')
+            requested.append(byte_range)
+            if byte_range in fail:
+                fail.remove(byte_range)
+                raise requests.exceptions.ConnectionError('dropped')
+            if byte_range is None:
+                return PureAPIResponse(
+                    200, {'Content-Length': str(len(content))}, content)
+            start, end = map(int, byte_range[len('bytes='):].split('-'))
+            return PureAPIResponse(206, {}, content[start:end + 1])
+
+        monkeypatch.setattr('requests.Session.head', mock_head)
+        monkeypatch.setattr('requests.Session.get', mock_get)
+        return requested
+
+    def test_download_file_segmented(self, monkeypatch, tmpdir):
+        content = bytes(range(100))
+        requested = self.mock_ranged_file(
+            monkeypatch, content, {'Accept-Ranges': 'bytes', 'ETag': '"v1"'})
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                      segment_workers=2,
+                      partial_download_dir=str(tmpdir.join('partial')))
+        dest = str(tmpdir.join('a_file.dat'))
+        hasher = StreamHasher()
+        api.download_file('https://pure/portal/a_file.dat', dest, hasher)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == content
+        assert sorted(requested) == [
+            'bytes=0-29', 'bytes=30-59', 'bytes=60-89', 'bytes=90-99']
+        assert tmpdir.join('partial').listdir() == []
+        assert hasher.hexdigests()['sha256'] == \
+            hashlib.sha256(content).hexdigest()
+
+    def test_partial_downloads_in_file_cache(self, tmpdir):
+        """ Partial downloads default to the document cache, on the same
+            filesystem as the documents downloaded through it.
+            """
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                      file_cache_dir=str(tmpdir))
+        assert os.path.dirname(api._partial_download_path('a_url')) == \
+            str(tmpdir.join('partial'))
+
+    def test_download_file_segmented_not_modified(self, monkeypatch,
+                                                  tmpdir):
+        requested = self.mock_ranged_file(
+            monkeypatch, bytes(100), {'Accept-Ranges': 'bytes'},
+            head_status=304)
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                      partial_download_dir=str(tmpdir.join('partial')))
+        dest = str(tmpdir.join('a_file.dat'))
+        assert api.download_file_if_modified(
+            'https://pure/portal/a_file.dat', dest,
+            {'If-None-Match': '"v1"'}) is None
+        assert requested == []
+
+    def test_download_file_segmented_resumes(self, monkeypatch, tmpdir):
+        """ An interrupted segmented download only fetches the segments
+            that are missing when it is next attempted, by a later run
+            downloading to a different destination.
+            """
+        content = bytes(range(100))
+        requested = self.mock_ranged_file(
+            monkeypatch, content, {'Accept-Ranges': 'bytes', 'ETag': '"v1"'},
+            fail=['bytes=30-59'])
+        partial_dir = tmpdir.join('partial')
+        url = 'https://pure/portal/a_file.dat'
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                      segment_workers=1, max_attempts=1,
+                      partial_download_dir=str(partial_dir))
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api.download_file(url, str(tmpdir.join('first_run.dat')))
+        assert len(partial_dir.listdir()) == 2
+        del requested[:]
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                      segment_workers=1, max_attempts=1,
+                      partial_download_dir=str(partial_dir))
+        dest = str(tmpdir.join('second_run.dat'))
+        hasher = StreamHasher()
+        api.download_file(url, dest, hasher)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == content
+        assert requested == ['bytes=30-59', 'bytes=60-89', 'bytes=90-99']
+        assert hasher.hexdigests()['sha256'] == \
+            hashlib.sha256(content).hexdigest()
+        assert partial_dir.listdir() == []
+
+    def test_stale_partial_downloads_removed(self, tmpdir):
+        partial_dir = tmpdir.mkdir('partial')
+        stale = partial_dir.join('stale.partial')
+        stale.write(b'stale')
+        stale.setmtime(time.time() - 3600)
+        partial_dir.join('recent.partial').write(b'recent')
+        PureAPI(self.endpoint_url, self.api_key, segment_size=30,
+                partial_download_dir=str(partial_dir),
+                partial_download_max_age=60)
+        assert partial_dir.listdir() == [partial_dir.join('recent.partial')]
+
+    def test_download_file_head_rejected(self, monkeypatch, tmpdir):
+        """ A document whose server rejects HEAD requests is streamed.
+            """
+        content = bytes(range(100))
+        requested = self.mock_ranged_file(
+            monkeypatch, content, {'Accept-Ranges': 'bytes'},
+            head_status=405)
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30)
+        dest = str(tmpdir.join('a_file.dat'))
+        api.download_file('https://pure/portal/a_file.dat', dest)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == content
+        assert requested == [None]
+
+    def test_download_file_without_ranges(self, monkeypatch, tmpdir):
+        content = bytes(range(100))
+        requested = self.mock_ranged_file(monkeypatch, content, {})
+        api = PureAPI(self.endpoint_url, self.api_key, segment_size=30)
+        dest = str(tmpdir.join('a_file.dat'))
+        api.download_file('https://pure/portal/a_file.dat', dest)
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == content
+        assert requested == [None]
+
+    def test_session_headers(self):
+        """ The api key and Accept headers are set once on the pooled API
+            session, while the download session only carries the api key.
+            """
+        assert self.api._session.headers['api-key'] == self.api_key
+        assert self.api._session.headers['Accept'] == 'application/json'
+        assert self.api._download_session.headers['api-key'] == self.api_key
+
+    def test_session_pool_size(self):
+        api = PureAPI(self.endpoint_url, self.api_key, pool_size=3,
+                      download_pool_size=2)
+        adapter = api._session.get_adapter(self.endpoint_url)
+        download_adapter = api._download_session.get_adapter(
+            self.endpoint_url)
+        assert adapter._pool_maxsize == 3
+        assert download_adapter._pool_maxsize == 2
+
+    def test_close(self, monkeypatch):
+        closed = []
+        monkeypatch.setattr('requests.Session.close',
+                            lambda session: closed.append(session))
+        with PureAPI(self.endpoint_url, self.api_key) as api:
+            pass
+        assert closed == [api._session, api._download_session]
+
     def teardown(self):
         pass
@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import pytest
+import tempfile
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ...base import StreamHasher
+from ..async_api import AsyncPureAPI
+
+
+@pytest.fixture
+def a_month_of_dates():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [now - datetime.timedelta(a) for a in range(30)]
+
+
+@pytest.fixture
+def pure_app(a_month_of_dates):
+    datasets = [{'uuid': str(i), 'info': {'modifiedDate': d.isoformat()}}
+                for i, d in enumerate(a_month_of_dates)]
+
+    async def list_datasets(request):
+        assert request.headers['api-key'] == 'a_uuid_api_key'
+        offset = int(request.query.get('offset', 0))
+        size = int(request.query.get('size', 20))
+        response = {'count': len(datasets),
+                    'items': datasets[offset:offset + size]}
+        if offset + size < len(datasets):
+            next_url = request.url.update_query(offset=offset + size)
+            response['navigationLink'] = [
+                {'ref': 'next', 'href': str(next_url)}]
+        return web.json_response(response)
+
+    async def get_file(request):
+        return web.Response(body=request.match_info['name'].encode() * 100)
+
+    async def get_slow_file(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(5):
+            await asyncio.sleep(0.1)
+            await response.write(b'slow')
+        await response.write_eof()
+        return response
+
+    async def get_etag_file(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=b'a document', headers={'ETag': '"v1"'})
+
+    app = web.Application()
+    app.router.add_get('/ws/api/59/datasets', list_datasets)
+    app.router.add_get('/portal/files/{name}', get_file)
+    app.router.add_get('/portal/slow_file', get_slow_file)
+    app.router.add_get('/portal/etag_file', get_etag_file)
+    return app
+
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def run_with_api(event_loop, pure_app, api_coroutine, **api_options):
+    """ Serves the mock Pure app and runs a coroutine function against an
+        AsyncPureAPI pointing at it.
+        """
+    async def run():
+        async with TestServer(pure_app) as server:
+            api_url = str(server.make_url('/ws/api/59/'))
+            async with AsyncPureAPI(api_url, 'a_uuid_api_key',
+                                    max_concurrent_downloads=2,
+                                    **api_options) as api:
+                return await api_coroutine(api, server)
+    return event_loop.run_until_complete(run())
+
+
+def test_changed_datasets(event_loop, pure_app, a_month_of_dates):
+    datasets = run_with_api(
+        event_loop, pure_app,
+        lambda api, server: api.changed_datasets())
+    assert [d.modified_date for d in datasets] == a_month_of_dates
+
+
+def test_changed_datasets_with_since_datetime(event_loop, pure_app,
+                                              a_month_of_dates):
+    datasets = run_with_api(
+        event_loop, pure_app,
+        lambda api, server: api.changed_datasets(a_month_of_dates[22]))
+    assert len(datasets) == 22
+
+
+def test_changed_dataset_refs(event_loop, pure_app, a_month_of_dates):
+    refs = run_with_api(
+        event_loop, pure_app,
+        lambda api, server: api.changed_dataset_refs(a_month_of_dates[22]))
+    assert refs == [(str(i), a_month_of_dates[i])
+                    for i in reversed(range(22))]
+
+
+def test_download_files(event_loop, pure_app):
+    temp_dir = tempfile.TemporaryDirectory()
+    names = ['a', 'b', 'c']
+    hashers = [StreamHasher() for _ in names]
+
+    def download(api, server):
+        return api.download_files([
+            (str(server.make_url('/portal/files/' + name)),
+             os.path.join(temp_dir.name, name)) for name in names], hashers)
+
+    dests = run_with_api(event_loop, pure_app, download)
+    for name, dest, hasher in zip(names, dests, hashers):
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == name.encode() * 100
+        assert hasher.hexdigests()['sha256'] == \
+            hashlib.sha256(name.encode() * 100).hexdigest()
+
+
+def test_download_file_if_modified(event_loop, pure_app):
+    temp_dir = tempfile.TemporaryDirectory()
+    dest = os.path.join(temp_dir.name, 'etag_file')
+
+    async def download(api, server):
+        url = str(server.make_url('/portal/etag_file'))
+        headers = await api.download_file_if_modified(url, dest)
+        not_modified = await api.download_file_if_modified(
+            url, dest, {'If-None-Match': headers['ETag']})
+        return headers, not_modified
+
+    headers, not_modified = run_with_api(event_loop, pure_app, download)
+    assert headers['ETag'] == '"v1"'
+    assert not_modified is None
+    with open(dest, 'rb') as f_in:
+        assert f_in.read() == b'a document'
+
+
+def test_chunks_written_off_the_event_loop(event_loop):
+    temp_dir = tempfile.TemporaryDirectory()
+    dest = os.path.join(temp_dir.name, 'chunks')
+    hasher = StreamHasher()
+    update = hasher.update
+    threads = set()
+
+    def recording_update(chunk):
+        threads.add(threading.get_ident())
+        update(chunk)
+
+    hasher.update = recording_update
+
+    async def chunks():
+        for chunk in (b'a' * 10, b'b' * 10, b'c' * 10):
+            yield chunk
+
+    written = event_loop.run_until_complete(
+        AsyncPureAPI._write_chunks(chunks(), dest, hasher))
+    assert written == 30
+    assert threading.get_ident() not in threads
+    with open(dest, 'rb') as f_in:
+        assert f_in.read() == b'a' * 10 + b'b' * 10 + b'c' * 10
+    assert hasher.hexdigests()['sha256'] == \
+        hashlib.sha256(b'a' * 10 + b'b' * 10 + b'c' * 10).hexdigest()
+
+
+def test_timeout_applies_per_read(event_loop, pure_app):
+    """ A download that takes longer than the timeout in total completes as
+        long as each read is within it.
+        """
+    temp_dir = tempfile.TemporaryDirectory()
+    dest = os.path.join(temp_dir.name, 'slow_file')
+
+    def download(api, server):
+        return api.download_file(
+            str(server.make_url('/portal/slow_file')), dest)
+
+    run_with_api(event_loop, pure_app, download, timeout=0.3,
+                 max_attempts=1)
+    with open(dest, 'rb') as f_in:
+        assert f_in.read() == b'slow' * 5
+
+
+def test_supported_options():
+    supported, ignored = AsyncPureAPI.supported_options(
+        {'timeout': 10.0, 'prefetch_workers': 2, 'stream_json': True})
+    assert supported == {'timeout': 10.0}
+    assert ignored == ['prefetch_workers', 'stream_json']
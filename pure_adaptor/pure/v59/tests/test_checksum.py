@@ -1,3 +1,4 @@
+import hashlib
 import pytest
 import os
 
@@ -25,7 +26,29 @@ def test_checksum_dict():
     }
 
 
-def test_file_checksums(test_dataset, test_checksum_dict):
-    checksum_generator = ChecksumGenerator()
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_file_checksums(test_dataset, test_checksum_dict, use_mmap):
+    checksum_generator = ChecksumGenerator(workers=2, buffer_size=16,
+                                           use_mmap=use_mmap)
     checksum_dict = checksum_generator.file_checksums(test_dataset)
     assert test_checksum_dict == checksum_dict
+
+
+def test_file_digests(test_dataset, test_checksum_dict):
+    checksum_generator = ChecksumGenerator(extra_algorithms=('md5', 'sha1'))
+    file_digests = checksum_generator.file_digests(test_dataset.local_files)
+    for f_path in test_dataset.local_files:
+        with open(f_path, 'rb') as f_in:
+            data = f_in.read()
+        digests = file_digests[os.path.basename(f_path)]
+        assert digests == {'sha256': hashlib.sha256(data).hexdigest(),
+                           'md5': hashlib.md5(data).hexdigest(),
+                           'sha1': hashlib.sha1(data).hexdigest()}
+
+
+def test_file_checksums_empty_file(tmpdir):
+    empty_file = str(tmpdir.join('empty.txt'))
+    open(empty_file, 'wb').close()
+    checksum_dict = ChecksumGenerator().file_checksums(
+        MockDataset(['empty.txt'], [empty_file]))
+    assert checksum_dict == {'empty.txt': hashlib.sha256().hexdigest()}
@@ -1,17 +1,22 @@
+import hashlib
 import pytest
 import shutil
 import os
 from collections import namedtuple
 
+from ...base import DiskBudget, FileCache
 from ..download_manager import PureDownloadManager
 
 
 @pytest.fixture
 def mock_pure_api():
-    MockAPI = namedtuple('MockAPI', ['download_file'])
-    return MockAPI(
-        lambda url, dest: shutil.copyfile(url, dest)
-    )
+    MockAPI = namedtuple('MockAPI',
+                         ['download_file', 'file_cache', 'disk_budget'])
+
+    def download_file(url, dest, hasher=None, reserve=None):
+        shutil.copyfile(url, dest)
+        hasher.update_from_file(dest)
+    return MockAPI(download_file, None, None)
 
 
 @pytest.fixture
@@ -25,5 +30,63 @@ def test_download_manager(mock_pure_api, mock_url_name_pairs):
     download_manager = PureDownloadManager(mock_pure_api)
     local_files = [download_manager.download_file(*pair)
                    for pair in mock_url_name_pairs]
-    for f_path in local_files:
+    for f_path, digests in local_files:
         assert os.path.exists(f_path) is True
+        assert list(digests) == ['sha256']
+    assert local_files[0][1]['sha256'] == \
+        '5e477661749669992878fa91c4a1dda5f42870d9aebdf54fba33070f57a318ef'
+
+
+def test_download_manager_cached(tmpdir):
+    """ A document that has not been modified since it was cached is
+        provided from the cache along with its stored digests.
+        """
+    requests = []
+
+    class MockAPI(object):
+        file_cache = FileCache(str(tmpdir.join('cache')))
+        disk_budget = None
+
+        def download_file_if_modified(self, url, dest, conditional_headers,
+                                      hasher=None, reserve=None):
+            requests.append(conditional_headers)
+            if conditional_headers.get('If-None-Match') == '"v1"':
+                return None
+            with open(dest, 'wb') as f_out:
+                f_out.write(b'a document')
+            hasher.update(b'a document')
+            return {'ETag': '"v1"'}
+
+    digests = {'sha256': hashlib.sha256(b'a document').hexdigest()}
+    for _ in range(2):
+        download_manager = PureDownloadManager(MockAPI())
+        dest, file_digests = download_manager.download_file(
+            'https://pure/a_file.txt', 'a_file.txt')
+        with open(dest, 'rb') as f_in:
+            assert f_in.read() == b'a document'
+        assert file_digests == digests
+    assert requests == [{}, {'If-None-Match': '"v1"'}]
+    assert MockAPI.file_cache.stats['hits'] == 1
+
+
+def test_download_manager_cleanup(tmpdir):
+    """ Removing the downloaded files releases the scratch disk reserved
+        for them from their Content-Length.
+        """
+    class MockAPI(object):
+        file_cache = None
+        disk_budget = DiskBudget(100)
+
+        def download_file(self, url, dest, hasher=None, reserve=None):
+            reserve(10)
+            assert self.disk_budget.reserved_bytes == 10
+            with open(dest, 'wb') as f_out:
+                f_out.write(b'a document')
+
+    download_manager = PureDownloadManager(MockAPI())
+    dest, _ = download_manager.download_file('https://pure/a_file.txt',
+                                             'a_file.txt')
+    assert MockAPI.disk_budget.reserved_bytes == 10
+    download_manager.cleanup()
+    assert not os.path.exists(dest)
+    assert MockAPI.disk_budget.reserved_bytes == 0
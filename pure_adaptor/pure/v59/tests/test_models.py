@@ -1,5 +1,8 @@
 import datetime
+import hashlib
+import os
 
+from ..checksum import ChecksumGenerator
 from ..models import PureDataset, ws_url_remap
 
 
@@ -34,6 +37,8 @@ class TestPureDataset():
 
     def test_modified_date(self):
         assert self.pure_dataset.modified_date == self.now
+        assert self.pure_dataset.modified_date is \
+            self.pure_dataset.modified_date
 
     def test_files(self):
         assert self.pure_dataset.files == [
@@ -51,6 +56,82 @@ class TestPureDataset():
         no_doi_pds = PureDataset(no_doi_ds)
         assert no_doi_pds.doi_upload_key == 'no_doi/{}'.format(self.uuid)
 
+    def test_download_files(self):
+        """ Files are hashed as they are downloaded, rather than read back
+            afterwards.
+            """
+        class MockAPI(object):
+            checksum_algorithms = ('sha256', 'md5')
+            file_cache = None
+            disk_budget = None
+
+            def download_file(self, url, dest, hasher=None, reserve=None):
+                with open(dest, 'wb') as f_out:
+                    f_out.write(url.encode())
+                hasher.update(url.encode())
+
+        pure_dataset = PureDataset(self.mock_dataset, MockAPI())
+        pure_dataset.download_files()
+        assert [os.path.basename(p) for p in pure_dataset.local_files] == [
+            n for u, n in self.url_name_pairs]
+        assert pure_dataset.local_file_checksums == {
+            n: hashlib.sha256(ws_url_remap(u).encode()).hexdigest()
+            for u, n in self.url_name_pairs}
+        url, file_name = self.url_name_pairs[0]
+        data = ws_url_remap(url).encode()
+        assert pure_dataset._format_checksum(file_name) == [
+            {'checksumType': 2,
+             'checksumValue': hashlib.sha256(data).hexdigest()},
+            {'checksumType': 1,
+             'checksumValue': hashlib.md5(data).hexdigest()}]
+
+    def test_download_files_unhashed(self):
+        """ Files that were not hashed as they were downloaded are hashed
+            once all the files are downloaded.
+            """
+        class MockAPI(object):
+            checksum_algorithms = ('sha256',)
+            file_cache = None
+            disk_budget = None
+            checksum_generator = ChecksumGenerator(workers=2)
+
+            def download_file(self, url, dest, hasher=None, reserve=None):
+                with open(dest, 'wb') as f_out:
+                    f_out.write(url.encode())
+
+        pure_dataset = PureDataset(self.mock_dataset, MockAPI())
+        pure_dataset.download_files()
+        assert pure_dataset.local_file_checksums == {
+            n: hashlib.sha256(ws_url_remap(u).encode()).hexdigest()
+            for u, n in self.url_name_pairs}
+
+    def test_stream_files(self):
+        class MockAPI(object):
+            checksum_algorithms = ('sha256',)
+            file_cache = None
+            disk_budget = None
+
+            def stream_file(self, url, hasher=None):
+                hasher.update(url.encode())
+                yield url.encode()
+
+        uploaded = {}
+
+        def upload_stream(file_name, chunks):
+            uploaded[file_name] = b''.join(chunks)
+            return 's3://a_bucket/' + file_name
+
+        pure_dataset = PureDataset(self.mock_dataset, MockAPI())
+        pure_dataset.stream_files(upload_stream)
+        assert uploaded == {n: ws_url_remap(u).encode()
+                            for u, n in self.url_name_pairs}
+        assert pure_dataset.local_files == []
+        assert pure_dataset.file_s3_urls == {
+            n: 's3://a_bucket/' + n for u, n in self.url_name_pairs}
+        assert pure_dataset.local_file_checksums == {
+            n: hashlib.sha256(ws_url_remap(u).encode()).hexdigest()
+            for u, n in self.url_name_pairs}
+
     def teardown(self):
         pass
 
@@ -3,6 +3,9 @@ import logging
 import os
 import sys
 
+import boto3
+
+from adaptor.s3_bucket import SUPPORTS_MAX_BANDWIDTH
 from processor import PureAdaptor
 
 logger = logging.getLogger(__name__)
@@ -27,6 +30,31 @@ def all_env_vars_exist(var_names):
     return env_vars
 
 
+def env_flag(value):
+    """ Converts an environment variable to a boolean flag.
+        """
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def env_list(value):
+    """ Converts a comma separated environment variable to a tuple.
+        """
+    return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+def optional_env_vars(prefix, var_types):
+    """ Return those optional environment variables with the given prefix
+        that have been set, converted to the given types and keyed by the
+        lower-cased variable name without the prefix.
+        """
+    env_vars = {}
+    for name, var_type in var_types.items():
+        value = os.environ.get(prefix + name)
+        if value:
+            env_vars[name.lower()] = var_type(value)
+    return env_vars
+
+
 def main():
 
     required_env_variables = (
@@ -40,6 +68,67 @@ def main():
     )
     env_vars = all_env_vars_exist(required_env_variables)
 
+    optional_api_variables = {
+        'POOL_SIZE': int,
+        'DOWNLOAD_POOL_SIZE': int,
+        'PREFETCH_WORKERS': int,
+        'CACHE_DIR': str,
+        'CACHE_MAX_BYTES': int,
+        'TIMEOUT': float,
+        'MIN_PAGE_SIZE': int,
+        'MAX_PAGE_SIZE': int,
+        'TARGET_PAGE_SECONDS': float,
+        'MAX_PAGE_BYTES': int,
+        'RATE_LIMIT': float,
+        'RATE_BURST': int,
+        'MAX_ATTEMPTS': int,
+        'MAX_RETRY_AFTER': float,
+        'CIRCUIT_FAILURE_THRESHOLD': int,
+        'CIRCUIT_RESET_SECONDS': float,
+        'STREAM_JSON': env_flag,
+        'SEGMENT_SIZE': int,
+        'SEGMENT_WORKERS': int,
+        'PARTIAL_DOWNLOAD_DIR': str,
+        'PARTIAL_DOWNLOAD_MAX_AGE': float,
+        'DOWNLOAD_BUFFER_SIZE': int,
+        'PREALLOCATE_DOWNLOADS': env_flag,
+        'CHECKSUM_WORKERS': int,
+        'CHECKSUM_ALGORITHMS': env_list,
+        'FILE_CACHE_DIR': str,
+        'FILE_CACHE_MAX_BYTES': int,
+        'SCRATCH_MAX_BYTES': int,
+    }
+    api_options = optional_env_vars('PURE_API_', optional_api_variables)
+
+    optional_transfer_variables = {
+        'MULTIPART_THRESHOLD': int,
+        'PART_SIZE': int,
+        'MAX_CONCURRENCY': int,
+        'MAX_BANDWIDTH': int,
+    }
+    upload_options = optional_env_vars('S3_UPLOAD_', {
+        **optional_transfer_variables,
+        'MAX_PART_BUFFERS': int,
+        'WORKERS': int,
+        'SKIP_UNCHANGED': env_flag,
+        'JSON_COMPACT': env_flag,
+        'JSON_GZIP': env_flag,
+        'JSON_STREAM': env_flag,
+    })
+    large_file_options = optional_env_vars('S3_UPLOAD_LARGE_FILE_',
+                                           optional_transfer_variables)
+    large_file_bytes = os.environ.get('S3_UPLOAD_LARGE_FILE_BYTES')
+    if large_file_bytes and large_file_options:
+        upload_options['size_classes'] = [
+            (int(large_file_bytes), large_file_options)]
+    if not SUPPORTS_MAX_BANDWIDTH and (
+            'max_bandwidth' in upload_options or
+            'max_bandwidth' in large_file_options):
+        logger.error('S3_UPLOAD_MAX_BANDWIDTH and '
+                     'S3_UPLOAD_LARGE_FILE_MAX_BANDWIDTH are not supported '
+                     'by the installed boto3 %s.', boto3.__version__)
+        sys.exit(2)
+
     try:
         adaptor = PureAdaptor(
             api_version=env_vars['PURE_API_VERSION'],
@@ -49,6 +138,13 @@ def main():
             input_stream=env_vars['RDSS_INTERNAL_INPUT_STREAM'],
             invalid_stream=env_vars['RDSS_MESSAGE_INVALID_STREAM'],
             error_stream=env_vars['RDSS_MESSAGE_ERROR_STREAM'],
+            api_options=api_options,
+            upload_options=upload_options,
+            stream_uploads=env_flag(os.environ.get('STREAM_UPLOADS', '')),
+            dedup_files=env_flag(os.environ.get('DEDUP_FILES', '')),
+            message_batch_size=int(
+                os.environ.get('MESSAGE_BATCH_SIZE') or 0) or None,
+            dataset_prefetch=int(os.environ.get('DATASET_PREFETCH') or 4),
         )
     except Exception:
         logging.exception('Cannot run the Pure Adaptor.')
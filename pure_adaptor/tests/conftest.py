@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The processor is run as a script from the pure_adaptor directory, and so
+# imports the pure and adaptor packages from there.
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,413 @@
+import asyncio
+import boto3
+import datetime
+import dateutil.parser
+import hashlib
+import json
+import moto
+import pytest
+import threading
+
+import processor
+from adaptor.s3_bucket import BucketUploader
+from adaptor.state_storage import DatasetState
+from pure import CircuitOpenError, DiskBudgetExceededError
+from pure.base import BasePureAPI
+
+NOW = datetime.datetime(2017, 5, 16, tzinfo=datetime.timezone.utc)
+DATES = {'uuid_{}'.format(day): NOW - datetime.timedelta(days=day)
+         for day in range(5)}
+
+
+class MockStateStore(object):
+
+    def __init__(self, instance_id):
+        self.latest = None
+        self.file_locations = {}
+        self.dataset_states = {}
+
+    def get_dataset_state(self, uuid):
+        return self.dataset_states.get(uuid, DatasetState({}))
+
+    def put_dataset_state(self, dataset_state):
+        self.dataset_states[dataset_state.uuid] = dataset_state
+
+    def latest_modified_datetime(self):
+        return self.latest
+
+    def get_file_location(self, digest):
+        return self.file_locations.get(digest)
+
+    def put_file_location(self, digest, s3_key):
+        self.file_locations[digest] = s3_key
+
+    def update_latest_modified(self, dataset_state):
+        self.latest = dateutil.parser.parse(
+            dataset_state.json['date_modified'])
+
+
+class MockPureAPI(BasePureAPI):
+
+    def __init__(self, api_url, api_key, timeout=None):
+        self.timeout = timeout
+        self.requested = []
+        self.processed = []
+
+    def changed_dataset_refs(self, since_datetime=None):
+        return sorted(((uuid, date) for uuid, date in DATES.items()
+                       if not since_datetime or date > since_datetime),
+                      key=lambda ref: ref[1])
+
+    def get_dataset(self, uuid):
+        self.requested.append(uuid)
+        return uuid
+
+    def changed_datasets(self, since_datetime=None):
+        pass
+
+    def iter_changed_datasets(self, since_datetime=None):
+        pass
+
+    def list_all_datasets(self):
+        pass
+
+    def iter_all_datasets(self):
+        pass
+
+    def download_file(self, url, dest):
+        pass
+
+
+@pytest.fixture
+def adaptor(monkeypatch):
+    monkeypatch.setattr(processor, 'AdaptorStateStore', MockStateStore)
+    monkeypatch.setattr(processor, 'BucketUploader', lambda *args: None)
+    monkeypatch.setattr(processor, 'KinesisClient', lambda *args: None)
+    pure_interface = processor.versioned_pure_interface('v59')
+    monkeypatch.setattr(processor, 'versioned_pure_interface',
+                        lambda version: pure_interface._replace(
+                            API=MockPureAPI))
+    return processor.PureAdaptor(
+        'v59', 'https://pure/ws/api/59/', 'an_api_key', 'an_instance_id',
+        'input', 'invalid', 'error',
+        api_options={'timeout': 10.0, 'prefetch_workers': 2})
+
+
+def process_failing(failing_uuids, error=RuntimeError):
+    """ A replacement _process_dataset failing for the given uuids.
+        """
+    def process_dataset(adaptor, uuid):
+        adaptor.pure_api.processed.append(uuid)
+        if uuid in failing_uuids:
+            raise error(uuid)
+        return DatasetState({'uuid': uuid,
+                             'date_modified': DATES[uuid].isoformat()})
+    return process_dataset
+
+
+def test_unsupported_api_options_ignored(adaptor):
+    assert adaptor.pure_api.timeout == 10.0
+
+
+def test_processed_least_recently_modified_first(adaptor, monkeypatch):
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_failing([]))
+    adaptor.run()
+    assert adaptor.pure_api.processed == [
+        'uuid_4', 'uuid_3', 'uuid_2', 'uuid_1', 'uuid_0']
+    assert adaptor.state_store.latest == DATES['uuid_0']
+
+
+def test_failure_resumed_by_next_run(adaptor, monkeypatch):
+    """ A dataset failing part way through a run keeps the progress made
+        before it, so the next run resumes from the failed dataset.
+        """
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_failing(['uuid_2']))
+    with pytest.raises(RuntimeError):
+        adaptor.run()
+    assert adaptor.state_store.latest == DATES['uuid_3']
+
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_failing([]))
+    adaptor.pure_api.processed = []
+    adaptor.run()
+    assert adaptor.pure_api.processed == ['uuid_2', 'uuid_1', 'uuid_0']
+    assert adaptor.state_store.latest == DATES['uuid_0']
+
+
+def test_circuit_open_keeps_progress(adaptor, monkeypatch):
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_failing(['uuid_1'], CircuitOpenError))
+    adaptor.run()
+    assert adaptor.pure_api.processed == ['uuid_4', 'uuid_3', 'uuid_2',
+                                          'uuid_1']
+    assert adaptor.state_store.latest == DATES['uuid_2']
+
+
+def test_datasets_prefetched(adaptor, monkeypatch):
+    """ The full records of later datasets are fetched while a dataset is
+        processed.
+        """
+    fetched_ahead = threading.Event()
+    get_dataset = adaptor.pure_api.get_dataset
+
+    def mock_get_dataset(uuid):
+        if uuid == 'uuid_3':
+            fetched_ahead.set()
+        return get_dataset(uuid)
+
+    def process_dataset(adaptor, uuid):
+        if uuid == 'uuid_4':
+            assert fetched_ahead.wait(5)
+        return process_failing([])(adaptor, uuid)
+
+    adaptor.pure_api.get_dataset = mock_get_dataset
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_dataset)
+    adaptor.run()
+    assert adaptor.pure_api.processed == [
+        'uuid_4', 'uuid_3', 'uuid_2', 'uuid_1', 'uuid_0']
+
+
+def test_local_files_removed(adaptor, monkeypatch):
+    """ A dataset's downloaded files are removed once it is published, or
+        if it fails.
+        """
+    class MockDataset(object):
+        removed = False
+
+        def download_files(self):
+            pass
+
+        def remove_local_files(self):
+            self.removed = True
+
+    monkeypatch.setattr(processor.PureAdaptor, '_publish_dataset',
+                        lambda adaptor, dataset: 'a_state')
+    dataset = MockDataset()
+    assert adaptor._process_dataset(dataset) == 'a_state'
+    assert dataset.removed
+
+    def failing_publish(adaptor, dataset):
+        raise RuntimeError()
+
+    monkeypatch.setattr(processor.PureAdaptor, '_publish_dataset',
+                        failing_publish)
+    dataset = MockDataset()
+    with pytest.raises(RuntimeError):
+        adaptor._process_dataset(dataset)
+    assert dataset.removed
+
+
+def test_dataset_over_disk_budget_streamed(adaptor, monkeypatch):
+    """ A dataset whose files would exceed the scratch disk budget is
+        streamed to S3 rather than downloaded.
+        """
+    class MockUploadManager(object):
+        def upload_stream(self, prefix, file_name, chunks):
+            pass
+
+    class MockDataset(object):
+        uuid = 'uuid_0'
+        doi_upload_key = 'a_doi'
+        calls = []
+
+        def download_files(self):
+            self.calls.append('download')
+            raise DiskBudgetExceededError('too big')
+
+        def stream_files(self, upload_stream):
+            self.calls.append('stream')
+
+        def remove_local_files(self):
+            self.calls.append('remove')
+
+    adaptor.upload_manager = MockUploadManager()
+    adaptor.pure_api.stream_file = lambda url, hasher=None: iter([])
+    monkeypatch.setattr(processor.PureAdaptor, '_publish_dataset',
+                        lambda adaptor, dataset: 'a_state')
+    dataset = MockDataset()
+    assert adaptor._process_dataset(dataset) == 'a_state'
+    assert dataset.calls == ['download', 'remove', 'stream', 'remove']
+
+    del adaptor.pure_api.stream_file
+    del dataset.calls[:]
+    with pytest.raises(DiskBudgetExceededError):
+        adaptor._process_dataset(dataset)
+    assert dataset.calls == ['download', 'remove']
+
+
+@moto.mock_s3
+def test_upload_dataset(adaptor, tmpdir):
+    """ The s3 urls of a dataset's files are included in its metadata, which
+        is uploaded alongside the files.
+        """
+    boto3.client('s3').create_bucket(Bucket='a_bucket')
+    adaptor.upload_manager = BucketUploader('a_bucket')
+    file_paths = []
+    for i in range(3):
+        file_path = tmpdir.join('file_{}.txt'.format(i))
+        file_path.write('file {}'.format(i))
+        file_paths.append(str(file_path))
+
+    class MockDataset(object):
+        doi_upload_key = 'a/prefix'
+        local_files = file_paths
+        local_file_digests = {}
+        file_s3_urls = {}
+        original_metadata_bytes = b'{"uuid":  "a_uuid"}'
+
+        @property
+        def rdss_canonical_metadata(self):
+            return {'objectFile': dict(self.file_s3_urls)}
+
+    dataset = MockDataset()
+    adaptor._upload_dataset(dataset)
+    file_s3_urls = {'file_{}.txt'.format(i):
+                    's3://a_bucket/a/prefix/file_{}.txt'.format(i)
+                    for i in range(3)}
+    assert dataset.file_s3_urls == file_s3_urls
+    metadata = boto3.client('s3').get_object(
+        Bucket='a_bucket', Key='a/prefix/metadata.json')['Body'].read()
+    assert json.loads(metadata.decode()) == {'objectFile': file_s3_urls}
+    assert boto3.client('s3').get_object(
+        Bucket='a_bucket', Key='a/prefix/original_purev59_metadata.json'
+    )['Body'].read() == b'{"uuid":  "a_uuid"}'
+    assert boto3.client('s3').get_object(
+        Bucket='a_bucket', Key='a/prefix/file_1.txt')['Body'].read() == \
+        b'file 1'
+
+
+@moto.mock_s3
+def test_upload_dataset_dedup_files(adaptor, tmpdir, monkeypatch):
+    """ A file already uploaded for another dataset is copied within s3.
+        """
+    boto3.client('s3').create_bucket(Bucket='a_bucket')
+    adaptor.upload_manager = BucketUploader('a_bucket')
+    adaptor.dedup_files = True
+    file_path = tmpdir.join('LICENCE.pdf')
+    file_path.write(b'a licence', mode='wb')
+    digest = hashlib.sha256(b'a licence').hexdigest()
+    copied = []
+    copy_file = adaptor.upload_manager.copy_file
+    monkeypatch.setattr(
+        adaptor.upload_manager, 'copy_file',
+        lambda *args: copied.append(args[0]) or copy_file(*args))
+
+    def mock_dataset(doi):
+        class MockDataset(object):
+            doi_upload_key = doi
+            local_files = [str(file_path)]
+            local_file_digests = {'LICENCE.pdf': {'sha256': digest}}
+            file_s3_urls = {}
+            original_metadata_bytes = b'{}'
+            rdss_canonical_metadata = {}
+        return MockDataset()
+
+    adaptor._upload_dataset(mock_dataset('a/first'))
+    adaptor._upload_dataset(mock_dataset('a/first'))
+    assert copied == []
+    assert adaptor.state_store.file_locations == {
+        digest: 'a/first/LICENCE.pdf'}
+
+    adaptor._upload_dataset(mock_dataset('a/second'))
+    assert copied == ['a/first/LICENCE.pdf']
+    assert boto3.client('s3').get_object(
+        Bucket='a_bucket', Key='a/second/LICENCE.pdf')['Body'].read() == \
+        b'a licence'
+
+
+class MockKinesisClient(object):
+
+    def __init__(self):
+        self.buffered = []
+        self.sent = []
+
+    def buffer_record(self, message):
+        self.buffered.append(message)
+
+    def flush(self):
+        self.sent.append(self.buffered)
+        self.buffered = []
+
+
+def test_batched_messages(adaptor, monkeypatch):
+    """ Batched messages are sent before the states of their datasets are
+        stored, including those of an unfinished batch when a run fails.
+        """
+    class MockMessage(object):
+        def __init__(self, instance_id):
+            pass
+
+        def generate(self, metadata):
+            return metadata['uuid']
+
+    class MockDataset(object):
+        def __init__(self, uuid):
+            self.uuid = uuid
+            self.modified_date = DATES[uuid]
+            self.local_file_checksums = {}
+            self.rdss_canonical_metadata = {'uuid': uuid}
+
+        def query_dataset_json(self, query):
+            return 'A title'
+
+    def process_dataset(adaptor, dataset):
+        if dataset.uuid == 'uuid_1':
+            raise RuntimeError()
+        return adaptor._publish_dataset(dataset)
+
+    monkeypatch.setattr(processor, 'MetadataCreate', MockMessage)
+    monkeypatch.setattr(processor.PureAdaptor, '_upload_dataset',
+                        lambda adaptor, dataset: None)
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset',
+                        process_dataset)
+    adaptor.pure_api.get_dataset = MockDataset
+    adaptor.kinesis_client = MockKinesisClient()
+    adaptor.message_batch_size = 2
+    with pytest.raises(RuntimeError):
+        adaptor.run()
+    assert adaptor.kinesis_client.sent == [['uuid_4', 'uuid_3'], ['uuid_2']]
+    assert sorted(adaptor.state_store.dataset_states) == [
+        'uuid_2', 'uuid_3', 'uuid_4']
+    assert adaptor.state_store.latest == DATES['uuid_2']
+
+
+def test_datasets_prefetched_async(adaptor, monkeypatch):
+    """ Datasets from an asynchronous Pure API are processed in order, with
+        later records fetched ahead.
+        """
+    class MockAsyncPureAPI(object):
+        requested = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+        async def changed_dataset_refs(self, since_datetime=None):
+            return MockPureAPI.changed_dataset_refs(self, since_datetime)
+
+        async def get_dataset(self, uuid):
+            self.requested.append(uuid)
+            await asyncio.sleep(0)
+            return uuid
+
+    processed = []
+
+    async def process_dataset(adaptor, uuid):
+        processed.append((uuid, len(adaptor.pure_api.requested)))
+        return DatasetState({'uuid': uuid,
+                             'date_modified': DATES[uuid].isoformat()})
+
+    monkeypatch.setattr(processor.PureAdaptor, '_process_dataset_async',
+                        process_dataset)
+    adaptor.pure_api = MockAsyncPureAPI()
+    adaptor.dataset_prefetch = 2
+    adaptor.run()
+    assert [uuid for uuid, _ in processed] == [
+        'uuid_4', 'uuid_3', 'uuid_2', 'uuid_1', 'uuid_0']
+    assert processed[0][1] == 2
+    assert adaptor.state_store.latest == DATES['uuid_0']